@@ -1,13 +1,456 @@
 import numpy as np
-from music21 import converter, instrument, note, chord, stream
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
+import importlib
 import pickle
 import os
+import json
+import hashlib
+import multiprocessing
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import midi_io
+from pipeline_metrics import PipelineMetrics, timed_stage
+
+
+class _LazyModule:
+    """Module proxy that defers a heavy import until an attribute is first used"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+# TensorFlow and music21 take seconds to import; load them on first use
+tf = _LazyModule('tensorflow')
+keras = _LazyModule('tensorflow.keras')
+layers = _LazyModule('tensorflow.keras.layers')
+converter = _LazyModule('music21.converter')
+instrument = _LazyModule('music21.instrument')
+note = _LazyModule('music21.note')
+chord = _LazyModule('music21.chord')
+stream = _LazyModule('music21.stream')
+midi = _LazyModule('music21.midi')
+
+
+def warm_up():
+    """Import TensorFlow and music21 ahead of time, e.g. from a background thread"""
+    for module in (tf, keras, layers, converter, instrument, note, chord, stream, midi):
+        module.load()
+
+DATASET_FORMAT_VERSION = 1
+MODEL_BUNDLE_VERSION = 1
+INFERENCE_EXPORT_VERSION = 1
+BUNDLE_SEED_WINDOWS = 16
+
+# Architectures selectable with model.preset in config.json
+MODEL_PRESETS = {
+    'large': {'lstm_units': 256, 'num_layers': 3, 'dropout': 0.3, 'dense_units': 256},
+    'medium': {'lstm_units': 128, 'num_layers': 2, 'dropout': 0.2, 'dense_units': 128},
+    'small': {'lstm_units': 64, 'num_layers': 1, 'dropout': 0.1, 'dense_units': 64},
+}
+PRECISION_POLICIES = ('float32', 'mixed_float16', 'mixed_bfloat16')
+# 'scalar' feeds each token as note_to_int / input_scale (the vocabulary size the model was
+# first trained with); 'embedding' feeds token ids to an Embedding layer
+INPUT_ENCODINGS = ('scalar', 'embedding')
+DISTRIBUTION_STRATEGIES = ('default', 'mirrored', 'multi_worker')
+# 'notes' tokens are pitch/chord names; 'events' are packed midi_io event codes with durations and time shifts
+TOKEN_SCHEMES = ('notes', 'events')
+
+
+def load_config(config_path='config.json'):
+    """Load the JSON configuration, or an empty config if the file is missing"""
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+
+def model_settings(model_config, preset=None):
+    """Resolve the architecture, precision and XLA options of the model config
+
+    model.preset supplies lstm_units, num_layers, dropout and dense_units,
+    and any of those keys set in the config override it; the 'large'
+    preset (the original architecture) fills the gaps when there is none.
+    A preset passed as an argument is used as is.
+
+    The LSTMs keep Keras' default activations and no recurrent dropout so
+    they stay eligible for the fused cuDNN kernel. precision selects a
+    mixed float16/bfloat16 policy (the softmax output stays float32),
+    jit_compile compiles the train step with XLA and input_encoding
+    'embedding' puts an Embedding layer of embedding_dim in front of the
+    LSTMs.
+    """
+    explicit = preset is not None
+    preset = preset or model_config.get('preset')
+    if preset is not None and preset not in MODEL_PRESETS:
+        raise ValueError(f"Unknown model preset {preset!r}; expected one of {sorted(MODEL_PRESETS)}.")
+    settings = dict(MODEL_PRESETS[preset or 'large'])
+    if not explicit:
+        settings.update({key: model_config[key] for key in settings if key in model_config})
+    settings['precision'] = model_config.get('precision', 'float32')
+    if settings['precision'] not in PRECISION_POLICIES:
+        raise ValueError(f"Unknown precision {settings['precision']!r}; expected one of {PRECISION_POLICIES}.")
+    settings['jit_compile'] = bool(model_config.get('jit_compile', False))
+    settings['input_encoding'] = model_config.get('input_encoding', 'scalar')
+    if settings['input_encoding'] not in INPUT_ENCODINGS:
+        raise ValueError(f"Unknown input encoding {settings['input_encoding']!r}; expected one of {INPUT_ENCODINGS}.")
+    settings['embedding_dim'] = model_config.get('embedding_dim', 32)
+    if settings['num_layers'] < 1:
+        raise ValueError("The model needs at least one LSTM layer.")
+    return settings
+
+
+def configure_threads(intra_op_threads=0, inter_op_threads=0):
+    """Size TensorFlow's intra-/inter-op thread pools; 0 keeps TensorFlow's default
+
+    This only works before TensorFlow runs its first op; returns False if
+    it was too late. Worker processes can use the TF_NUM_INTRAOP_THREADS
+    and TF_NUM_INTEROP_THREADS environment variables instead.
+    """
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError:
+        return False
+    return True
+
+
+def make_strategy(distribution_config):
+    """Create the tf.distribute strategy named by training.distribution.strategy
+
+    'multi_worker' reads the cluster from the TF_CONFIG environment
+    variable, as set by distributed_training.launch_local_workers.
+    MusicAI.train takes a per-replica batch_size: with
+    training.distribution.scale_batch_size (the default) the global batch
+    is batch_size * replicas. Multi-worker training always streams from
+    make_dataset, shuffled identically on every worker with training.seed,
+    so each worker reads its own shard.
+    """
+    name = distribution_config.get('strategy', 'default')
+    if name not in DISTRIBUTION_STRATEGIES:
+        raise ValueError(f"Unknown distribution strategy {name!r}; expected one of {DISTRIBUTION_STRATEGIES}.")
+    if not configure_threads(distribution_config.get('intra_op_threads', 0),
+                             distribution_config.get('inter_op_threads', 0)):
+        print("TensorFlow is already running; thread settings were not applied.")
+    if name == 'mirrored':
+        return tf.distribute.MirroredStrategy()
+    if name == 'multi_worker':
+        # Ring all-reduce works on CPU-only hosts
+        options = tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING)
+        return tf.distribute.MultiWorkerMirroredStrategy(communication_options=options)
+    return tf.distribute.get_strategy()
+
+
+def list_midi_files(midi_folder):
+    """List MIDI files in a folder, in the order they are ingested"""
+    return [
+        os.path.join(midi_folder, file) for file in os.listdir(midi_folder)
+        if file.endswith('.mid') or file.endswith('.midi')
+    ]
+
+
+def parse_midi_notes(path, fast=False):
+    """Parse a single MIDI file into its list of note/chord tokens
+
+    fast=True scans the track events with midi_io.read_midi_notes and only
+    falls back to a full music21 parse for files it cannot reproduce.
+    """
+    if fast:
+        try:
+            return midi_io.read_midi_notes(path)
+        except midi_io.UnsupportedMidiError:
+            pass
+
+    notes = []
+    score = converter.parse(path)
+    notes_to_parse = score.flatten().notes
+
+    for element in notes_to_parse:
+        if isinstance(element, note.Note):
+            notes.append(str(element.pitch))
+        elif isinstance(element, chord.Chord):
+            notes.append('.'.join(str(n) for n in element.normalOrder))
+    return notes
+
+
+def parse_midi_events(path, fast=False):
+    """Parse a single MIDI file into packed event codes (see midi_io.events_from_elements)
+
+    fast=True reads the track events with midi_io.read_midi_events and only
+    falls back to music21 for files it cannot reproduce. Tied notes are
+    merged so each note keeps its full duration.
+    """
+    if fast:
+        try:
+            return midi_io.read_midi_events(path)
+        except midi_io.UnsupportedMidiError:
+            pass
+
+    elements = []
+    tied = {}
+    score = converter.parse(path).stripTies()
+    for element in score.flatten().notes:
+        if isinstance(element, note.Note):
+            pitches = [element.pitch.midi]
+        elif isinstance(element, chord.Chord):
+            pitches = [p.midi for p in element.pitches]
+        else:
+            continue
+        # stripTies leaves chords tied across barlines split; merge them here
+        tie = element.tie.type if element.tie is not None else None
+        key = tuple(pitches)
+        if tie in ('stop', 'continue') and key in tied:
+            index = tied[key]
+            offset = elements[index][0]
+            elements[index] = (offset, float(element.offset) + float(element.quarterLength) - offset, pitches)
+            if tie == 'stop':
+                del tied[key]
+            continue
+        if tie == 'start':
+            tied[key] = len(elements)
+        elements.append((float(element.offset), float(element.quarterLength), pitches))
+    return midi_io.events_from_elements(elements)
+
+
+def _parse_midi_notes_safe(path, fast=False, events=False):
+    """Worker entry point: parse a file, returning (notes, error) instead of raising"""
+    try:
+        if events:
+            return parse_midi_events(path, fast).tolist(), None
+        return parse_midi_notes(path, fast), None
+    except Exception as e:
+        return None, str(e)
+
+
+def encode_notes(notes, note_to_int, dtype=np.int32):
+    """Map note tokens to a compact integer array"""
+    return np.fromiter((note_to_int[n] for n in notes), dtype=dtype, count=len(notes))
+
+
+def transposed_vocabulary(tokens, transpositions):
+    """The tokens plus every transposition of them by the given semitone shifts"""
+    vocabulary = set(tokens)
+    for semitones in transpositions:
+        for token in tokens:
+            transposed = midi_io.transpose_token(token, semitones)
+            if transposed is not None:
+                vocabulary.add(transposed)
+    return vocabulary
+
+
+def nearest_token(token, candidates, max_chord_distance=2):
+    """The candidate closest to a token, or None if none is close enough
+
+    Chords go to the chord differing in the fewest pitch classes (at most
+    max_chord_distance added or dropped), notes to the same pitch class in
+    the nearest octave and time shifts to the nearest shift. Event tokens
+    only match tokens of the same duration. Ties go to the earlier
+    candidate.
+    """
+    signature = midi_io.token_signature(token)
+    if signature is None:
+        return None
+    kind, duration, pitch_classes, pitch = signature
+    best, best_distance = None, None
+    for candidate in candidates:
+        other = midi_io.token_signature(candidate)
+        if other is None or other[0] != kind:
+            continue
+        if kind == 'shift':
+            distance = abs(other[1] - duration)
+        elif other[1] != duration:
+            continue
+        elif kind == 'chord':
+            distance = len(pitch_classes ^ other[2])
+            if distance > max_chord_distance:
+                continue
+        elif other[2] != pitch_classes:
+            continue
+        else:
+            distance = abs(other[3] - pitch)
+        if best_distance is None or distance < best_distance:
+            best, best_distance = candidate, distance
+    return best
+
+
+def build_vocabulary(counts, min_count=1, max_size=None, max_chord_distance=2, known=()):
+    """Prune a {token: count} mapping into a vocabulary
+
+    Keeps the tokens seen at least min_count times, and at most the
+    max_size most frequent of them (plus the unknown token, if used).
+    Every pruned token is replaced by its nearest kept token (see
+    nearest_token) or by midi_io.UNKNOWN_TOKEN. known tokens (an existing
+    vocabulary being extended) are always kept, come first and count
+    toward max_size. MusicAI reads min_count, max_size and
+    max_chord_distance from the 'vocabulary' config section and keeps the
+    statistics in `vocabulary_stats`.
+    Returns (vocabulary, {pruned token: replacement}, coverage statistics).
+    """
+    known = list(known)
+    known_tokens = set(known)
+    ranked = sorted(counts, key=lambda token: (-counts[token], token))
+    new = [token for token in ranked if token not in known_tokens]
+    kept = [token for token in new if counts[token] >= min_count]
+    if max_size is not None:
+        kept = kept[:max(0, max_size - len(known))]
+    kept_tokens = set(kept)
+    replacements = {}
+    for token in new:
+        if token not in kept_tokens:
+            replacements[token] = (nearest_token(token, known + kept, max_chord_distance)
+                                   or midi_io.UNKNOWN_TOKEN)
+
+    total = sum(counts.values())
+    unknown = sum(counts[token] for token, target in replacements.items() if target == midi_io.UNKNOWN_TOKEN)
+    mapped = sum(counts[token] for token in replacements) - unknown
+    vocabulary = known + kept
+    if unknown and midi_io.UNKNOWN_TOKEN not in known_tokens:
+        vocabulary.append(midi_io.UNKNOWN_TOKEN)
+    stats = {
+        'tokens': total,
+        'distinct_tokens': len(counts),
+        'vocabulary_size': len(vocabulary),
+        'pruned_tokens': len(replacements),
+        # Fractions of the corpus kept as is, mapped to a neighbour and lost to the unknown token
+        'coverage': (total - mapped - unknown) / total if total else 1.0,
+        'mapped_fraction': mapped / total if total else 0.0,
+        'unknown_fraction': unknown / total if total else 0.0,
+    }
+    return vocabulary, replacements, stats
+
+
+def transposition_table(pitchnames, transpositions):
+    """Lookup table mapping token ids to transposed token ids, one row per shift
+
+    Row r holds the id of each vocabulary token transposed by
+    transpositions[r]; tokens whose transposition is not in the vocabulary
+    (microtones, notes leaving the MIDI range) map to themselves. A whole
+    batch of windows is then transposed with one fancy-indexing gather,
+    table[rows[:, None], windows], which is how make_dataset augments
+    training windows on the fly instead of storing a copy of the corpus
+    per key.
+    """
+    note_to_int = {name: number for number, name in enumerate(pitchnames)}
+    table = np.tile(np.arange(len(pitchnames), dtype=np.int32), (len(transpositions), 1))
+    for row, semitones in enumerate(transpositions):
+        if semitones == 0:
+            continue
+        for number, name in enumerate(pitchnames):
+            transposed = midi_io.transpose_token(name, semitones)
+            table[row, number] = note_to_int.get(transposed, number)
+    return table
+
+
+def sliding_windows(values, sequence_length):
+    """Return every length-`sequence_length` window of a 1-D array as a strided view
+
+    Row i is values[i:i + sequence_length]; no window is copied. The last
+    element is never the start of a full input window because it is only
+    ever a prediction target.
+    """
+    return np.lib.stride_tricks.sliding_window_view(values[:-1], sequence_length)
+
+
+def sample_tokens(probabilities, temperature=1.0, top_k=0, top_p=1.0, rng=None):
+    """Draw one token per row of a (batch, n_vocab) probability matrix
+
+    temperature <= 0 is greedy argmax. Otherwise probabilities are
+    sharpened or flattened by the temperature, restricted to the top_k
+    most likely tokens (0 disables) and then to the smallest set whose
+    mass reaches top_p, and sampled by inverse CDF with one uniform draw
+    per row from the given numpy Generator.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if temperature <= 0:
+        return probabilities.argmax(axis=-1)
+    if rng is None:
+        rng = np.random.default_rng()
+    n_vocab = probabilities.shape[-1]
+
+    logits = np.log(np.maximum(probabilities, 1e-12)) / temperature
+    if 0 < top_k < n_vocab:
+        kth = np.partition(logits, -top_k, axis=-1)[:, -top_k, np.newaxis]
+        logits = np.where(logits < kth, -np.inf, logits)
+    weights = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    weights /= weights.sum(axis=-1, keepdims=True)
+
+    if top_p < 1.0:
+        order = np.argsort(-weights, axis=-1)
+        sorted_weights = np.take_along_axis(weights, order, axis=-1)
+        # Keep each token whose preceding mass is still below top_p; the top one always survives
+        keep_sorted = np.cumsum(sorted_weights, axis=-1) - sorted_weights < top_p
+        keep = np.empty_like(keep_sorted)
+        np.put_along_axis(keep, order, keep_sorted, axis=-1)
+        weights = np.where(keep, weights, 0.0)
+
+    cdf = np.cumsum(weights, axis=-1)
+    draws = rng.random((len(cdf), 1)) * cdf[:, -1:]
+    return np.minimum((cdf <= draws).sum(axis=-1), n_vocab - 1)
+
+
+def make_sampler(generation_config, temperature=None, top_k=None, top_p=None, seed=None):
+    """Return a function picking tokens from probabilities, defaulting to generation_config"""
+    if temperature is None:
+        temperature = generation_config.get('temperature', 0.0)
+    if top_k is None:
+        top_k = generation_config.get('top_k', 0)
+    if top_p is None:
+        top_p = generation_config.get('top_p', 1.0)
+    rng = np.random.default_rng(seed)
+    return lambda probabilities: sample_tokens(probabilities, temperature, top_k, top_p, rng)
+
+
+class NoteCache:
+    """On-disk cache of extracted tokens, keyed by file path, mtime and size"""
+
+    def __init__(self, cache_dir='cache/notes'):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, path):
+        digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    @staticmethod
+    def _signature(path):
+        st = os.stat(path)
+        return [os.path.abspath(path), st.st_mtime_ns, st.st_size]
+
+    def get(self, path):
+        """Return cached tokens for an unchanged file, or None"""
+        try:
+            with open(self._entry_path(path), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != self._signature(path):
+            return None
+        return entry['notes']
+
+    def put(self, path, notes):
+        """Store tokens for a file, replacing any stale entry"""
+        entry_path = self._entry_path(path)
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': self._signature(path), 'notes': notes}, f)
+        os.replace(tmp_path, entry_path)
+
 
 class MusicAI:
-    def __init__(self):
+    def __init__(self, config=None):
+        self.config = load_config() if config is None else config
         self.notes = []
         self.model = None
         self.network_input = []
@@ -15,30 +458,70 @@ class MusicAI:
         self.n_vocab = 0
         self.note_to_int = {}
         self.int_to_note = {}
+        self.encoded_notes = np.zeros(0, dtype=np.int32)
+        self.sparse_labels = False
+        self.input_encoding = self.config.get('model', {}).get('input_encoding', 'scalar')
+        # Divisor of scalar inputs, fixed when update_corpus grows the vocabulary (0: n_vocab)
+        self.input_scale = 0
+        self.sequence_length = 0
+        self.note_sources = []
+        self.seed_windows = np.zeros((0, 0), dtype=np.int64)
+        self.strategy = None
+        self.token_scheme = self.config.get('model', {}).get('token_scheme', 'notes')
+        if self.token_scheme not in TOKEN_SCHEMES:
+            raise ValueError(f"Unknown token scheme {self.token_scheme!r}; expected one of {TOKEN_SCHEMES}.")
+        self.events = np.zeros(0, dtype=np.int32)
+        self.transpositions = []
+        self.transpose_table = None
+        self.vocabulary_stats = None
+        self.window_start = 0
+        # Compiled generation steps of `self._step_model_owner`, keyed by (stateful, batch size)
+        self._step_functions = {}
+        self._step_model_owner = None
+        self.metrics = PipelineMetrics.from_config(self.config.get('profiling', {}))
         
-    def extract_notes_from_midi(self, midi_folder='output'):
-        """Extract notes from MIDI files"""
+    @timed_stage('extract')
+    def extract_notes_from_midi(self, midi_folder='output', workers=1, cache_dir=None,
+                                fast_reader=False):
+        """Extract notes from MIDI files
+
+        workers > 1 parses files in a process pool (None uses every core);
+        cache_dir keeps each file's tokens on disk so unchanged files are
+        skipped on later runs. Files are always concatenated in listing
+        order, so the result matches the serial path exactly. fast_reader
+        reads MIDI events directly, keeping music21 as the fallback.
+        """
+        events = self.token_scheme == 'events'
         self.notes = []
+        self.events = np.zeros(0, dtype=np.int32)
+        self.note_sources = []
         
         # If no MIDI files exist, create sample data
         if not os.path.exists(midi_folder) or len(os.listdir(midi_folder)) == 0:
             print("No MIDI files found. Creating sample data...")
-            self.create_sample_training_data()
-            return self.notes
-            
-        for file in os.listdir(midi_folder):
-            if file.endswith('.mid') or file.endswith('.midi'):
-                try:
-                    midi = converter.parse(os.path.join(midi_folder, file))
-                    notes_to_parse = midi.flatten().notes
-                    
-                    for element in notes_to_parse:
-                        if isinstance(element, note.Note):
-                            self.notes.append(str(element.pitch))
-                        elif isinstance(element, chord.Chord):
-                            self.notes.append('.'.join(str(n) for n in element.normalOrder))
-                except Exception as e:
-                    print(f"Error parsing {file}: {e}")
+            return self.create_sample_training_data()
+
+        paths = list_midi_files(midi_folder)
+        results = self._parse_files(paths, workers, cache_dir, fast_reader)
+
+        if events:
+            offset = 0
+            for path, codes in zip(paths, results):
+                if codes:
+                    self.note_sources.append((path, offset))
+                    offset += len(codes)
+            self.events = np.array([code for codes in results if codes for code in codes], dtype=np.int32)
+            self.metrics.count('notes_extracted', len(self.events))
+            if len(self.events) == 0:
+                return self.create_sample_training_data()
+            return self.events
+
+        for path, notes in zip(paths, results):
+            if notes:
+                self.note_sources.append((path, len(self.notes)))
+                self.notes.extend(notes)
+        
+        self.metrics.count('notes_extracted', len(self.notes))
         
         # If still no notes, create sample data
         if len(self.notes) == 0:
@@ -46,6 +529,112 @@ class MusicAI:
             
         return self.notes
     
+    def _parse_files(self, paths, workers=1, cache_dir=None, fast_reader=False):
+        """Parse MIDI files into per-file token lists (None for files that failed)
+
+        Options are as for extract_notes_from_midi; event codes are parsed
+        instead of note tokens under the 'events' token scheme.
+        """
+        events = self.token_scheme == 'events'
+        if cache_dir and events:
+            cache_dir = os.path.join(cache_dir, 'events')
+        cache = NoteCache(cache_dir) if cache_dir else None
+        results = [cache.get(path) if cache else None for path in paths]
+        pending = [i for i, notes in enumerate(results) if notes is None]
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and len(pending) > 1:
+            # Spawned, not forked: this process may already be running TensorFlow
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending)),
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                parsed = list(pool.map(_parse_midi_notes_safe, [paths[i] for i in pending],
+                                       [fast_reader] * len(pending), [events] * len(pending)))
+        else:
+            parsed = [_parse_midi_notes_safe(paths[i], fast_reader, events) for i in pending]
+
+        self.metrics.count('files_cached', len(paths) - len(pending))
+        for i, (notes, error) in zip(pending, parsed):
+            if error is not None:
+                print(f"Error parsing {os.path.basename(paths[i])}: {error}")
+                self.metrics.count('files_failed')
+                continue
+            self.metrics.count('files_parsed')
+            results[i] = notes
+            if cache:
+                cache.put(paths[i], notes)
+        return results
+
+    @timed_stage('extract')
+    def update_corpus(self, midi_folder='output', workers=1, cache_dir=None, fast_reader=False):
+        """Ingest only the MIDI files that are not in the corpus yet
+
+        Files are new when their path is not in `self.note_sources`. Their
+        tokens are appended to `self.encoded_notes`; tokens missing from
+        the vocabulary are appended to it (pruned as in prepare_sequences,
+        with their transpositions when augmenting), so existing token ids,
+        and the trained weights that depend on them, stay valid. Scalar
+        inputs keep dividing by `self.input_scale`, the original vocabulary
+        size, so old tokens are fed to the model unchanged.
+        `self.vocabulary_stats` then describes the new files. A model loaded
+        without its dataset still knows its source files from the bundle.
+        Options are as for extract_notes_from_midi. Returns the number of
+        new tokens.
+        """
+        if self.n_vocab == 0:
+            raise ValueError("No vocabulary found. Prepare sequences or load a model first.")
+        events = self.token_scheme == 'events'
+        known_files = {os.path.abspath(path) for path, _ in self.note_sources}
+        paths = [path for path in list_midi_files(midi_folder)
+                 if os.path.abspath(path) not in known_files] if os.path.isdir(midi_folder) else []
+        results = self._parse_files(paths, workers, cache_dir, fast_reader)
+
+        offset = len(self.encoded_notes)
+        tokens = []
+        new_sources = []
+        for path, file_tokens in zip(paths, results):
+            if file_tokens:
+                new_sources.append((path, offset + len(tokens)))
+                if events:
+                    file_tokens = [midi_io.event_label(code) for code in file_tokens]
+                tokens.extend(file_tokens)
+        self.metrics.count('notes_extracted', len(tokens))
+        if not tokens:
+            return 0
+
+        vocabulary_config = self.config.get('vocabulary', {})
+        pitchnames = [self.int_to_note[i] for i in range(self.n_vocab)]
+        vocabulary, replacements, self.vocabulary_stats = build_vocabulary(
+            Counter(tokens),
+            min_count=vocabulary_config.get('min_count', 1),
+            max_size=vocabulary_config.get('max_size'),
+            max_chord_distance=vocabulary_config.get('max_chord_distance', 2),
+            known=pitchnames
+        )
+        added = vocabulary[len(pitchnames):]
+        if self.transpositions:
+            added += sorted(transposed_vocabulary(added, self.transpositions) - set(vocabulary))
+        for token in added:
+            self.note_to_int[token] = len(self.int_to_note)
+            self.int_to_note[len(self.int_to_note)] = token
+        self.n_vocab = len(self.int_to_note)
+        if self.encoded_notes.dtype == np.uint16 and self.n_vocab > np.iinfo(np.uint16).max + 1:
+            raise ValueError(f"Vocabulary of {self.n_vocab} tokens does not fit in uint16.")
+
+        encoded = encode_notes([replacements.get(token, token) for token in tokens], self.note_to_int,
+                               self.encoded_notes.dtype)
+        self.encoded_notes = np.concatenate([self.encoded_notes, encoded])
+        self.note_sources.extend(new_sources)
+        if self.transpositions:
+            self._set_transpositions(self.transpositions)
+        # Keep the raw corpus in step when it is held in full
+        if events and len(self.events) == offset:
+            self.events = np.concatenate([self.events] + [np.asarray(codes, dtype=np.int32)
+                                                          for codes in results if codes])
+        elif not events and len(self.notes) == offset:
+            self.notes.extend(tokens)
+        return len(tokens)
+
     def create_sample_training_data(self):
         """Create sample musical sequences for training"""
         # Create a simple melodic pattern (C major scale patterns)
@@ -59,125 +648,919 @@ class MusicAI:
         ]
         
         # Repeat patterns to create more training data
+        sample = []
         for _ in range(20):
             for pattern in patterns:
-                self.notes.extend(pattern)
+                sample.extend(pattern)
         
+        if self.token_scheme == 'events':
+            self.events = np.concatenate([self.events, midi_io.events_from_tokens(sample)])
+            return self.events
+        self.notes.extend(sample)
         return self.notes
     
-    def prepare_sequences(self, sequence_length=100, midi_folder='output'):
-        """Prepare sequences for training"""
-        if len(self.notes) == 0:
-            self.extract_notes_from_midi(midi_folder)
+    def prepare_sequences(self, sequence_length=100, midi_folder='output', compact=False,
+                          sparse_labels=False, input_encoding=None, transpositions=None):
+        """Prepare sequences for training
+
+        The corpus is encoded once into `self.encoded_notes` and the input
+        windows are strided views over it, so memory stays O(N). compact=True
+        stores uint16 tokens and float32 inputs, network_output always holds
+        integer labels (sparse_labels=True selects the sparse loss) and
+        input_encoding='embedding' windows the token ids (default:
+        model.input_encoding). The 'events' token scheme windows
+        `self.events`, named by midi_io.event_label. Rare tokens are pruned
+        per the 'vocabulary' config section (see build_vocabulary), and
+        transpositions (default training.augmentation.transpositions) add
+        every transposed token (see transposition_table).
+        """
+        if transpositions is None:
+            transpositions = self.config.get('training', {}).get('augmentation', {}).get('transpositions', [])
+        events = self.token_scheme == 'events'
+        corpus = self.events if events else self.notes
+        if len(corpus) == 0:
+            corpus = self.extract_notes_from_midi(midi_folder)
 
-        if len(self.notes) <= sequence_length:
+        if len(corpus) <= sequence_length:
             raise ValueError(
-                f"Not enough notes ({len(self.notes)}) for sequence length {sequence_length}. "
+                f"Not enough notes ({len(corpus)}) for sequence length {sequence_length}. "
                 "Reduce sequence length or add more MIDI data."
             )
 
+        # Count the tokens and prune the rare ones
+        if events:
+            codes, inverse, counts = np.unique(corpus, return_inverse=True, return_counts=True)
+            labels = [midi_io.event_label(code) for code in codes]
+            counts = dict(zip(labels, counts.tolist()))
+        else:
+            counts = Counter(corpus)
+        vocabulary_config = self.config.get('vocabulary', {})
+        kept, replacements, self.vocabulary_stats = build_vocabulary(
+            counts,
+            min_count=vocabulary_config.get('min_count', 1),
+            max_size=vocabulary_config.get('max_size'),
+            max_chord_distance=vocabulary_config.get('max_chord_distance', 2)
+        )
+        if replacements:
+            stats = self.vocabulary_stats
+            print(f"Vocabulary pruned to {stats['vocabulary_size']} of {stats['distinct_tokens']} tokens "
+                  f"({stats['coverage']:.1%} kept, {stats['mapped_fraction']:.1%} mapped, "
+                  f"{stats['unknown_fraction']:.1%} unknown)")
+
         # Get unique notes
-        pitchnames = sorted(set(self.notes))
+        if events:
+            vocabulary_codes = np.array(sorted(midi_io.parse_event_label(label)
+                                               for label in transposed_vocabulary(kept, transpositions)),
+                                        dtype=np.int32)
+            pitchnames = [midi_io.event_label(code) for code in vocabulary_codes]
+        else:
+            pitchnames = sorted(transposed_vocabulary(kept, transpositions))
         self.n_vocab = len(pitchnames)
+        self.input_scale = self.n_vocab
         
         # Create mappings
         self.note_to_int = {note: number for number, note in enumerate(pitchnames)}
         self.int_to_note = {number: note for number, note in enumerate(pitchnames)}
+        self._set_transpositions(transpositions)
+
+        if compact and self.n_vocab > np.iinfo(np.uint16).max + 1:
+            raise ValueError(f"Vocabulary of {self.n_vocab} tokens does not fit in uint16.")
+        token_dtype = np.uint16 if compact else np.int32
+        if events:
+            targets = [midi_io.parse_event_label(replacements.get(label, label)) for label in labels]
+            self.encoded_notes = np.searchsorted(vocabulary_codes, targets).astype(token_dtype)[inverse]
+        else:
+            notes = [replacements.get(n, n) for n in corpus] if replacements else corpus
+            self.encoded_notes = encode_notes(notes, self.note_to_int, token_dtype)
+        return self._build_windows(sequence_length, compact, sparse_labels, input_encoding)
+
+    def _set_transpositions(self, transpositions):
+        """Build `self.transpose_table` over the current vocabulary, or clear it"""
+        # Row 0 is always the untransposed key
+        self.transpositions = [0] + [int(t) for t in transpositions if t != 0] if transpositions else []
+        if self.transpositions:
+            pitchnames = [self.int_to_note[i] for i in range(self.n_vocab)]
+            self.transpose_table = transposition_table(pitchnames, self.transpositions)
+        else:
+            self.transpose_table = None
+
+    @timed_stage('windows')
+    def _build_windows(self, sequence_length, compact=False, sparse_labels=False,
+                       input_encoding=None, start=0):
+        """Window `self.encoded_notes` into network_input/network_output
+
+        Only windows starting at token `start` or later are built; the
+        start is kept in `self.window_start` for make_dataset.
+        """
+        tokens = self.encoded_notes[start:]
+        if len(tokens) <= sequence_length:
+            raise ValueError(
+                f"Not enough notes ({len(tokens)}) for sequence length {sequence_length}. "
+                "Reduce sequence length or add more MIDI data."
+            )
+        if input_encoding is None:
+            input_encoding = self.input_encoding
+        if input_encoding not in INPUT_ENCODINGS:
+            raise ValueError(f"Unknown input encoding {input_encoding!r}; expected one of {INPUT_ENCODINGS}.")
+        self.input_encoding = input_encoding
+        self.sequence_length = sequence_length
+        self.window_start = start
         
-        # Create input sequences
-        self.network_input = []
-        self.network_output = []
-        
-        for i in range(0, len(self.notes) - sequence_length, 1):
-            sequence_in = self.notes[i:i + sequence_length]
-            sequence_out = self.notes[i + sequence_length]
-            self.network_input.append([self.note_to_int[char] for char in sequence_in])
-            self.network_output.append(self.note_to_int[sequence_out])
-        
-        n_patterns = len(self.network_input)
-        
-        # Reshape and normalize input
-        self.network_input = np.reshape(self.network_input, (n_patterns, sequence_length, 1))
-        self.network_input = self.network_input / float(self.n_vocab)
+        if input_encoding == 'embedding':
+            # Token ids go straight to the Embedding layer
+            self.network_input = sliding_windows(tokens, sequence_length)
+        else:
+            # Normalize once, then window the normalized stream without copying
+            input_dtype = np.float32 if compact else np.float64
+            normalized = tokens.astype(input_dtype) / input_dtype(self._input_scale())
+            self.network_input = sliding_windows(normalized, sequence_length)[..., np.newaxis]
+        # Labels stay integer ids; one-hot rows are only built per batch or for an in-memory fit
+        self.network_output = tokens[sequence_length:]
         
-        # One-hot encode output
         if len(self.network_output) == 0:
             raise ValueError(
                 "No training patterns were created. Reduce sequence length or add more MIDI data."
             )
-        self.network_output = keras.utils.to_categorical(self.network_output)
+        self.sparse_labels = sparse_labels
+        self.metrics.count('windows_built', len(self.network_input))
         
         return self.network_input, self.network_output
-    
-    def create_model(self, sequence_length=100):
-        """Create LSTM neural network"""
+
+    def save_dataset(self, dataset_dir='models/dataset'):
+        """Save the encoded corpus as a memory-mappable dataset artifact
+
+        The directory holds tokens.npy (the encoded token array), vocab.json
+        (tokens in id order), sources.json (each source file and the index
+        of its first token) and meta.json.
+        """
+        if len(self.encoded_notes) == 0:
+            raise ValueError("No encoded notes found. Prepare sequences before saving a dataset.")
+        os.makedirs(dataset_dir, exist_ok=True)
+        np.save(os.path.join(dataset_dir, 'tokens.npy'), np.ascontiguousarray(self.encoded_notes))
+        with open(os.path.join(dataset_dir, 'vocab.json'), 'w') as f:
+            json.dump([self.int_to_note[i] for i in range(self.n_vocab)], f)
+        with open(os.path.join(dataset_dir, 'sources.json'), 'w') as f:
+            json.dump([{'file': path, 'offset': offset} for path, offset in self.note_sources], f)
+        with open(os.path.join(dataset_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'format_version': DATASET_FORMAT_VERSION,
+                'n_tokens': int(len(self.encoded_notes)),
+                'n_vocab': self.n_vocab,
+                'dtype': str(self.encoded_notes.dtype),
+                'token_scheme': self.token_scheme,
+                'input_scale': self._input_scale(),
+                'transpositions': self.transpositions,
+                'vocabulary_stats': self.vocabulary_stats
+            }, f)
+        return dataset_dir
+
+    def load_dataset(self, dataset_dir='models/dataset', sequence_length=None, mmap=True,
+                     sparse_labels=False, input_encoding=None):
+        """Load a dataset artifact written by save_dataset
+
+        With mmap=True the token array is memory-mapped read-only, so
+        startup skips parsing and several processes on one host share the
+        same page-cache pages. `self.notes` is left empty; the corpus is
+        only available in encoded form. Passing sequence_length also
+        builds the training windows, as prepare_sequences would.
+        """
+        with open(os.path.join(dataset_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta.get('format_version') != DATASET_FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset format version: {meta.get('format_version')}")
+        with open(os.path.join(dataset_dir, 'vocab.json'), 'r') as f:
+            pitchnames = json.load(f)
+        with open(os.path.join(dataset_dir, 'sources.json'), 'r') as f:
+            self.note_sources = [(entry['file'], entry['offset']) for entry in json.load(f)]
+
+        self.notes = []
+        self.events = np.zeros(0, dtype=np.int32)
+        self.token_scheme = meta.get('token_scheme', 'notes')
+        self.n_vocab = len(pitchnames)
+        self.input_scale = meta.get('input_scale', self.n_vocab)
+        self.note_to_int = {note: number for number, note in enumerate(pitchnames)}
+        self.int_to_note = {number: note for number, note in enumerate(pitchnames)}
+        self._set_transpositions(meta.get('transpositions', []))
+        self.vocabulary_stats = meta.get('vocabulary_stats')
+        self.encoded_notes = np.load(os.path.join(dataset_dir, 'tokens.npy'),
+                                     mmap_mode='r' if mmap else None)
+        if sequence_length is not None:
+            self._build_windows(sequence_length, compact=self.encoded_notes.dtype == np.uint16,
+                                sparse_labels=sparse_labels, input_encoding=input_encoding)
+        return self.encoded_notes
+
+    def get_strategy(self):
+        """The distribution strategy from training.distribution, created once"""
+        if self.strategy is None:
+            self.strategy = make_strategy(self.config.get('training', {}).get('distribution', {}))
+        return self.strategy
+
+    def _rebuild_model(self, strategy):
+        """Recreate the compiled model, with its current weights, under strategy
+
+        The optimizer restarts from its configuration; its slot variables
+        are not carried over.
+        """
+        weights = self.model.get_weights()
+        optimizer_config = keras.optimizers.serialize(self.model.optimizer)
+        jit_compile = model_settings(self.config.get('model', {}))['jit_compile']
+        with strategy.scope():
+            model = keras.models.clone_model(self.model)
+            model.set_weights(weights)
+            model.compile(loss=self.model.loss, optimizer=keras.optimizers.deserialize(optimizer_config),
+                          jit_compile=jit_compile)
+        self.model = model
+        self.strategy = strategy
+
+    def _grow_model(self):
+        """Widen the output layer (and any Embedding) of the model to `self.n_vocab` tokens
+
+        Trained weights are kept for the existing tokens. New output units
+        start from the layer initializer with the smallest trained bias, so
+        new tokens begin as unlikely as the rarest known one. The optimizer
+        restarts from its configuration, as in _rebuild_model.
+        """
+        output_layer = [layer for layer in self.model.layers if isinstance(layer, layers.Dense)][-1]
+
+        def clone_layer(layer):
+            config = layer.get_config()
+            if layer is output_layer:
+                config['units'] = self.n_vocab
+            elif isinstance(layer, layers.Embedding):
+                config['input_dim'] = self.n_vocab
+            return layer.__class__.from_config(config)
+
+        optimizer_config = keras.optimizers.serialize(self.model.optimizer)
+        jit_compile = model_settings(self.config.get('model', {}))['jit_compile']
+        with self.model.distribute_strategy.scope():
+            model = keras.models.clone_model(self.model, clone_function=clone_layer)
+            for old_layer, new_layer in zip(self.model.layers, model.layers):
+                weights = new_layer.get_weights()
+                for index, old in enumerate(old_layer.get_weights()):
+                    if old.shape != weights[index].shape:
+                        if old_layer is output_layer and old.ndim == 1:
+                            weights[index][len(old):] = old.min()
+                        weights[index][tuple(slice(0, size) for size in old.shape)] = old
+                    else:
+                        weights[index] = old
+                new_layer.set_weights(weights)
+            model.compile(loss=self.model.loss, optimizer=keras.optimizers.deserialize(optimizer_config),
+                          jit_compile=jit_compile)
+        self.model = model
+
+    def fine_tune(self, midi_folder='output', epochs=None, batch_size=64, learning_rate=None,
+                  workers=1, cache_dir=None, fast_reader=False, progress=None, should_stop=None):
+        """Ingest new MIDI files and fine-tune the current model on them
+
+        Runs update_corpus, widens the model to any new tokens
+        (_grow_model) and trains only on the windows whose targets come from
+        the new files, for training.fine_tune.epochs at
+        training.fine_tune.learning_rate unless given. Other options are as
+        for update_corpus and train. Returns the number of new tokens; with
+        none, or too few for one training window (ValueError), the model
+        and corpus are left untouched.
+        """
+        if self.model is None:
+            raise Exception("No trained model! Train or load a model first.")
+        sequence_length = int(self.model.input_shape[1] or self.sequence_length)
+        fine_tune_config = self.config.get('training', {}).get('fine_tune', {})
+        old_length = len(self.encoded_notes)
+        old_vocab = self.n_vocab
+        # update_corpus grows these in place or replaces them; keep what is needed to undo it
+        saved = {'note_to_int': dict(self.note_to_int), 'int_to_note': dict(self.int_to_note),
+                 'note_sources': list(self.note_sources), 'n_vocab': self.n_vocab,
+                 'encoded_notes': self.encoded_notes, 'events': self.events,
+                 'transpose_table': self.transpose_table, 'vocabulary_stats': self.vocabulary_stats}
+        n_notes = len(self.notes)
+        n_new = self.update_corpus(midi_folder, workers, cache_dir, fast_reader)
+        if n_new == 0:
+            return 0
+        start = max(0, old_length - sequence_length)
+        available = len(self.encoded_notes) - start
+        if available <= sequence_length:
+            # Not a single training window: undo the update so the files count as new next time
+            for name, value in saved.items():
+                setattr(self, name, value)
+            del self.notes[n_notes:]
+            raise ValueError(
+                f"Not enough notes ({available}) for sequence length "
+                f"{sequence_length}. Add more MIDI data before fine-tuning."
+            )
+        if self.n_vocab != old_vocab:
+            self._grow_model()
+        if learning_rate is None:
+            learning_rate = fine_tune_config.get('learning_rate')
+        if learning_rate is not None:
+            self.model.optimizer.learning_rate.assign(learning_rate)
+
+        # The first new target takes its context from the end of the old corpus
+        self._build_windows(sequence_length, compact=self.encoded_notes.dtype == np.uint16,
+                            sparse_labels=self.sparse_labels, start=start)
+        if epochs is None:
+            epochs = fine_tune_config.get('epochs', 5)
+        self.train(epochs=epochs, batch_size=batch_size, progress=progress, should_stop=should_stop,
+                   resume=False)
+        return n_new
+
+    def create_model(self, sequence_length=100, sparse_labels=None, preset=None, input_encoding=None,
+                     strategy=None):
+        """Create LSTM neural network
+
+        The architecture comes from the model config, or from preset (see
+        model_settings). sparse_labels and input_encoding default to the
+        mode used by prepare_sequences; strategy defaults to the one in
+        training.distribution (see make_strategy).
+        """
         if self.n_vocab == 0:
             raise ValueError("No vocabulary found. Prepare sequences before creating the model.")
-        self.model = keras.Sequential([
-            layers.LSTM(256, input_shape=(sequence_length, 1), return_sequences=True),
-            layers.Dropout(0.3),
-            layers.LSTM(256, return_sequences=True),
-            layers.Dropout(0.3),
-            layers.LSTM(256),
-            layers.Dropout(0.3),
-            layers.Dense(256),
-            layers.Dropout(0.3),
-            layers.Dense(self.n_vocab, activation='softmax')
-        ])
-        
-        self.model.compile(loss='categorical_crossentropy', optimizer='adam')
+        settings = model_settings(self.config.get('model', {}), preset)
+        precision = settings['precision']
+        dtype = None if precision == 'float32' else keras.mixed_precision.Policy(precision)
+
+        if input_encoding is None:
+            input_encoding = self.input_encoding
+        self.input_encoding = input_encoding
+
+        if sparse_labels is None:
+            sparse_labels = self.sparse_labels
+        self.sparse_labels = sparse_labels
+        loss = 'sparse_categorical_crossentropy' if sparse_labels else 'categorical_crossentropy'
+        if strategy is None:
+            strategy = self.get_strategy()
+
+        # Variables must be created under the strategy that will train them
+        with strategy.scope():
+            model_layers = []
+            if input_encoding == 'embedding':
+                model_layers.append(layers.Embedding(self.n_vocab, settings['embedding_dim'],
+                                                     input_length=sequence_length, dtype=dtype))
+                input_options = {}
+            else:
+                input_options = {'input_shape': (sequence_length, 1)}
+            for index in range(settings['num_layers']):
+                more_lstms = index < settings['num_layers'] - 1
+                model_layers.append(layers.LSTM(settings['lstm_units'], return_sequences=more_lstms,
+                                                dtype=dtype, **(input_options if index == 0 else {})))
+                if settings['dropout'] > 0:
+                    model_layers.append(layers.Dropout(settings['dropout'], dtype=dtype))
+            model_layers.append(layers.Dense(settings['dense_units'], dtype=dtype))
+            if settings['dropout'] > 0:
+                model_layers.append(layers.Dropout(settings['dropout'], dtype=dtype))
+            if dtype is None:
+                model_layers.append(layers.Dense(self.n_vocab, activation='softmax'))
+            else:
+                # Compute logits in reduced precision, but the softmax in float32 for stability
+                model_layers.append(layers.Dense(self.n_vocab, dtype=dtype))
+                model_layers.append(layers.Activation('softmax', dtype='float32'))
+            self.model = keras.Sequential(model_layers)
+
+            optimizer = keras.optimizers.Adam()
+            if precision == 'mixed_float16':
+                optimizer = keras.mixed_precision.LossScaleOptimizer(optimizer)
+            self.model.compile(loss=loss, optimizer=optimizer, jit_compile=settings['jit_compile'])
         return self.model
+
+    def _training_targets(self):
+        """Return the integer network_output in the label format the compiled loss expects"""
+        if self.sparse_labels:
+            return np.asarray(self.network_output)
+        return keras.utils.to_categorical(self.network_output, num_classes=self.n_vocab)
     
-    def train(self, epochs=10, batch_size=64):
-        """Train the model"""
+    def make_dataset(self, batch_size=64, shuffle_buffer=10000, validation_split=0.0, seed=None):
+        """Build tf.data pipelines that window the encoded token stream on the fly
+
+        train() streams from here by default, since model.fit would copy
+        the strided network_input view into a dense N x sequence_length
+        tensor, and always with multi-worker strategies or transposition.
+        Only the O(N) token array is held in memory, and a memory-mapped
+        one (see load_dataset) is read in place, so processes mapping the
+        same artifact keep sharing its pages. Each batch of windows
+        is gathered, normalized and labelled in a parallel map and
+        prefetched while the previous step runs. Like Keras' own
+        validation_split, the last fraction of windows is held out.
+        With a transposition table (see prepare_sequences) every training
+        window and its target are moved to a random key per epoch;
+        validation windows stay untransposed. Windows start at
+        `self.window_start`, as for network_input.
+        Returns (train_dataset, validation_dataset or None).
+        """
+        if len(self.encoded_notes) <= self.sequence_length:
+            raise ValueError("Training data is empty. Prepare sequences before training.")
+        sequence_length = self.sequence_length
+        n_vocab = self.n_vocab
+        input_scale = float(self._input_scale())
+        sparse_labels = self.sparse_labels
+        encoded_notes = self.encoded_notes
+        mapped = isinstance(encoded_notes, np.memmap)
+        if mapped:
+            # Read windows straight from the mapped pages; a tf.constant would copy the corpus
+            window_offsets = np.arange(sequence_length + 1)
+
+            def read_windows(starts):
+                rows = encoded_notes[starts[:, np.newaxis] + window_offsets].astype(np.int32)
+                return rows[:, :-1], rows[:, -1]
+        else:
+            tokens = tf.constant(encoded_notes)
+            offsets = tf.range(sequence_length, dtype=tf.int64)
+
+        embedding = self.input_encoding == 'embedding'
+        if self.transpose_table is not None:
+            # Flattened so a (row, token) lookup is a single gather
+            transpose = tf.constant(self.transpose_table.ravel())
+            n_keys = len(self.transpositions)
+
+        def to_batch(starts, augment=False):
+            if mapped:
+                windows, targets = tf.numpy_function(read_windows, [starts], [tf.int32, tf.int32])
+                windows.set_shape([None, sequence_length])
+                targets.set_shape([None])
+            else:
+                windows = tf.cast(tf.gather(tokens, starts[:, tf.newaxis] + offsets), tf.int32)
+                targets = tf.cast(tf.gather(tokens, starts + sequence_length), tf.int32)
+            if augment:
+                rows = tf.random.uniform(tf.shape(starts), maxval=n_keys, dtype=tf.int32) * n_vocab
+                windows = tf.gather(transpose, rows[:, tf.newaxis] + windows)
+                targets = tf.gather(transpose, rows + targets)
+            if embedding:
+                inputs = windows
+            else:
+                inputs = tf.cast(windows, tf.float32)[..., tf.newaxis] / input_scale
+            if not sparse_labels:
+                targets = tf.one_hot(targets, n_vocab)
+            return inputs, targets
+
+        def pipeline(start, stop, shuffle, augment=False):
+            dataset = tf.data.Dataset.range(start, stop)
+            if shuffle:
+                dataset = dataset.shuffle(min(shuffle_buffer, stop - start), seed=seed,
+                                          reshuffle_each_iteration=True)
+            return (dataset.batch(batch_size)
+                    .map(lambda starts: to_batch(starts, augment), num_parallel_calls=tf.data.AUTOTUNE)
+                    .prefetch(tf.data.AUTOTUNE))
+
+        first = self.window_start
+        n_patterns = len(self.encoded_notes) - sequence_length - first
+        n_train = n_patterns - int(n_patterns * validation_split)
+        if n_train <= 0:
+            raise ValueError("Validation split leaves no training patterns.")
+        train_dataset = pipeline(first, first + n_train, shuffle=shuffle_buffer > 0,
+                                 augment=self.transpose_table is not None)
+        validation_dataset = (pipeline(first + n_train, first + n_patterns, shuffle=False)
+                              if n_train < n_patterns else None)
+        return train_dataset, validation_dataset
+
+    def _progress_callback(self, epochs, progress=None, should_stop=None):
+        """Keras callback reporting finished epochs and polling for cancellation
+
+        progress(done, total) is called after every epoch; should_stop() is
+        polled after every batch and stops training cooperatively.
+        """
+        def on_epoch_end(epoch, logs=None):
+            if progress is not None:
+                progress(epoch + 1, epochs)
+
+        def on_batch_end(batch, logs=None):
+            if should_stop is not None and should_stop():
+                self.model.stop_training = True
+
+        return keras.callbacks.LambdaCallback(on_epoch_end=on_epoch_end, on_batch_end=on_batch_end)
+
+    def _corpus_fingerprint(self):
+        """Short hash of the encoded tokens the training windows are drawn from"""
+        digest = hashlib.sha1(np.ascontiguousarray(self.encoded_notes[self.window_start:]).data)
+        digest.update(json.dumps([self.int_to_note[i] for i in range(self.n_vocab)]).encode('utf-8'))
+        return digest.hexdigest()[:12]
+
+    def _checkpoint_signature(self):
+        """What a checkpoint must match to resume training of the current model"""
+        return {
+            'sequence_length': int(self.model.input_shape[1] or self.sequence_length),
+            'n_vocab': self.n_vocab,
+            'input_encoding': self.input_encoding,
+            'sparse_labels': self.sparse_labels,
+            'parameters': int(self.model.count_params()),
+            'config_hash': self.config_hash(),
+            'corpus': self._corpus_fingerprint(),
+        }
+
+    def _read_checkpoint_state(self, checkpoint_dir):
+        state_path = os.path.join(checkpoint_dir, 'state.json')
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path, 'r') as f:
+            return json.load(f)
+
+    def _write_checkpoint_state(self, checkpoint_dir, state):
+        """Replace state.json atomically so a crash never leaves it half written"""
+        state_path = os.path.join(checkpoint_dir, 'state.json')
+        tmp_path = f"{state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, state_path)
+
+    def _resume_checkpoint(self, checkpoint_dir, signature, resume=True):
+        """Reload the latest checkpoint of an unfinished run of this model
+
+        The run must have the same signature (see _checkpoint_signature):
+        model shape, configuration and training corpus. A fresh run
+        (nothing to resume, or resume=False) clears the old periodic
+        checkpoints instead. Returns (initial_epoch, best monitored value
+        or None).
+        """
+        state = self._read_checkpoint_state(checkpoint_dir)
+        if (resume and state is not None and not state.get('completed')
+                and state.get('signature') == signature):
+            # The .keras file holds the weights and the optimizer state
+            with self.model.distribute_strategy.scope():
+                self.model = keras.models.load_model(os.path.join(checkpoint_dir, state['latest']))
+            print(f"Resuming training from epoch {state['epoch']} ({state['latest']})")
+            return state['epoch'], state.get('best')
+        for file in os.listdir(checkpoint_dir):
+            if file.startswith('epoch-') and file.endswith('.keras'):
+                os.remove(os.path.join(checkpoint_dir, file))
+        return 0, None
+
+    def _checkpoint_callbacks(self, checkpoint_config, monitor, signature, best=None):
+        """Periodic and best-model checkpoint callbacks
+
+        Every `every_epochs` epochs the full model (weights and optimizer
+        state) is saved as epoch-NNNN.keras, only the newest `keep` are kept,
+        and state.json records the epoch for resuming. With save_best the
+        model with the lowest `monitor` value is kept as best.keras.
+
+        train() adds these when training.checkpoint is enabled, next to
+        _plateau_callbacks; all are off by default and monitor val_loss
+        when there is a validation split, loss otherwise. An interrupted
+        run of the same model, config and corpus then resumes from its
+        latest checkpoint unless resume (default training.checkpoint.resume)
+        is False.
+        """
+        checkpoint_dir = checkpoint_config.get('dir', 'models/checkpoints')
+        every_epochs = max(1, checkpoint_config.get('every_epochs', 1))
+        keep = max(1, checkpoint_config.get('keep', 2))
+        callbacks = []
+        best_checkpoint = None
+        if checkpoint_config.get('save_best', True):
+            best_checkpoint = keras.callbacks.ModelCheckpoint(
+                os.path.join(checkpoint_dir, 'best.keras'),
+                monitor=monitor,
+                save_best_only=True,
+                initial_value_threshold=best
+            )
+            callbacks.append(best_checkpoint)
+
+        def on_epoch_end(epoch, logs=None):
+            done = epoch + 1
+            if done % every_epochs:
+                return
+            name = f"epoch-{done:04d}.keras"
+            self.model.save(os.path.join(checkpoint_dir, name))
+            self.metrics.count('checkpoints_saved')
+            saved = sorted(file for file in os.listdir(checkpoint_dir)
+                           if file.startswith('epoch-') and file.endswith('.keras'))
+            for file in saved[:-keep]:
+                os.remove(os.path.join(checkpoint_dir, file))
+            best_value = best_checkpoint.best if best_checkpoint is not None else None
+            self._write_checkpoint_state(checkpoint_dir, {
+                'epoch': done,
+                'latest': name,
+                'monitor': monitor,
+                'best': float(best_value) if best_value is not None and np.isfinite(best_value) else None,
+                'signature': signature,
+                'completed': False
+            })
+
+        callbacks.append(keras.callbacks.LambdaCallback(on_epoch_end=on_epoch_end))
+        return callbacks
+
+    def _plateau_callbacks(self, training_config, monitor):
+        """Early stopping and learning-rate reduction on a stalled `monitor`"""
+        callbacks = []
+        early_stopping = training_config.get('early_stopping', {})
+        if early_stopping.get('enabled'):
+            callbacks.append(keras.callbacks.EarlyStopping(
+                monitor=monitor,
+                patience=early_stopping.get('patience', 5),
+                min_delta=early_stopping.get('min_delta', 0.0),
+                restore_best_weights=early_stopping.get('restore_best_weights', True)
+            ))
+        reduce_lr = training_config.get('reduce_lr_on_plateau', {})
+        if reduce_lr.get('enabled'):
+            callbacks.append(keras.callbacks.ReduceLROnPlateau(
+                monitor=monitor,
+                factor=reduce_lr.get('factor', 0.5),
+                patience=reduce_lr.get('patience', 2),
+                min_delta=reduce_lr.get('min_delta', 1e-4),
+                min_lr=reduce_lr.get('min_lr', 0.0)
+            ))
+        return callbacks
+
+    @timed_stage('train')
+    def train(self, epochs=10, batch_size=64, streaming=None, validation_split=None,
+              callbacks=None, progress=None, should_stop=None, resume=None, strategy=None):
+        """Train the model for a total of `epochs` epochs
+
+        streaming feeds model.fit from make_dataset rather than in-memory
+        arrays (default: whenever network_input is a window view; see
+        make_dataset). validation_split defaults to
+        training.validation_split. callbacks are extra Keras callbacks,
+        progress and should_stop are as for _progress_callback and resume
+        as for _checkpoint_callbacks. batch_size is per replica, and the
+        model is rebuilt under strategy if given (see make_strategy).
+        """
         if self.model is None:
             raise Exception("Model not created. Call create_model() first.")
-        if len(self.network_input) == 0 or len(self.network_output) == 0:
-            raise ValueError("Training data is empty. Prepare sequences before training.")
-        
-        self.model.fit(
-            self.network_input, 
-            self.network_output, 
-            epochs=epochs, 
-            batch_size=batch_size,
-            verbose=1
-        )
+        if strategy is not None and self.model.distribute_strategy is not strategy:
+            self._rebuild_model(strategy)
+        strategy = self.model.distribute_strategy
+        training_config = self.config.get('training', {})
+        distribution_config = training_config.get('distribution', {})
+        if distribution_config.get('scale_batch_size', True):
+            batch_size *= strategy.num_replicas_in_sync
+        multi_worker = isinstance(strategy, tf.distribute.MultiWorkerMirroredStrategy)
+        if streaming is None:
+            streaming = isinstance(self.network_input, np.ndarray) and not self.network_input.flags.owndata
+        streaming = streaming or multi_worker or self.transpose_table is not None
+        seed = training_config.get('seed')
+        if seed is None and multi_worker:
+            seed = 0
+        if validation_split is None:
+            validation_split = training_config.get('validation_split', 0.0)
+        monitor = 'val_loss' if validation_split > 0 else 'loss'
+
+        checkpoint_config = training_config.get('checkpoint', {})
+        initial_epoch, best = 0, None
+        if checkpoint_config.get('enabled'):
+            checkpoint_dir = checkpoint_config.get('dir', 'models/checkpoints')
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            if resume is None:
+                resume = checkpoint_config.get('resume', True)
+            signature = self._checkpoint_signature()
+            initial_epoch, best = self._resume_checkpoint(checkpoint_dir, signature, resume)
+
+        fit_callbacks = list(callbacks or [])
+        fit_callbacks += self._plateau_callbacks(training_config, monitor)
+        if checkpoint_config.get('enabled'):
+            fit_callbacks += self._checkpoint_callbacks(checkpoint_config, monitor, signature, best)
+        if progress is not None or should_stop is not None:
+            fit_callbacks.append(self._progress_callback(epochs, progress, should_stop))
+
+        if streaming:
+            train_dataset, validation_dataset = self.make_dataset(
+                batch_size=batch_size,
+                shuffle_buffer=training_config.get('shuffle_buffer', 10000),
+                validation_split=validation_split,
+                seed=seed
+            )
+            history = self.model.fit(
+                train_dataset,
+                validation_data=validation_dataset,
+                epochs=epochs,
+                initial_epoch=initial_epoch,
+                callbacks=fit_callbacks,
+                verbose=1
+            )
+            n_patterns = len(self.encoded_notes) - self.sequence_length - self.window_start
+            n_train = n_patterns - int(n_patterns * validation_split)
+        else:
+            if len(self.network_input) == 0 or len(self.network_output) == 0:
+                raise ValueError("Training data is empty. Prepare sequences before training.")
+            
+            history = self.model.fit(
+                self.network_input, 
+                self._training_targets(), 
+                epochs=epochs, 
+                initial_epoch=initial_epoch,
+                batch_size=batch_size,
+                validation_split=validation_split,
+                callbacks=fit_callbacks,
+                verbose=1
+            )
+            # Keras trains on the first floor(N * (1 - validation_split)) samples
+            n_train = int(np.floor(len(self.network_input) * (1.0 - validation_split)))
+        self.metrics.count('samples_trained', n_train * len(history.epoch))
+
+        if checkpoint_config.get('enabled') and not (should_stop is not None and should_stop()):
+            # Finished (or stopped early): the next train() call starts a fresh run
+            state = self._read_checkpoint_state(checkpoint_dir) or {}
+            state['completed'] = True
+            self._write_checkpoint_state(checkpoint_dir, state)
         
         return self.model
     
-    def generate_notes(self, length=100, sequence_length=100):
-        """Generate new notes using the trained model"""
+    def _seed_tokens(self, start=None):
+        """Return the integer tokens of a training window to seed generation"""
+        if len(self.network_input) == 0 and len(self.seed_windows) > 0:
+            # Loaded for inference only: seed from the windows stored in the bundle
+            if start is None:
+                start = np.random.randint(0, len(self.seed_windows))
+            return self.seed_windows[start % len(self.seed_windows)].astype(np.int64)
         if len(self.network_input) == 0:
             raise ValueError("No input patterns found. Train or load a model first.")
         # Pick a random sequence from the input as a starting point
-        start = np.random.randint(0, len(self.network_input) - 1)
-        pattern = self.network_input[start].flatten().tolist()
-        
-        prediction_output = []
-        
-        # Generate notes
-        for note_index in range(length):
-            prediction_input = np.reshape(pattern, (1, len(pattern), 1))
-            prediction_input = prediction_input / float(self.n_vocab)
-            
-            prediction = self.model.predict(prediction_input, verbose=0)
-            index = np.argmax(prediction)
-            result = self.int_to_note[index]
-            prediction_output.append(result)
-            
-            pattern.append(index / float(self.n_vocab))
-            pattern = pattern[1:]
-        
-        return prediction_output
+        if start is None:
+            start = np.random.randint(0, len(self.network_input) - 1)
+        window = np.asarray(self.network_input[start]).ravel()
+        if self.input_encoding == 'embedding':
+            return window.astype(np.int64)
+        return np.rint(window * self._input_scale()).astype(np.int64)
+
+    def _input_scale(self):
+        """The divisor of scalar inputs: the vocabulary size the model was first trained with"""
+        return int(self.input_scale or self.n_vocab)
+
+    def _encode_inputs(self, tokens):
+        """Shape a (batch, steps) array of tokens as model inputs for the input encoding"""
+        if self.input_encoding == 'embedding':
+            return np.asarray(tokens, dtype=np.int32)
+        return (np.asarray(tokens, dtype=np.float32) / float(self._input_scale()))[..., np.newaxis]
+
+    def _build_step_model(self, batch_size=1):
+        """Clone the trained network as a stateful model accepting any number of steps"""
+        inputs = keras.Input(batch_shape=(batch_size, None) + tuple(self.model.input_shape[2:]),
+                             dtype=self.model.input.dtype)
+        x = inputs
+        for layer in self.model.layers:
+            config = layer.get_config()
+            config.pop('batch_input_shape', None)
+            if isinstance(layer, layers.Embedding):
+                config['input_length'] = None
+            if isinstance(layer, layers.LSTM):
+                config['stateful'] = True
+            x = layer.__class__.from_config(config)(x)
+        step_model = keras.Model(inputs, x)
+        step_model.set_weights(self.model.get_weights())
+        return step_model
+
+    def _seed_array(self, seeds):
+        """Stack seeds (training window indices, None for random, or note lists) as tokens"""
+        rows = []
+        for seed in seeds:
+            if seed is None or isinstance(seed, (int, np.integer)):
+                rows.append(self._seed_tokens(seed))
+                continue
+            try:
+                rows.append(np.array([self.note_to_int[n] for n in seed], dtype=np.int64))
+            except KeyError as e:
+                raise ValueError(f"Seed note {e} is not in the vocabulary.")
+        if len({len(row) for row in rows}) > 1:
+            raise ValueError("All seeds must have the same length.")
+        return np.stack(rows)
+
+    def _sampler(self, temperature=None, top_k=None, top_p=None, seed=None):
+        """Return a function picking tokens from probabilities, defaulting to the generation config"""
+        return make_sampler(self.config.get('generation', {}), temperature, top_k, top_p, seed)
+
+    def _generation_step(self, stateful, batch_size):
+        """The compiled forward pass used by _generate_tokens, traced once per model and batch size
+
+        The cache is dropped whenever `self.model` is replaced. A stateful
+        step model copies the current weights and is reset on every call.
+        """
+        if self._step_model_owner is not self.model:
+            self._step_functions = {}
+            self._step_model_owner = self.model
+        key = (stateful, batch_size)
+        if key not in self._step_functions:
+            jit_compile = model_settings(self.config.get('model', {}))['jit_compile']
+            model = self._build_step_model(batch_size) if stateful else self.model
+            self._step_functions[key] = (model, tf.function(lambda x: model(x, training=False),
+                                                            jit_compile=jit_compile))
+        model, step = self._step_functions[key]
+        if stateful:
+            model.set_weights(self.model.get_weights())
+            model.reset_states()
+        return step
+
+    @timed_stage('generate')
+    def _generate_tokens(self, patterns, lengths, stop_ids, stateful=False, sampler=None,
+                         progress=None, should_stop=None):
+        """Advance every seed window together, one batched forward pass per step
+
+        progress(done, total) is called after each step and should_stop()
+        is polled before it; stopping early returns the notes so far.
+        """
+        if sampler is None:
+            sampler = self._sampler()
+        n_seeds = len(patterns)
+        outputs = [[] for _ in range(n_seeds)]
+        active = np.array([length > 0 for length in lengths])
+
+        step = self._generation_step(stateful, n_seeds)
+        if stateful:
+            inputs = self._encode_inputs(patterns)
+
+        total_steps = max(lengths, default=0)
+        for note_index in range(total_steps):
+            if not active.any() or (should_stop is not None and should_stop()):
+                break
+            prediction = step(inputs if stateful else self._encode_inputs(patterns))
+            indices = sampler(prediction.numpy())
+            for i in np.flatnonzero(active):
+                outputs[i].append(int(indices[i]))
+                if len(outputs[i]) >= lengths[i] or indices[i] in stop_ids[i]:
+                    active[i] = False
+            # Finished sequences keep their slot so the batch shape never changes
+            if stateful:
+                inputs = self._encode_inputs(indices[:, np.newaxis])
+            else:
+                patterns = np.concatenate([patterns[:, 1:], indices[:, np.newaxis]], axis=1)
+            if progress is not None:
+                progress(note_index + 1, total_steps)
+            self.metrics.count('generation_steps')
+        self.metrics.count('notes_generated', sum(len(output) for output in outputs))
+        return outputs
+
+    def generate_batch(self, seeds, length=100, stop_tokens=None, stateful=False,
+                       temperature=None, top_k=None, top_p=None, seed=None,
+                       progress=None, should_stop=None):
+        """Generate one piece per seed, advancing all of them in a single batch
+
+        seeds holds training window indices, None (a random window) or lists
+        of note tokens. length may be given once or per seed. stop_tokens is
+        one collection of tokens (a set or flat list) shared by every seed,
+        or a list holding one collection per seed; a sequence ends after
+        emitting one of its stop tokens. temperature, top_k and top_p default to the
+        generation config (see sample_tokens); seed makes sampling
+        reproducible. progress/should_stop hooks are as for
+        _generate_tokens. Returns one note list per seed, ready for
+        create_midi_from_notes.
+        """
+        if self.model is None:
+            raise Exception("No trained model! Train or load a model first.")
+        seeds = list(seeds)
+        lengths = list(length) if isinstance(length, (list, tuple)) else [length] * len(seeds)
+        collections = (list, tuple, set, frozenset)
+        if stop_tokens is None:
+            stop_tokens = [()] * len(seeds)
+        elif isinstance(stop_tokens, str):
+            raise ValueError("stop_tokens must be a collection of tokens, not a single string.")
+        elif all(isinstance(token, str) for token in stop_tokens):
+            stop_tokens = [stop_tokens] * len(seeds)
+        elif isinstance(stop_tokens, (list, tuple)) and all(
+                isinstance(tokens, collections) for tokens in stop_tokens):
+            stop_tokens = list(stop_tokens)
+        else:
+            raise ValueError("stop_tokens must be one collection of tokens or one per seed.")
+        if len(lengths) != len(seeds) or len(stop_tokens) != len(seeds):
+            raise ValueError("length and stop_tokens must match the number of seeds.")
+        if not seeds:
+            return []
+
+        stop_ids = [{self.note_to_int[n] for n in tokens if n in self.note_to_int}
+                    for tokens in stop_tokens]
+        sampler = self._sampler(temperature, top_k, top_p, seed)
+        outputs = self._generate_tokens(self._seed_array(seeds), lengths, stop_ids, stateful,
+                                        sampler, progress, should_stop)
+        return [[self.int_to_note[i] for i in output] for output in outputs]
+
+    def generate_notes(self, length=100, sequence_length=100, start=None, stateful=False,
+                       temperature=None, top_k=None, top_p=None, seed=None,
+                       progress=None, should_stop=None):
+        """Generate new notes using the trained model
+
+        The network is called directly through a compiled tf.function rather
+        than model.predict. stateful=True warms a stateful copy of the
+        network on the seed once and then feeds a single token per step,
+        i.e. O(length) instead of O(length * sequence_length) LSTM steps.
+        Its first note equals the windowed result; later notes are
+        conditioned on the whole generated history instead of a fixed window.
+        Sampling and progress options are as for generate_batch;
+        temperature 0 is greedy.
+        """
+        pattern = self._seed_tokens(start)
+        sampler = self._sampler(temperature, top_k, top_p, seed)
+        outputs = self._generate_tokens(pattern[np.newaxis], [length], [set()], stateful,
+                                        sampler, progress, should_stop)
+        return [self.int_to_note[i] for i in outputs[0]]
     
-    def create_midi_from_notes(self, prediction_output, filename='output/ai_generated.mid'):
-        """Convert predicted notes to MIDI file"""
+    @timed_stage('write_midi')
+    def create_midi_from_notes(self, prediction_output, filename='output/ai_generated.mid', fast=False):
+        """Convert predicted notes to MIDI file
+
+        fast=True encodes the tokens directly with midi_io instead of
+        building a music21 stream; filename may then also be a binary
+        file-like object such as io.BytesIO. Tokens the fast writer cannot
+        represent (microtones) fall back to music21. Event tokens (the
+        'events' token scheme) carry their own durations and rests and are
+        always written with midi_io. Unknown tokens are skipped.
+        """
+        prediction_output = [token for token in prediction_output if token != midi_io.UNKNOWN_TOKEN]
+        if self.token_scheme == 'events':
+            codes = [midi_io.parse_event_label(token) for token in prediction_output]
+            return self._write_midi_bytes(midi_io.encode_events(codes), filename)
+        if fast:
+            try:
+                return self._write_midi_bytes(midi_io.encode_midi(prediction_output), filename)
+            except ValueError:
+                pass
+
         offset = 0
         output_notes = []
         
         for pattern in prediction_output:
-            # Pattern is a chord
-            if '.' in pattern:
+            # Pattern is a chord (a lone pitch class is a one-note chord)
+            if '.' in pattern or pattern.isdigit():
                 notes_in_chord = pattern.split('.')
                 notes = []
                 for current_note in notes_in_chord:
@@ -198,33 +1581,260 @@ class MusicAI:
             offset += 0.5
         
         midi_stream = stream.Stream(output_notes)
+        if hasattr(filename, 'write'):
+            return self._write_midi_bytes(midi.translate.streamToMidiFile(midi_stream).writestr(), filename)
         
         # Ensure output directory exists
         os.makedirs(os.path.dirname(filename), exist_ok=True)
         
         midi_stream.write('midi', fp=filename)
+        self.metrics.count('midi_files_written')
+        self.metrics.count('midi_bytes_written', os.path.getsize(filename))
+        return filename
+
+    def _write_midi_bytes(self, data, filename):
+        """Write encoded MIDI bytes with midi_io.write_bytes and count them"""
+        self.metrics.count('midi_files_written')
+        self.metrics.count('midi_bytes_written', midi_io.write_bytes(data, filename))
         return filename
     
-    def save_model(self, model_path='models/music_model.h5', 
-                   notes_path='models/notes.pkl'):
-        """Save trained model and notes"""
-        os.makedirs('models', exist_ok=True)
-        self.model.save(model_path)
-        with open(notes_path, 'wb') as f:
-            pickle.dump({
-                'notes': self.notes,
-                'note_to_int': self.note_to_int,
-                'int_to_note': self.int_to_note,
-                'n_vocab': self.n_vocab
-            }, f)
+    def config_hash(self):
+        """Short, stable hash of the configuration used to build the model"""
+        encoded = json.dumps(self.config, sort_keys=True).encode('utf-8')
+        return hashlib.sha1(encoded).hexdigest()[:12]
+
+    def _bundle_seed_windows(self):
+        """A few evenly spaced training windows to seed generation after loading"""
+        if len(self.network_input) == 0:
+            return self.seed_windows
+        picks = np.linspace(0, len(self.network_input) - 1,
+                            min(BUNDLE_SEED_WINDOWS, len(self.network_input))).astype(int)
+        return np.stack([self._seed_tokens(int(i)) for i in picks])
+
+    @timed_stage('save_model')
+    def save_model(self, bundle_dir='models/bundle', include_dataset=False):
+        """Save trained model and vocabulary as a versioned bundle
+
+        The bundle holds the Keras model in its native format (model.keras),
+        the vocabulary (vocab.json), a few seed windows for generation
+        (seeds.npy) and metadata.json, which also lists the source MIDI
+        files for update_corpus. The corpus itself is only written,
+        as a dataset artifact under dataset/, when include_dataset is True.
+        """
+        if self.model is None:
+            raise ValueError("No model to save! Train a model first.")
+        os.makedirs(bundle_dir, exist_ok=True)
+        self.model.save(os.path.join(bundle_dir, 'model.keras'))
+        with open(os.path.join(bundle_dir, 'vocab.json'), 'w') as f:
+            json.dump([self.int_to_note[i] for i in range(self.n_vocab)], f)
+
+        np.save(os.path.join(bundle_dir, 'seeds.npy'), self._bundle_seed_windows())
+
+        with open(os.path.join(bundle_dir, 'metadata.json'), 'w') as f:
+            json.dump({
+                'format_version': MODEL_BUNDLE_VERSION,
+                'sequence_length': int(self.model.input_shape[1] or self.sequence_length),
+                'n_vocab': self.n_vocab,
+                'sparse_labels': self.sparse_labels,
+                'input_encoding': self.input_encoding,
+                'input_scale': self._input_scale(),
+                'token_scheme': self.token_scheme,
+                'transpositions': self.transpositions,
+                'config_hash': self.config_hash(),
+                'has_dataset': include_dataset,
+                'sources': [path for path, _ in self.note_sources]
+            }, f, indent=2)
+        if include_dataset:
+            self.save_dataset(os.path.join(bundle_dir, 'dataset'))
+        return bundle_dir
     
-    def load_model(self, model_path='models/music_model.h5',
-                   notes_path='models/notes.pkl'):
-        """Load trained model and notes"""
+    def _step_function(self):
+        """A float32 tf.function running one token through the network with explicit LSTM state
+
+        Inputs are the token id and each LSTM's (h, c) state; outputs the
+        next-token probabilities and the updated states. Dropout is skipped,
+        as at inference time.
+        """
+        constants = []
+
+        def constant(value):
+            tensor = tf.constant(np.asarray(value, dtype=np.float32))
+            constants.append(tensor)
+            return tensor
+
+        steps = []
+        state_sizes = []
+        for layer in self.model.layers:
+            if isinstance(layer, layers.Dropout):
+                continue
+            if isinstance(layer, layers.Embedding):
+                table = constant(layer.get_weights()[0])
+                steps.append(lambda x, state, table=table: (tf.gather(table, tf.cast(x, tf.int32)), state))
+            elif isinstance(layer, layers.LSTM):
+                kernel, recurrent_kernel, bias = (constant(w) for w in layer.get_weights())
+                index = len(state_sizes)
+                state_sizes.append(layer.units)
+
+                def lstm_step(x, state, kernel=kernel, recurrent_kernel=recurrent_kernel, bias=bias,
+                              index=index):
+                    h, c = state[2 * index], state[2 * index + 1]
+                    # Keras gate order: input, forget, candidate, output
+                    z = tf.matmul(x, kernel) + tf.matmul(h, recurrent_kernel) + bias
+                    i, f, g, o = tf.split(z, 4, axis=-1)
+                    c = tf.sigmoid(f) * c + tf.sigmoid(i) * tf.tanh(g)
+                    h = tf.sigmoid(o) * tf.tanh(c)
+                    state = state[:2 * index] + [h, c] + state[2 * index + 2:]
+                    return h, state
+                steps.append(lstm_step)
+            elif isinstance(layer, layers.Dense):
+                kernel, bias = (constant(w) for w in layer.get_weights())
+                steps.append(lambda x, state, kernel=kernel, bias=bias, activation=layer.activation:
+                             (activation(tf.matmul(x, kernel) + bias), state))
+            elif isinstance(layer, layers.Activation):
+                steps.append(lambda x, state, activation=layer.activation: (activation(x), state))
+            else:
+                raise ValueError(f"Cannot export layer {layer.name} ({layer.__class__.__name__}).")
+
+        embedding = self.input_encoding == 'embedding'
+        input_scale = float(self._input_scale())
+        signature = {'token': tf.TensorSpec([1], tf.int32)}
+        for index, units in enumerate(state_sizes):
+            signature[f'h{index}'] = tf.TensorSpec([1, units], tf.float32)
+            signature[f'c{index}'] = tf.TensorSpec([1, units], tf.float32)
+
+        def step(**inputs):
+            token = inputs['token']
+            x = token if embedding else tf.cast(token, tf.float32)[:, tf.newaxis] / input_scale
+            state = []
+            for index in range(len(state_sizes)):
+                state += [inputs[f'h{index}'], inputs[f'c{index}']]
+            for run in steps:
+                x, state = run(x, state)
+            outputs = {'probabilities': x}
+            for index in range(len(state_sizes)):
+                outputs[f'next_h{index}'] = state[2 * index]
+                outputs[f'next_c{index}'] = state[2 * index + 1]
+            return outputs
+
+        module = tf.Module()
+        module.constants = constants
+        concrete = tf.function(step).get_concrete_function(**signature)
+        return module, concrete, state_sizes
+
+    def export_inference(self, export_dir='models/inference'):
+        """Export a single-step stateful TFLite model for music_inference.MusicInference
+
+        The directory holds model.tflite (one 'step' signature taking a
+        token and the LSTM states, returning probabilities and new states),
+        vocab.json, seeds.npy and export.json. Generation from it matches
+        generate_notes(stateful=True). Returns export_dir.
+        """
+        if self.model is None:
+            raise ValueError("No model to export! Train or load a model first.")
+        module, concrete, state_sizes = self._step_function()
+        saved_model_dir = tempfile.mkdtemp()
+        try:
+            tf.saved_model.save(module, saved_model_dir, signatures={'step': concrete})
+            lite_converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir,
+                                                                      signature_keys=['step'])
+            tflite_model = lite_converter.convert()
+        finally:
+            shutil.rmtree(saved_model_dir)
+
+        os.makedirs(export_dir, exist_ok=True)
+        with open(os.path.join(export_dir, 'model.tflite'), 'wb') as f:
+            f.write(tflite_model)
+        with open(os.path.join(export_dir, 'vocab.json'), 'w') as f:
+            json.dump([self.int_to_note[i] for i in range(self.n_vocab)], f)
+        np.save(os.path.join(export_dir, 'seeds.npy'), self._bundle_seed_windows())
+        with open(os.path.join(export_dir, 'export.json'), 'w') as f:
+            json.dump({
+                'format_version': INFERENCE_EXPORT_VERSION,
+                'sequence_length': int(self.model.input_shape[1] or self.sequence_length),
+                'n_vocab': self.n_vocab,
+                'input_encoding': self.input_encoding,
+                'token_scheme': self.token_scheme,
+                'state_sizes': state_sizes,
+                'config_hash': self.config_hash()
+            }, f, indent=2)
+        return export_dir
+
+    @timed_stage('load_model')
+    def load_model(self, bundle_dir='models/bundle', load_dataset=False):
+        """Load trained model and vocabulary from a bundle
+
+        Only the model, vocabulary and seed windows are read, so inference
+        never touches the corpus; load_dataset=True also memory-maps the
+        bundled dataset. Older models saved as music_model.h5 + notes.pkl,
+        in bundle_dir or the directory above it, are still loaded when no
+        bundle exists.
+        """
+        metadata_path = os.path.join(bundle_dir, 'metadata.json')
+        if not os.path.exists(metadata_path):
+            for legacy_dir in (bundle_dir, os.path.dirname(os.path.normpath(bundle_dir))):
+                notes_path = os.path.join(legacy_dir, 'notes.pkl')
+                if os.path.exists(notes_path):
+                    return self._load_legacy_model(os.path.join(legacy_dir, 'music_model.h5'), notes_path)
+        with open(metadata_path, 'r') as f:
+            metadata = json.load(f)
+        if metadata.get('format_version') != MODEL_BUNDLE_VERSION:
+            raise ValueError(f"Unsupported model bundle version: {metadata.get('format_version')}")
+
+        self.model = keras.models.load_model(os.path.join(bundle_dir, 'model.keras'))
+        with open(os.path.join(bundle_dir, 'vocab.json'), 'r') as f:
+            pitchnames = json.load(f)
+        self.n_vocab = metadata['n_vocab']
+        self.input_scale = metadata.get('input_scale', self.n_vocab)
+        self.note_to_int = {note: number for number, note in enumerate(pitchnames)}
+        self.int_to_note = {number: note for number, note in enumerate(pitchnames)}
+        self.sequence_length = metadata['sequence_length']
+        self.sparse_labels = metadata.get('sparse_labels', False)
+        self.input_encoding = metadata.get('input_encoding', 'scalar')
+        self.token_scheme = metadata.get('token_scheme', 'notes')
+        self._set_transpositions(metadata.get('transpositions', []))
+        self.seed_windows = np.load(os.path.join(bundle_dir, 'seeds.npy'))
+        self.network_input = []
+        self.network_output = []
+
+        if load_dataset and metadata.get('has_dataset'):
+            self.load_dataset(os.path.join(bundle_dir, 'dataset'))
+        else:
+            # The corpus is not loaded, so the sources have no token offsets
+            self.notes = []
+            self.events = np.zeros(0, dtype=np.int32)
+            self.encoded_notes = np.zeros(0, dtype=np.int32)
+            self.note_sources = [(path, None) for path in metadata.get('sources', [])]
+        return metadata
+
+    def _load_legacy_model(self, model_path='models/music_model.h5',
+                           notes_path='models/notes.pkl'):
+        """Load a model saved by the old pickle-based save_model
+
+        Old models always took scalar note tokens and one-hot labels; any
+        state left from an earlier corpus or model is reset as in load_model.
+        """
         self.model = keras.models.load_model(model_path)
         with open(notes_path, 'rb') as f:
             data = pickle.load(f)
             self.notes = data['notes']
             self.note_to_int = data['note_to_int']
             self.int_to_note = data['int_to_note']
-            self.n_vocab = data['n_vocab']
\ No newline at end of file
+            self.n_vocab = data['n_vocab']
+        self.input_scale = self.n_vocab
+        self.sequence_length = sequence_length = self.model.input_shape[1]
+        self.sparse_labels = False
+        self.input_encoding = 'scalar'
+        self.token_scheme = 'notes'
+        self._set_transpositions([])
+        self.vocabulary_stats = None
+        self.network_input = []
+        self.network_output = []
+        self.events = np.zeros(0, dtype=np.int32)
+        self.encoded_notes = np.zeros(0, dtype=np.int32)
+        self.note_sources = []
+        self.window_start = 0
+        self.seed_windows = np.zeros((0, sequence_length), dtype=np.int64)
+        if len(self.notes) > sequence_length:
+            windows = sliding_windows(encode_notes(self.notes, self.note_to_int), sequence_length)
+            step = max(1, len(windows) // BUNDLE_SEED_WINDOWS)
+            self.seed_windows = np.array(windows[::step][:BUNDLE_SEED_WINDOWS], dtype=np.int64)
@@ -0,0 +1,363 @@
+"""
+Benchmarks for the Music Generation pipeline
+Run with: python benchmark_music.py [--suite small|medium|large] [--output results.json]
+                                    [--compare baseline.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import midi_io
+from ai_music_model import MusicAI, parse_midi_notes
+
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+result = {}
+import tkinter as tk
+import music_gui_enhanced
+result['import_seconds'] = time.perf_counter() - start
+try:
+    root = tk.Tk()
+    music_gui_enhanced.MusicGeneratorApp(root)
+    root.update()
+    result['first_window_seconds'] = time.perf_counter() - start
+    root.destroy()
+except tk.TclError:
+    result['first_window_seconds'] = None  # no display available
+from ai_music_model import MusicAI
+ai = MusicAI(config={})
+ai.create_sample_training_data()
+ai.prepare_sequences(32, sparse_labels=True)
+ai.create_model(32)
+ai.generate_notes(length=1, start=0)
+result['first_generation_seconds'] = time.perf_counter() - start
+print(json.dumps(result))
+"""
+
+INFERENCE_SCRIPT = """
+import json, sys, time
+from pipeline_metrics import peak_memory_bytes
+mode, path, n_notes = sys.argv[1], sys.argv[2], int(sys.argv[3])
+start = time.perf_counter()
+if mode == 'keras':
+    from ai_music_model import MusicAI
+    ai = MusicAI(config={})
+    ai.load_model(path)
+    generate = lambda length: ai.generate_notes(length=length, start=0, stateful=True)
+else:
+    from music_inference import MusicInference
+    runtime = MusicInference(path, config={})
+    generate = lambda length: runtime.generate_notes(length=length, start=0)
+# Two notes trace both the seed and the single-token step
+generate(2)
+result = {'load_seconds': time.perf_counter() - start}
+start = time.perf_counter()
+generate(n_notes)
+result['ms_per_note'] = (time.perf_counter() - start) * 1000 / n_notes
+result['peak_memory_bytes'] = peak_memory_bytes()
+print(json.dumps(result))
+"""
+
+SAMPLE_TOKENS = ['C4', 'D4', 'E-4', 'F#4', 'G4', 'A4', 'B-3', '0.4.7', '2.5.9', '7.11.2']
+
+# Synthetic corpus and model sizes for the pipeline suite
+SUITES = {
+    'small': {'n_files': 8, 'notes_per_file': 300, 'sequence_length': 32,
+              'epochs': 1, 'batch_size': 64, 'generation_length': 50},
+    'medium': {'n_files': 32, 'notes_per_file': 1000, 'sequence_length': 64,
+               'epochs': 2, 'batch_size': 64, 'generation_length': 100},
+    'large': {'n_files': 128, 'notes_per_file': 2000, 'sequence_length': 100,
+              'epochs': 2, 'batch_size': 128, 'generation_length': 200},
+}
+
+
+def random_tokens(n_notes, seed=0):
+    """Build a reproducible random note/chord token list"""
+    rng = random.Random(seed)
+    return [rng.choice(SAMPLE_TOKENS) for _ in range(n_notes)]
+
+
+def best_time(func, repeats):
+    """Return the fastest of several timed runs, in seconds"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def make_synthetic_corpus(folder, n_files, notes_per_file, seed=0):
+    """Write a reproducible corpus of random MIDI files and return their paths"""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(n_files):
+        path = os.path.join(folder, f"synthetic_{index:04d}.mid")
+        midi_io.write_midi(random_tokens(notes_per_file, seed=seed * 100003 + index), path)
+        paths.append(path)
+    return paths
+
+
+def bench_pipeline(n_files=8, notes_per_file=300, sequence_length=32, epochs=1, batch_size=64,
+                   generation_length=50, workers=1, fast_reader=False, seed=0, repeats=3):
+    """Run every pipeline stage on a synthetic corpus and report its throughput
+
+    Extraction uses the production music21 parser unless fast_reader is
+    set, which switches to the raw midi_io event reader; the choice is
+    recorded in the parameters. Stage timings come from MusicAI.metrics.
+    Generation is warmed up once so its latency excludes tf.function
+    tracing, which is reported separately as first_call_seconds (the
+    compiled step is cached).
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        make_synthetic_corpus(tmp, n_files, notes_per_file, seed)
+        ai = MusicAI(config={})
+        notes = ai.extract_notes_from_midi(tmp, workers=workers, fast_reader=fast_reader)
+        extract = ai.metrics.as_dict()
+    finally:
+        shutil.rmtree(tmp)
+
+    ai.metrics.reset()
+    start = time.perf_counter()
+    ai.prepare_sequences(sequence_length, sparse_labels=True)
+    prepare_seconds = time.perf_counter() - start
+
+    ai.create_model(sequence_length)
+    ai.metrics.reset()
+    ai.train(epochs=epochs, batch_size=batch_size, validation_split=0.0)
+    train = ai.metrics.as_dict()
+
+    ai.metrics.reset()
+    ai.generate_notes(length=1, start=0)
+    first_call_seconds = ai.metrics.stages['generate']['seconds']
+    ai.metrics.reset()
+    generated = ai.generate_notes(length=generation_length, start=0)
+    generate = ai.metrics.as_dict()
+
+    midi_seconds = best_time(lambda: ai.create_midi_from_notes(generated, io.BytesIO(), fast=True), repeats)
+    midi_bytes = len(midi_io.encode_midi(generated))
+
+    return {
+        'parameters': {
+            'n_files': n_files, 'notes_per_file': notes_per_file,
+            'sequence_length': sequence_length, 'epochs': epochs, 'batch_size': batch_size,
+            'generation_length': generation_length, 'workers': workers,
+            'fast_reader': fast_reader, 'seed': seed,
+        },
+        'extract': {
+            'seconds': extract['stages']['extract']['seconds'],
+            'files': extract['counters'].get('files_parsed', 0),
+            'notes': len(notes),
+            'notes_per_second': extract['rates'].get('notes_per_second'),
+        },
+        'prepare': {
+            'seconds': prepare_seconds,
+            'windows': len(ai.network_input),
+            'windows_per_second': len(ai.network_input) / prepare_seconds,
+        },
+        'train': {
+            'seconds': train['stages']['train']['seconds'],
+            'samples': train['counters']['samples_trained'],
+            'samples_per_second': train['rates']['samples_per_second'],
+        },
+        'generate': {
+            'first_call_seconds': first_call_seconds,
+            'notes': len(generated),
+            'ms_per_note': generate['rates']['ms_per_generated_note'],
+        },
+        'write_midi': {
+            'seconds': midi_seconds,
+            'bytes': midi_bytes,
+            'bytes_per_second': midi_bytes / midi_seconds,
+            'notes_per_second': len(generated) / midi_seconds,
+        },
+        'peak_memory_bytes': ai.metrics.peak_memory,
+    }
+
+
+def bench_inference(n_notes=200, sequence_length=32, preset='small'):
+    """Compare the Keras bundle with the exported TFLite step model
+
+    Each runtime loads and generates in its own interpreter, so the peak
+    memory and cold-load times include only what that path imports.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        ai = MusicAI(config={'model': {'preset': preset}})
+        ai.create_sample_training_data()
+        ai.prepare_sequences(sequence_length, sparse_labels=True)
+        ai.create_model(sequence_length)
+        ai.train(epochs=1, validation_split=0.0)
+        bundle_dir = ai.save_model(os.path.join(tmp, 'bundle'))
+        export_dir = ai.export_inference(os.path.join(tmp, 'inference'))
+
+        results = {'n_notes': n_notes, 'preset': preset}
+        for mode, path in (('keras', bundle_dir), ('tflite', export_dir)):
+            completed = subprocess.run(
+                [sys.executable, '-c', INFERENCE_SCRIPT, mode, path, str(n_notes)],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True, check=True
+            )
+            results[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(tmp)
+    return results
+
+
+def environment():
+    """Describe the machine and code version a result was measured on"""
+    import numpy
+    import tensorflow
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'tensorflow': tensorflow.__version__,
+    }
+
+
+def run_suite(size='small', **overrides):
+    """Run the pipeline benchmark at a preset size and return a JSON-ready result"""
+    parameters = dict(SUITES[size], **overrides)
+    return {'suite': size, 'environment': environment(), 'pipeline': bench_pipeline(**parameters)}
+
+
+# Metrics compared by compare_results; True means higher is better
+REGRESSION_METRICS = {
+    ('extract', 'notes_per_second'): True,
+    ('prepare', 'windows_per_second'): True,
+    ('train', 'samples_per_second'): True,
+    ('generate', 'ms_per_note'): False,
+    ('write_midi', 'bytes_per_second'): True,
+}
+
+
+def compare_results(baseline, current):
+    """Relative change of each tracked metric; positive values are improvements"""
+    changes = {}
+    for (stage, metric), higher_is_better in REGRESSION_METRICS.items():
+        before = baseline['pipeline'][stage].get(metric)
+        after = current['pipeline'][stage].get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        changes[f"{stage}.{metric}"] = change if higher_is_better else -change
+    return changes
+
+
+def bench_midi_writer(n_notes=2000, repeats=5):
+    """Compare the music21 MIDI writer against the direct midi_io encoder"""
+    ai = MusicAI()
+    tokens = random_tokens(n_notes)
+    music21_time = best_time(lambda: ai.create_midi_from_notes(tokens, io.BytesIO()), repeats)
+    fast_time = best_time(lambda: ai.create_midi_from_notes(tokens, io.BytesIO(), fast=True), repeats)
+    return {
+        'n_notes': n_notes,
+        'music21_seconds': music21_time,
+        'fast_seconds': fast_time,
+        'speedup': music21_time / fast_time,
+    }
+
+
+def bench_midi_reader(n_notes=2000, repeats=3):
+    """Compare music21 parsing against the raw midi_io event reader"""
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'bench.mid')
+        midi_io.write_midi(random_tokens(n_notes), path)
+        music21_time = best_time(lambda: parse_midi_notes(path), repeats)
+        fast_time = best_time(lambda: parse_midi_notes(path, fast=True), repeats)
+    finally:
+        shutil.rmtree(tmp)
+    return {
+        'n_notes': n_notes,
+        'music21_seconds': music21_time,
+        'fast_seconds': fast_time,
+        'speedup': music21_time / fast_time,
+    }
+
+
+def bench_startup():
+    """Measure cold-start time to the first window and the first generated note
+
+    Runs in a fresh interpreter so module imports are counted. The window
+    time is None when no display is available.
+    """
+    completed = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_micro_benchmarks():
+    for label, bench in (("MIDI writer", bench_midi_writer), ("MIDI reader", bench_midi_reader)):
+        result = bench()
+        print(f"{label}, {result['n_notes']} notes: "
+              f"music21 {result['music21_seconds'] * 1000:.1f} ms, "
+              f"fast {result['fast_seconds'] * 1000:.1f} ms "
+              f"({result['speedup']:.0f}x)")
+    inference = bench_inference()
+    for mode in ('keras', 'tflite'):
+        print(f"Inference ({mode}): load {inference[mode]['load_seconds']:.2f} s, "
+              f"{inference[mode]['ms_per_note']:.2f} ms/note, "
+              f"peak memory {inference[mode]['peak_memory_bytes'] / 2 ** 20:.0f} MiB")
+    startup = bench_startup()
+    window = startup['first_window_seconds']
+    print(f"Startup: imports {startup['import_seconds']:.2f} s, "
+          f"first window {'n/a' if window is None else f'{window:.2f} s'}, "
+          f"first generation {startup['first_generation_seconds']:.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the music generation pipeline")
+    parser.add_argument('--suite', choices=sorted(SUITES),
+                        help="run the synthetic-corpus pipeline suite at this size")
+    parser.add_argument('--output', help="write the suite result to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON result to compare against")
+    parser.add_argument('--fast-reader', action='store_true',
+                        help="extract the suite corpus with the midi_io event reader instead of music21")
+    args = parser.parse_args()
+
+    if args.suite is None:
+        print_micro_benchmarks()
+    else:
+        result = run_suite(args.suite, fast_reader=args.fast_reader)
+        pipeline = result['pipeline']
+        print(f"Suite '{args.suite}' at {result['environment']['commit']}: "
+              f"extract {pipeline['extract']['notes_per_second']:.0f} notes/s, "
+              f"prepare {pipeline['prepare']['windows_per_second']:.0f} windows/s, "
+              f"train {pipeline['train']['samples_per_second']:.0f} samples/s, "
+              f"generate {pipeline['generate']['ms_per_note']:.2f} ms/note, "
+              f"MIDI {pipeline['write_midi']['bytes_per_second'] / 1e6:.1f} MB/s")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+        if args.compare:
+            with open(args.compare, 'r') as f:
+                baseline = json.load(f)
+            for name, change in compare_results(baseline, result).items():
+                print(f"  {name}: {change:+.1%}")
@@ -0,0 +1,128 @@
+"""
+Multi-worker training for MusicAI on a single machine
+Launches one process per worker with a TF_CONFIG cluster of localhost
+ports; every worker memory-maps the same dataset artifact (see
+MusicAI.save_dataset) and trains its shard under
+MultiWorkerMirroredStrategy. Run a worker by hand with:
+python distributed_training.py --task '<json>'
+"""
+
+import argparse
+import copy
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
+
+def free_ports(count):
+    """Reserve `count` free localhost ports"""
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket()
+            sock.bind(('localhost', 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def local_cluster(n_workers):
+    """TF_CONFIG cluster spec for n_workers processes on this machine"""
+    return {'worker': [f"localhost:{port}" for port in free_ports(n_workers)]}
+
+
+def worker_config(config, index, n_workers):
+    """The MusicAI config for one worker of a multi-worker run"""
+    config = copy.deepcopy(config)
+    training = config.setdefault('training', {})
+    training.setdefault('distribution', {})['strategy'] = 'multi_worker' if n_workers > 1 else 'default'
+    checkpoint = training.get('checkpoint', {})
+    if index > 0 and checkpoint.get('enabled'):
+        # Only the chief writes the shared checkpoint directory
+        checkpoint['dir'] = os.path.join(checkpoint.get('dir', 'models/checkpoints'), f"worker-{index}")
+    return config
+
+
+def run_worker(task):
+    """Train one worker and return its per-epoch losses
+
+    task holds dataset_dir, sequence_length, epochs, batch_size (per
+    replica), config, index and n_workers, and optionally bundle_dir, which
+    the chief (index 0) saves the trained model to.
+    """
+    from ai_music_model import MusicAI, keras
+
+    ai = MusicAI(config=worker_config(task['config'], task['index'], task['n_workers']))
+    # The strategy must exist before TensorFlow runs any op
+    strategy = ai.get_strategy()
+    keras.utils.set_random_seed(ai.config['training'].get('seed') or 0)
+    ai.load_dataset(task['dataset_dir'], sequence_length=task['sequence_length'], sparse_labels=True)
+    ai.create_model(task['sequence_length'])
+    ai.train(epochs=task['epochs'], batch_size=task['batch_size'], streaming=True, validation_split=0.0)
+    if task['index'] == 0 and task.get('bundle_dir'):
+        ai.save_model(task['bundle_dir'])
+    return {
+        'index': task['index'],
+        'replicas': strategy.num_replicas_in_sync,
+        'loss': [float(loss) for loss in ai.model.history.history['loss']],
+        'metrics': ai.metrics.as_dict(),
+    }
+
+
+def launch_local_workers(dataset_dir, n_workers=2, sequence_length=100, epochs=10, batch_size=64,
+                         config=None, bundle_dir=None, threads_per_worker=None, timeout=None):
+    """Train on n_workers local processes and return each worker's result
+
+    Each worker gets threads_per_worker intra-op threads (by default the
+    cores split evenly). batch_size is per worker, so the global batch is
+    batch_size * n_workers.
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // n_workers)
+    cluster = local_cluster(n_workers)
+    processes = []
+    for index in range(n_workers):
+        task = {
+            'dataset_dir': dataset_dir, 'sequence_length': sequence_length, 'epochs': epochs,
+            'batch_size': batch_size, 'config': config or {}, 'index': index,
+            'n_workers': n_workers, 'bundle_dir': bundle_dir,
+        }
+        env = dict(os.environ,
+                   TF_CONFIG=json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}}),
+                   TF_NUM_INTRAOP_THREADS=str(threads_per_worker),
+                   TF_CPP_MIN_LOG_LEVEL='2')
+        output = tempfile.TemporaryFile(mode='w+')
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--task', json.dumps(task)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, stdout=output, stderr=subprocess.STDOUT, text=True
+        )
+        processes.append((process, output))
+
+    results = []
+    try:
+        for process, output in processes:
+            process.wait(timeout=timeout)
+            output.seek(0)
+            lines = output.read().strip().splitlines()
+            if process.returncode != 0:
+                raise RuntimeError(f"Training worker failed:\n" + "\n".join(lines[-20:]))
+            results.append(json.loads(lines[-1]))
+    finally:
+        for process, output in processes:
+            if process.poll() is None:
+                process.kill()
+            output.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one MusicAI training worker")
+    parser.add_argument('--task', required=True, help="JSON task description (see run_worker)")
+    args = parser.parse_args()
+    print(json.dumps(run_worker(json.loads(args.task))))
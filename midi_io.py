@@ -0,0 +1,557 @@
+"""
+Lightweight MIDI encoding and decoding for MusicAI note tokens
+Writes note/chord token lists straight to Standard MIDI File bytes,
+producing the same file music21 writes for the equivalent stream, and
+reads token lists back out of MIDI track events without building a
+music21 score. Also packs timed notes, chords and time shifts into
+integer event codes for the rhythm-aware 'events' token scheme.
+"""
+
+import functools
+import math
+import os
+import re
+import struct
+from collections import defaultdict, deque
+from fractions import Fraction
+
+import numpy as np
+
+TICKS_PER_QUARTER = 10080
+VELOCITY = 90
+TEMPO_USEC_PER_QUARTER = 500000
+
+_PITCH_PATTERN = re.compile(r'^([A-Ga-g])([#-]*)(-?\d+)$')
+_STEP_SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+PITCH_NAMES = ('C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B')
+QUANTIZE_DIVISORS = (4, 3)
+PERCUSSION_CHANNEL = 9
+
+# Event codes pack kind << 24 | value << 8 | duration index into an int32.
+# NOTE values are MIDI numbers, CHORD values 12-bit pitch-class masks;
+# SHIFT events advance time by their duration before the next onset.
+# Code 0 is the unknown-token bucket of a pruned vocabulary.
+EVENT_UNKNOWN = 0
+EVENT_NOTE = 1
+EVENT_CHORD = 2
+EVENT_SHIFT = 3
+# Durations and time shifts in twelfths of a quarter note (the 1/4 and 1/3 grid)
+DURATION_TWELFTHS = (1, 2, 3, 4, 6, 8, 9, 12, 15, 16, 18, 20, 21, 24, 30, 36, 42, 48, 72, 96)
+# Stands for tokens pruned from the vocabulary; it is skipped when writing MIDI
+UNKNOWN_TOKEN = '<unk>'
+
+
+class UnsupportedMidiError(ValueError):
+    """Raised when a file needs music21's full parser to be read faithfully"""
+
+
+def pitch_to_midi(name):
+    """Convert a music21 pitch name such as 'C#4' or 'E-3' to a MIDI number"""
+    match = _PITCH_PATTERN.match(name)
+    if match is None:
+        # Microtones need per-channel pitch bends, which only music21 writes
+        raise ValueError(f"Unsupported pitch token for the fast MIDI writer: {name!r}")
+    step, accidentals, octave = match.groups()
+    alter = accidentals.count('#') - accidentals.count('-')
+    return (int(octave) + 1) * 12 + _STEP_SEMITONES[step.upper()] + alter
+
+
+def token_pitches(token):
+    """Return the MIDI numbers sounded by a note or chord token"""
+    if '.' in token or token.isdigit():
+        # Chord tokens are pitch classes; music21 places small integers in octave 4
+        pitches = []
+        for pitch_class in token.split('.'):
+            number = int(pitch_class)
+            pitches.append(number if number >= 12 else 60 + number)
+        return pitches
+    return [pitch_to_midi(token)]
+
+
+def _variable_length(value):
+    """Encode a delta time as a MIDI variable-length quantity"""
+    data = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        data.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(data)
+
+
+def _chunk(kind, data):
+    return kind + struct.pack('>I', len(data)) + data
+
+
+def encode_midi(tokens, step=0.5, duration=1.0):
+    """Encode note/chord tokens as Standard MIDI File bytes
+
+    Token i starts at i * step quarter notes and lasts `duration` quarters,
+    matching MusicAI.create_midi_from_notes.
+    """
+    return encode_elements([(index * step, duration, token_pitches(token))
+                            for index, token in enumerate(tokens)])
+
+
+def encode_elements(elements):
+    """Encode (offset, duration, pitches) elements, in quarter notes, as MIDI bytes"""
+    # (tick, 0 for note-off / 1 for note-on, order, pitch); offs sort before ons
+    events = []
+    for offset, duration, pitches in elements:
+        start = round(offset * TICKS_PER_QUARTER)
+        end = start + round(duration * TICKS_PER_QUARTER)
+        for pitch in pitches:
+            events.append((start, 1, len(events), pitch))
+            events.append((end, 0, len(events), pitch))
+    events.sort()
+
+    conductor = (
+        b'\x00\xff\x51\x03' + TEMPO_USEC_PER_QUARTER.to_bytes(3, 'big')
+        + b'\x00\xff\x58\x04\x04\x02\x18\x08'
+        + _variable_length(TICKS_PER_QUARTER) + b'\xff\x2f\x00'
+    )
+
+    track = bytearray(b'\x00\xff\x03\x00\x00\xe0\x00\x40')
+    now = 0
+    for tick, is_on, _, pitch in events:
+        track += _variable_length(tick - now)
+        track += bytes((0x90, pitch, VELOCITY) if is_on else (0x80, pitch, 0))
+        now = tick
+    track += _variable_length(TICKS_PER_QUARTER) + b'\xff\x2f\x00'
+
+    header = struct.pack('>HHH', 1, 2, TICKS_PER_QUARTER)
+    return (_chunk(b'MThd', header) + _chunk(b'MTrk', conductor)
+            + _chunk(b'MTrk', bytes(track)))
+
+
+def write_midi(tokens, target, step=0.5, duration=1.0):
+    """Write tokens as a MIDI file to a path or a binary file-like object
+
+    Returns the number of bytes written.
+    """
+    return write_bytes(encode_midi(tokens, step=step, duration=duration), target)
+
+
+def write_bytes(data, target):
+    """Write encoded MIDI bytes to a path or binary file-like object
+
+    Missing parent directories of a path are created. Returns the number
+    of bytes written.
+    """
+    if hasattr(target, 'write'):
+        target.write(data)
+    else:
+        if os.path.dirname(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+    return len(data)
+
+
+def midi_to_pitch_name(number):
+    """Spell a MIDI number the way music21 does, e.g. 63 -> 'E-4'"""
+    return f"{PITCH_NAMES[number % 12]}{number // 12 - 1}"
+
+
+@functools.lru_cache(maxsize=None)
+def chord_token(pitch_classes):
+    """Return the normalOrder token for a sorted tuple of pitch classes"""
+    # normalOrder depends only on the pitch-class set, so each set is computed once
+    from music21 import chord
+    return '.'.join(str(n) for n in chord.Chord(list(pitch_classes)).normalOrder)
+
+
+def _read_variable_length(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _read_track(data, time_signatures):
+    """Return (tick, is_note_on, channel, pitch) note events of one track chunk"""
+    events = []
+    tick = 0
+    pos = 0
+    status = 0
+    while pos < len(data):
+        delta, pos = _read_variable_length(data, pos)
+        tick += delta
+        if data[pos] & 0x80:
+            status = data[pos]
+            pos += 1
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = _read_variable_length(data, pos + 1)
+            if meta_type == 0x58:
+                time_signatures.add((tick, data[pos], 2 ** data[pos + 1]))
+            elif meta_type == 0x2F:
+                break
+            pos += length
+        elif status in (0xF0, 0xF7):
+            length, pos = _read_variable_length(data, pos)
+            pos += length
+        else:
+            kind = status & 0xF0
+            if kind in (0x80, 0x90):
+                pitch, velocity = data[pos], data[pos + 1]
+                events.append((tick, kind == 0x90 and velocity > 0, status & 0x0F, pitch))
+            pos += 1 if kind in (0xC0, 0xD0) else 2
+    return events
+
+
+def _read_tracks(data):
+    """Split Standard MIDI File bytes into per-track note events"""
+    if data[:4] != b'MThd':
+        raise UnsupportedMidiError("Not a Standard MIDI File.")
+    header_length = struct.unpack('>I', data[4:8])[0]
+    _, n_tracks, division = struct.unpack('>HHH', data[8:14])
+    if division & 0x8000:
+        raise UnsupportedMidiError("SMPTE time division is not supported.")
+
+    tracks = []
+    time_signatures = set()
+    pos = 8 + header_length
+    while pos + 8 <= len(data) and len(tracks) < n_tracks:
+        kind = data[pos:pos + 4]
+        length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        if kind == b'MTrk':
+            tracks.append(_read_track(data[pos + 8:pos + 8 + length], time_signatures))
+        pos += 8 + length
+    return division, tracks, time_signatures
+
+
+def _pair_notes(events):
+    """Match each note-on with the first later unused note-off of its pitch and channel"""
+    note_offs = defaultdict(deque)
+    for index, (_, is_on, channel, pitch) in enumerate(events):
+        if not is_on:
+            note_offs[channel, pitch].append(index)
+
+    notes = []
+    for index, (tick, is_on, channel, pitch) in enumerate(events):
+        if not is_on:
+            continue
+        pending = note_offs[channel, pitch]
+        while pending and pending[0] < index:
+            pending.popleft()
+        if pending:
+            notes.append((tick, events[pending.popleft()][0], pitch))
+    return notes
+
+
+def _group_chords(notes, ticks_per_quarter):
+    """Collect notes starting together into chords, as music21's MIDI import does"""
+    tolerance = ticks_per_quarter / max(QUANTIZE_DIVISORS)
+    gathered = set()
+    groups = []
+    for i, (start, end, _) in enumerate(notes):
+        if i in gathered:
+            continue
+        group = [notes[i]]
+        for j in range(i + 1, len(notes)):
+            if abs(notes[j][0] - start) >= tolerance:
+                break
+            if abs(notes[j][1] - end) > tolerance:
+                # Different end time: music21 keeps it as a separate element in another voice
+                continue
+            gathered.add(j)
+            group.append(notes[j])
+        groups.append(group)
+    return groups
+
+
+def _nearest_multiple(value, unit):
+    """Nearest multiple of unit, rounding halves down (music21 nearestMultiple)"""
+    low = unit * math.floor(value / unit)
+    if value <= low + unit / 2:
+        return low, round(value - low, 7)
+    return low + unit, round(low + unit - value, 7)
+
+
+def _exact_gap(start, stop):
+    """Distance between two grid offsets, as music21 computes it with exact fractions"""
+    grid = math.lcm(*QUANTIZE_DIVISORS)
+    return round((stop - start) * grid) / grid
+
+
+def _quantize(value, zero_allowed=True, gap=0.0):
+    """Snap a quarter-length value to the 1/4 or 1/3 grid (music21 Stream.quantize)"""
+    found = []
+    for divisor in QUANTIZE_DIVISORS:
+        unit = 1 / divisor
+        match, error = _nearest_multiple(value, unit)
+        if not zero_allowed and match == 0.0:
+            match = unit
+            error = abs(round(value - match, 7))
+        remaining_gap = 0.0 if gap % unit == 0 else max(gap - match, 0.0)
+        found.append((remaining_gap, error, unit, match))
+    return min(found)[3]
+
+
+def _read_elements(source):
+    """Quantized elements of every part, as music21's MIDI import would build them
+
+    Returns the bar length and a list of (offset, part, insert_order,
+    group, duration), where group holds the (start, end, pitch) notes
+    sounding together.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        data = bytes(source)
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+    try:
+        ticks_per_quarter, tracks, time_signatures = _read_tracks(data)
+    except (IndexError, struct.error):
+        raise UnsupportedMidiError("Truncated MIDI data.")
+
+    if len({signature[1:] for signature in time_signatures}) > 1 or any(
+            tick > 0 for tick, _, _ in time_signatures):
+        raise UnsupportedMidiError("Time signature changes are not supported.")
+    numerator, denominator = next(iter(time_signatures), (0, 4, 4))[1:]
+    bar_length = numerator * 4.0 / denominator
+
+    elements = []
+    for part_index, events in enumerate(tracks):
+        channels = {channel for _, is_on, channel, _ in events if is_on}
+        if PERCUSSION_CHANNEL in channels or len(channels) > 1:
+            raise UnsupportedMidiError("Percussion or multi-channel tracks are not supported.")
+        # Elements are quantized in onset order, but ties after quantization
+        # keep the order in which they were grouped (their music21 insert order)
+        groups = sorted(enumerate(_group_chords(_pair_notes(events), ticks_per_quarter)),
+                        key=lambda item: item[1][0][0])
+        offsets = [_quantize(group[0][0] / ticks_per_quarter) for _, group in groups]
+        # First later offset strictly greater than each element's own offset
+        following = [None] * len(offsets)
+        for index in range(len(offsets) - 2, -1, -1):
+            later = offsets[index + 1]
+            following[index] = later if later > offsets[index] else following[index + 1]
+
+        for index, (insert_order, group) in enumerate(groups):
+            offset = offsets[index]
+            length = max((group[-1][1] - group[-1][0]) / ticks_per_quarter, 0)
+            if following[index] is None:
+                duration = _quantize(length, zero_allowed=False)
+            else:
+                gap = _exact_gap(offset, following[index])
+                duration = _quantize(length, zero_allowed=False, gap=gap)
+            elements.append((offset, part_index, insert_order, group, duration))
+    return bar_length, elements
+
+
+def read_midi_notes(source):
+    """Read note/chord tokens from a MIDI file path or bytes without music21 parsing
+
+    Reproduces converter.parse(...).flatten().notes for ordinary files:
+    simultaneous note-ons become normalOrder chord tokens, offsets and
+    durations are quantized to the same grid, and notes crossing a
+    barline are repeated once per measure as music21's ties are. Raises
+    UnsupportedMidiError for files that need the full parser (percussion,
+    several channels in one track, meter changes, malformed data).
+    """
+    bar_length, elements = _read_elements(source)
+    pieces = []
+    for offset, part_index, insert_order, group, duration in elements:
+        pitches = sorted({pitch % 12 for _, _, pitch in group})
+        token = chord_token(tuple(pitches)) if len(group) > 1 else midi_to_pitch_name(group[0][2])
+
+        # One token per measure the element spans, like music21's tied pieces
+        key = (offset, part_index, 0, insert_order)
+        pieces.append((key, token))
+        end = offset + duration
+        bar_start = (math.floor(offset / bar_length + 1e-9) + 1) * bar_length
+        while bar_start < end - 1e-9:
+            key = (bar_start, part_index, 1, key)
+            pieces.append((key, token))
+            bar_start += bar_length
+
+    pieces.sort(key=lambda piece: piece[0])
+    return [token for _, token in pieces]
+
+
+def read_midi_events(source):
+    """Read a MIDI file path or bytes as packed event codes (see events_from_elements)
+
+    Uses the same quantization as read_midi_notes, but keeps each element
+    whole with its duration instead of repeating it per measure.
+    """
+    _, elements = _read_elements(source)
+    elements.sort(key=lambda element: element[:3])
+    return events_from_elements(
+        [(offset, duration, [pitch for _, _, pitch in group])
+         for offset, _, _, group, duration in elements]
+    )
+
+
+def _duration_index(twelfths):
+    """Index of the DURATION_TWELFTHS entry closest to a duration"""
+    return min(range(len(DURATION_TWELFTHS)), key=lambda i: abs(DURATION_TWELFTHS[i] - twelfths))
+
+
+def pack_event(kind, value, duration_index):
+    return (kind << 24) | (value << 8) | duration_index
+
+
+def unpack_event(code):
+    """Split an event code into (kind, value, duration in quarter notes)"""
+    code = int(code)
+    return code >> 24, (code >> 8) & 0xFFFF, DURATION_TWELFTHS[code & 0xFF] / 12
+
+
+def events_from_elements(elements):
+    """Pack onset-ordered (offset, duration, pitches) elements into an int32 event array
+
+    One note sounds as a NOTE, several as a CHORD of their pitch classes;
+    the time between onsets (including rests) becomes SHIFT events.
+    Durations snap to the nearest DURATION_TWELFTHS value, and shifts are
+    split into exact table values.
+    """
+    codes = []
+    now = 0
+    for offset, duration, pitches in elements:
+        gap = round(offset * 12) - now
+        while gap > 0:
+            shift = max(t for t in DURATION_TWELFTHS if t <= gap)
+            codes.append(pack_event(EVENT_SHIFT, 0, DURATION_TWELFTHS.index(shift)))
+            gap -= shift
+        now = round(offset * 12)
+        duration_index = _duration_index(round(duration * 12))
+        if len(pitches) == 1:
+            codes.append(pack_event(EVENT_NOTE, pitches[0], duration_index))
+        else:
+            mask = 0
+            for pitch in pitches:
+                mask |= 1 << (pitch % 12)
+            codes.append(pack_event(EVENT_CHORD, mask, duration_index))
+    return np.array(codes, dtype=np.int32)
+
+
+def events_from_tokens(tokens, step=0.5, duration=1.0):
+    """Event codes for note/chord tokens laid out as create_midi_from_notes does"""
+    return events_from_elements([(index * step, duration, token_pitches(token))
+                                 for index, token in enumerate(tokens)])
+
+
+def _mask_chord_token(mask):
+    """normalOrder chord token of a CHORD event's pitch-class bit mask"""
+    return chord_token(tuple(pc for pc in range(12) if mask >> pc & 1))
+
+
+def elements_from_events(codes):
+    """Decode event codes back to (offset, duration, pitches) elements"""
+    elements = []
+    now = 0.0
+    for code in codes:
+        kind, value, duration = unpack_event(code)
+        if kind == EVENT_SHIFT:
+            now += duration
+        elif kind == EVENT_NOTE:
+            elements.append((now, duration, [value]))
+        elif kind == EVENT_CHORD:
+            elements.append((now, duration, token_pitches(_mask_chord_token(value))))
+        elif kind != EVENT_UNKNOWN:
+            raise ValueError(f"Unknown event code: {code}")
+    return elements
+
+
+def encode_events(codes):
+    """Encode event codes as Standard MIDI File bytes"""
+    return encode_elements(elements_from_events(codes))
+
+
+def event_label(code):
+    """Readable, reversible name of an event code, e.g. 'E-4:1/2', '0.4.7:1' or 'shift:3/2'"""
+    if int(code) == EVENT_UNKNOWN:
+        return UNKNOWN_TOKEN
+    kind, value, duration = unpack_event(code)
+    length = str(Fraction(duration).limit_denominator(12))
+    if kind == EVENT_SHIFT:
+        return f"shift:{length}"
+    if kind == EVENT_NOTE:
+        return f"{midi_to_pitch_name(value)}:{length}"
+    if kind == EVENT_CHORD:
+        return f"{_mask_chord_token(value)}:{length}"
+    raise ValueError(f"Unknown event code: {code}")
+
+
+def parse_event_label(label):
+    """Event code of a label written by event_label"""
+    if label == UNKNOWN_TOKEN:
+        return EVENT_UNKNOWN
+    name, _, length = label.rpartition(':')
+    if not name:
+        raise ValueError(f"Not an event label: {label!r}")
+    twelfths = Fraction(length) * 12
+    if twelfths.denominator != 1 or int(twelfths) not in DURATION_TWELFTHS:
+        raise ValueError(f"Unsupported event duration in {label!r}")
+    duration_index = DURATION_TWELFTHS.index(int(twelfths))
+    if name == 'shift':
+        return pack_event(EVENT_SHIFT, 0, duration_index)
+    if '.' in name or name.isdigit():
+        mask = 0
+        for pitch_class in name.split('.'):
+            mask |= 1 << (int(pitch_class) % 12)
+        return pack_event(EVENT_CHORD, mask, duration_index)
+    return pack_event(EVENT_NOTE, pitch_to_midi(name), duration_index)
+
+
+def transpose_event(code, semitones):
+    """Transpose an event code; returns None when a note leaves the MIDI range"""
+    kind, value, _ = unpack_event(code)
+    duration_index = int(code) & 0xFF
+    if kind == EVENT_NOTE:
+        pitch = value + semitones
+        return pack_event(EVENT_NOTE, pitch, duration_index) if 0 <= pitch <= 127 else None
+    if kind == EVENT_CHORD:
+        shift = semitones % 12
+        mask = ((value << shift) | (value >> (12 - shift))) & 0xFFF
+        return pack_event(EVENT_CHORD, mask, duration_index)
+    return int(code)
+
+
+def transpose_token(token, semitones):
+    """Transpose a note name, chord normalOrder token or event label by semitones
+
+    Transposed pitches are respelled as music21 spells MIDI numbers. Returns
+    None for tokens that cannot be transposed (microtones, or notes pushed
+    outside the MIDI range).
+    """
+    if ':' in token:
+        code = transpose_event(parse_event_label(token), semitones)
+        return None if code is None else event_label(code)
+    if '.' in token or token.isdigit():
+        return chord_token(tuple(sorted({(int(pc) + semitones) % 12 for pc in token.split('.')})))
+    try:
+        pitch = pitch_to_midi(token) + semitones
+    except ValueError:
+        return None
+    return midi_to_pitch_name(pitch) if 0 <= pitch <= 127 else None
+
+
+@functools.lru_cache(maxsize=None)
+def token_signature(token):
+    """Describe a token as (kind, duration, pitch classes, MIDI pitch)
+
+    kind is 'note', 'chord' or 'shift'; duration is None for plain note and
+    chord tokens, which have no rhythm, and the MIDI pitch is None for
+    anything but single notes. Returns None for tokens with no pitch
+    content: microtones and the unknown token.
+    """
+    duration = None
+    if ':' in token:
+        kind, value, duration = unpack_event(parse_event_label(token))
+        if kind == EVENT_SHIFT:
+            return 'shift', duration, frozenset(), None
+        if kind == EVENT_NOTE:
+            return 'note', duration, frozenset([value % 12]), value
+        token = _mask_chord_token(value)
+    if '.' in token or token.isdigit():
+        return 'chord', duration, frozenset(int(pc) % 12 for pc in token.split('.')), None
+    try:
+        pitch = pitch_to_midi(token)
+    except ValueError:
+        return None
+    return 'note', duration, frozenset([pitch % 12]), pitch
@@ -0,0 +1,299 @@
+"""
+Command-line entry point for running MusicAI without the Tk GUI
+Subcommands cover the pipeline stages (ingest, prepare, train, generate,
+export) and take their defaults from config.json. `generate --count K
+--workers W` is a job mode: K pieces are generated by W worker processes
+that each load the model bundle once, followed by a throughput summary.
+Run `python music_cli.py <command> --help` for the options.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ai_music_model import MusicAI, configure_threads, load_config
+
+# The model loaded by each job-mode worker process, and how long loading took
+_worker_ai = None
+_worker_load_seconds = None
+
+
+def _ingest_options(args, config):
+    paths = config.get('paths', {})
+    return {
+        'midi_folder': args.midi_dir or paths.get('midi_folder', 'output'),
+        'workers': args.workers,
+        'cache_dir': args.cache_dir or paths.get('note_cache_path', 'cache/notes'),
+        'fast_reader': args.fast_reader,
+    }
+
+
+def run_ingest(args, config):
+    """Parse the MIDI folder into the per-file token cache"""
+    ai = MusicAI(config=config)
+    tokens = ai.extract_notes_from_midi(**_ingest_options(args, config))
+    counters = ai.metrics.counters
+    print(f"Ingested {len(ai.note_sources)} files, {len(tokens)} tokens "
+          f"({counters.get('files_parsed', 0)} parsed, {counters.get('files_cached', 0)} cached, "
+          f"{counters.get('files_failed', 0)} failed)")
+    return ai
+
+
+def run_prepare(args, config):
+    """Build the vocabulary and write the dataset artifact
+
+    --update appends only files missing from an existing dataset (see
+    MusicAI.update_corpus) instead of rebuilding it.
+    """
+    ai = MusicAI(config=config)
+    dataset_dir = args.dataset_dir or config.get('paths', {}).get('dataset_path', 'models/dataset')
+    options = _ingest_options(args, config)
+    if args.update:
+        ai.load_dataset(dataset_dir, mmap=False)
+        midi_folder = options.pop('midi_folder')
+        print(f"Added {ai.update_corpus(midi_folder, **options)} tokens to {dataset_dir}")
+    else:
+        ai.extract_notes_from_midi(**options)
+        sequence_length = args.sequence_length or config.get('model', {}).get('sequence_length', 100)
+        ai.prepare_sequences(sequence_length, compact=args.compact, sparse_labels=True)
+    ai.save_dataset(dataset_dir)
+    stats = ai.vocabulary_stats or {}
+    print(f"Dataset {dataset_dir}: {len(ai.encoded_notes)} tokens from {len(ai.note_sources)} files, "
+          f"vocabulary {ai.n_vocab}"
+          + (f" ({stats['coverage']:.1%} of tokens kept as is)" if stats else ""))
+    return ai
+
+
+def run_train(args, config):
+    """Train a model on the dataset artifact and save it as a bundle
+
+    --fine-tune instead loads the bundle and fine-tunes it on MIDI files
+    added since (see MusicAI.fine_tune).
+    """
+    ai = MusicAI(config=config)
+    paths = config.get('paths', {})
+    training = config.get('training', {})
+    bundle_dir = args.bundle_dir or paths.get('model_save_path', 'models/bundle')
+    batch_size = args.batch_size or training.get('batch_size', 64)
+    if args.fine_tune:
+        ai.load_model(bundle_dir, load_dataset=True)
+        options = _ingest_options(args, config)
+        midi_folder = options.pop('midi_folder')
+        n_new = ai.fine_tune(midi_folder, epochs=args.epochs, batch_size=batch_size, **options)
+        if n_new == 0:
+            print("No new MIDI files; the model is unchanged.")
+            return ai
+        print(f"Fine-tuned on {n_new} new tokens (vocabulary {ai.n_vocab})")
+    else:
+        dataset_dir = args.dataset_dir or paths.get('dataset_path', 'models/dataset')
+        sequence_length = args.sequence_length or config.get('model', {}).get('sequence_length', 100)
+        ai.load_dataset(dataset_dir, sequence_length=sequence_length, sparse_labels=True)
+        ai.create_model(sequence_length)
+        ai.train(epochs=args.epochs or training.get('epochs', 20), batch_size=batch_size,
+                 streaming=False if args.in_memory else None)
+    ai.save_model(bundle_dir, include_dataset=True)
+    # A resumed run with no epochs left trains none and records no loss
+    losses = ai.model.history.history.get('loss', [])
+    print(f"Saved {bundle_dir} after {len(losses)} epochs"
+          + (f", loss {losses[-1]:.4f}" if losses else ""))
+    return ai
+
+
+def run_export(args, config):
+    """Export the bundle as a TFLite step model for music_inference"""
+    ai = MusicAI(config=config)
+    paths = config.get('paths', {})
+    ai.load_model(args.bundle_dir or paths.get('model_save_path', 'models/bundle'))
+    export_dir = ai.export_inference(args.export_dir or paths.get('inference_export_path', 'models/inference'))
+    print(f"Exported {export_dir}")
+    return export_dir
+
+
+def _load_worker(bundle_dir, config, threads):
+    """Process initializer: size the thread pools and load the bundle once"""
+    global _worker_ai, _worker_load_seconds
+    start = time.perf_counter()
+    configure_threads(threads)
+    _worker_ai = MusicAI(config=config)
+    _worker_ai.load_model(bundle_dir)
+    _worker_load_seconds = time.perf_counter() - start
+
+
+def _generate_piece(job):
+    """Generate one piece with the worker's model and write it as MIDI"""
+    start = time.perf_counter()
+    rng = np.random.default_rng(job['seed'])
+    notes = _worker_ai.generate_notes(
+        length=job['length'], start=int(rng.integers(2 ** 31)), stateful=job['stateful'],
+        temperature=job['temperature'], top_k=job['top_k'], top_p=job['top_p'],
+        seed=None if job['seed'] is None else int(rng.integers(2 ** 31))
+    )
+    path = _worker_ai.create_midi_from_notes(notes, job['path'], fast=True)
+    return {'path': path, 'notes': len(notes), 'bytes': os.path.getsize(path),
+            'seconds': time.perf_counter() - start, 'worker': os.getpid(),
+            'load_seconds': _worker_load_seconds}
+
+
+def run_jobs(bundle_dir, output_dir, count=1, workers=1, length=100, stateful=False, temperature=None,
+             top_k=None, top_p=None, seed=None, config=None, threads_per_worker=None):
+    """Generate `count` pieces into output_dir with `workers` processes
+
+    Each worker loads the bundle once and gets threads_per_worker
+    intra-op threads (by default the cores split evenly). Piece i is
+    seeded with seed + i when seed is given. With a single worker the
+    pieces are generated in this process. Returns the throughput summary;
+    seconds is the wall time including model loading, ms_per_note the
+    generation time per note within a worker.
+    """
+    if count < 1 or length < 1:
+        raise ValueError("count and length must be positive.")
+    config = load_config() if config is None else config
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(workers, count))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    jobs = [{
+        'path': os.path.join(output_dir, f"piece_{index:04d}.mid"), 'length': length,
+        'stateful': stateful, 'temperature': temperature, 'top_k': top_k, 'top_p': top_p,
+        'seed': None if seed is None else seed + index,
+    } for index in range(count)]
+
+    start = time.perf_counter()
+    if workers == 1:
+        _load_worker(bundle_dir, config, 0)
+        results = [_generate_piece(job) for job in jobs]
+    else:
+        # Spawned workers never inherit a TensorFlow runtime from this process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_load_worker,
+                                 initargs=(bundle_dir, config, threads_per_worker)) as pool:
+            results = list(pool.map(_generate_piece, jobs))
+    seconds = time.perf_counter() - start
+    load_seconds = {result['worker']: result['load_seconds'] for result in results}
+
+    notes = sum(result['notes'] for result in results)
+    generate_seconds = sum(result['seconds'] for result in results)
+    return {
+        'pieces': len(results),
+        'workers': workers,
+        'notes': notes,
+        'bytes': sum(result['bytes'] for result in results),
+        'seconds': seconds,
+        'load_seconds': sum(load_seconds.values()) / len(load_seconds),
+        'pieces_per_second': len(results) / seconds,
+        'notes_per_second': notes / seconds,
+        'ms_per_note': generate_seconds / notes * 1000.0 if notes else None,
+        'files': [result['path'] for result in results],
+    }
+
+
+def run_generate(args, config):
+    """Generate one or more pieces from the bundle"""
+    paths = config.get('paths', {})
+    generation = config.get('generation', {})
+    summary = run_jobs(
+        args.bundle_dir or paths.get('model_save_path', 'models/bundle'),
+        args.output_dir or paths.get('midi_folder', 'output'),
+        count=args.count,
+        workers=args.workers,
+        length=args.length or generation.get('note_generation_length', 100),
+        stateful=args.stateful,
+        temperature=args.temperature,
+        top_k=args.top_k,
+        top_p=args.top_p,
+        seed=args.seed,
+        config=config,
+        threads_per_worker=args.threads_per_worker,
+    )
+    print(f"Generated {summary['pieces']} pieces ({summary['notes']} notes, {summary['bytes'] / 1024:.1f} KiB) "
+          f"in {summary['seconds']:.1f}s with {summary['workers']} workers: "
+          f"{summary['pieces_per_second']:.2f} pieces/s, {summary['notes_per_second']:.0f} notes/s, "
+          f"{summary['ms_per_note']:.2f} ms/note, {summary['load_seconds']:.1f}s model load per worker")
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the MusicAI pipeline from the command line")
+    parser.add_argument('--config', default='config.json', help="configuration file (default: config.json)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def ingest_arguments(command):
+        command.add_argument('--midi-dir', help="MIDI folder (default: paths.midi_folder)")
+        command.add_argument('--cache-dir', help="token cache (default: paths.note_cache_path)")
+        command.add_argument('--workers', type=int, default=1, help="parser processes (0 for every core)")
+        command.add_argument('--fast-reader', action='store_true', help="read MIDI events without music21")
+
+    ingest = commands.add_parser('ingest', help="parse MIDI files into the token cache")
+    ingest_arguments(ingest)
+    ingest.set_defaults(handler=run_ingest)
+
+    prepare = commands.add_parser('prepare', help="build the vocabulary and dataset artifact")
+    ingest_arguments(prepare)
+    prepare.add_argument('--dataset-dir', help="dataset artifact (default: paths.dataset_path)")
+    prepare.add_argument('--sequence-length', type=int, help="default: model.sequence_length")
+    prepare.add_argument('--compact', action='store_true', help="store tokens as uint16")
+    prepare.add_argument('--update', action='store_true', help="only add files missing from the dataset")
+    prepare.set_defaults(handler=run_prepare)
+
+    train = commands.add_parser('train', help="train a model and save the bundle")
+    ingest_arguments(train)
+    train.add_argument('--dataset-dir', help="dataset artifact (default: paths.dataset_path)")
+    train.add_argument('--bundle-dir', help="model bundle (default: paths.model_save_path)")
+    train.add_argument('--sequence-length', type=int, help="default: model.sequence_length")
+    train.add_argument('--epochs', type=int, help="default: training.epochs (training.fine_tune.epochs)")
+    train.add_argument('--batch-size', type=int, help="default: training.batch_size")
+    train.add_argument('--in-memory', action='store_true',
+                       help="feed training from in-memory arrays instead of tf.data")
+    train.add_argument('--fine-tune', action='store_true',
+                       help="fine-tune the saved bundle on new MIDI files instead")
+    train.set_defaults(handler=run_train)
+
+    generate = commands.add_parser('generate', help="generate MIDI files from the bundle")
+    generate.add_argument('--bundle-dir', help="model bundle (default: paths.model_save_path)")
+    generate.add_argument('--output-dir', help="where pieces are written (default: paths.midi_folder)")
+    generate.add_argument('--count', type=positive_int, default=1, help="number of pieces")
+    generate.add_argument('--workers', type=positive_int, default=1, help="worker processes for the pieces")
+    generate.add_argument('--threads-per-worker', type=positive_int, help="default: cores / workers")
+    generate.add_argument('--length', type=positive_int,
+                          help="notes per piece (default: generation.note_generation_length)")
+    generate.add_argument('--stateful', action='store_true', help="feed one token per step")
+    generate.add_argument('--temperature', type=float, help="default: generation.temperature")
+    generate.add_argument('--top-k', type=int, help="default: generation.top_k")
+    generate.add_argument('--top-p', type=float, help="default: generation.top_p")
+    generate.add_argument('--seed', type=int, help="piece i uses seed + i")
+    generate.add_argument('--summary', help="also write the throughput summary to this JSON file")
+    generate.set_defaults(handler=run_generate)
+
+    export = commands.add_parser('export', help="export the bundle for music_inference")
+    export.add_argument('--bundle-dir', help="model bundle (default: paths.model_save_path)")
+    export.add_argument('--export-dir', help="default: paths.inference_export_path")
+    export.set_defaults(handler=run_export)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'workers', 1) == 0:
+        args.workers = os.cpu_count() or 1
+    return args.handler(args, load_config(args.config))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
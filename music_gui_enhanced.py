@@ -1,9 +1,9 @@
 import tkinter as tk
 from tkinter import messagebox, ttk, filedialog
-import music21
 import os
 import threading
-from ai_music_model import MusicAI
+from ai_music_model import MusicAI, warm_up
+from task_runner import TaskRunner
 
 class MusicGeneratorApp:
     def __init__(self, root):
@@ -13,11 +13,24 @@ class MusicGeneratorApp:
         self.root.configure(bg='#2C3E50')
         
         self.ai = MusicAI()
-        self.is_training = False
+        self.tasks = TaskRunner(self.root)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Create UI
         self.create_ui()
         
+        # Import TensorFlow and music21 in the background once the window is up
+        self.root.after(100, self.start_warm_up)
+        
+    def on_close(self):
+        """Cancel running tasks and close the window without waiting for them"""
+        self.tasks.shutdown()
+        self.root.destroy()
+        
+    def start_warm_up(self):
+        """Load the heavy ML libraries without blocking the window"""
+        threading.Thread(target=warm_up, daemon=True).start()
+        
     def create_ui(self):
         # Header
         header_frame = tk.Frame(self.root, bg='#34495E', pady=15)
@@ -150,14 +163,36 @@ class MusicGeneratorApp:
         )
         self.train_button.pack(pady=10)
         
+        tk.Button(
+            step2_frame,
+            text="🔁 Fine-tune on New Files",
+            command=self.fine_tune_model,
+            width=30,
+            bg='#D35400',
+            fg='white',
+            font=("Arial", 10, "bold"),
+            cursor='hand2'
+        ).pack(pady=5)
+        
         # Progress bar
         self.progress = ttk.Progressbar(
             step2_frame,
-            mode='indeterminate',
+            mode='determinate',
+            maximum=100,
             length=400
         )
         self.progress.pack(pady=5)
         
+        tk.Button(
+            step2_frame,
+            text="⏹ Cancel",
+            command=self.cancel_task,
+            width=14,
+            bg='#C0392B',
+            fg='white',
+            cursor='hand2'
+        ).pack(pady=5)
+        
         # Step 3: Generation
         step3_frame = tk.LabelFrame(
             main_frame,
@@ -215,15 +250,50 @@ class MusicGeneratorApp:
         ).pack(side='left', padx=5)
         
     def log(self, message):
-        """Add message to status log"""
+        """Add message to status log (safe to call from any thread)"""
+        if threading.current_thread() is not threading.main_thread():
+            self.tasks.call_soon(self.log, message)
+            return
         self.status_text.insert(tk.END, f"{message}\n")
         self.status_text.see(tk.END)
-        self.status_text.update()
+        
+    def set_progress(self, done, total):
+        """Show task progress as a percentage"""
+        self.progress['value'] = 100.0 * done / total if total else 0
+        
+    def run_task(self, name, task, on_success):
+        """Run task(context) in the background; returns False if another task is running"""
+        if self.tasks.is_busy():
+            messagebox.showwarning("Busy", "Another task is still running!")
+            return False
+        
+        def on_error(error):
+            self.log(f"❌ Error: {str(error)}")
+            messagebox.showerror("Error", str(error))
+        
+        self.set_progress(0, 0)
+        self.tasks.submit(
+            name,
+            task,
+            on_success=on_success,
+            on_error=on_error,
+            on_cancel=lambda: self.log("⏹ Cancelled."),
+            on_log=self.log,
+            on_progress=self.set_progress
+        )
+        return True
+        
+    def cancel_task(self):
+        """Ask running training or generation to stop"""
+        if self.tasks.is_busy():
+            self.log("Cancelling...")
+            self.tasks.cancel_all()
         
     def create_sample(self):
         """Create sample MIDI files for training"""
-        try:
-            self.log("Creating sample MIDI files...")
+        def task(context):
+            import music21
+            context.log("Creating sample MIDI files...")
             if not os.path.exists('output'):
                 os.makedirs('output')
             
@@ -235,17 +305,19 @@ class MusicGeneratorApp:
                 (['G3', 'B3', 'D4', 'G4', 'D4', 'B3'], 'sample_gmajor.mid'),
             ]
             
-            for notes, filename in patterns:
+            for done, (notes, filename) in enumerate(patterns, 1):
                 s = music21.stream.Stream()
                 for p in notes:
                     s.append(music21.note.Note(p, quarterLength=1.0))
                 s.write('midi', fp=f'output/{filename}')
-            
-            self.log(f"✅ Created {len(patterns)} sample MIDI files in 'output/' folder!")
-            messagebox.showinfo("Success", f"Created {len(patterns)} sample MIDI files!")
-        except Exception as e:
-            self.log(f"❌ Error: {str(e)}")
-            messagebox.showerror("Error", str(e))
+                context.progress(done, len(patterns))
+            return len(patterns)
+        
+        def on_success(count):
+            self.log(f"✅ Created {count} sample MIDI files in 'output/' folder!")
+            messagebox.showinfo("Success", f"Created {count} sample MIDI files!")
+        
+        self.run_task('sample', task, on_success)
     
     def import_midi(self):
         """Import MIDI files for training"""
@@ -279,23 +351,23 @@ class MusicGeneratorApp:
     
     def extract_notes(self):
         """Extract notes from MIDI files"""
-        try:
-            self.log("Extracting notes from MIDI files...")
-            notes = self.ai.extract_notes_from_midi('output')
+        def task(context):
+            context.log("Extracting notes from MIDI files...")
+            return self.ai.extract_notes_from_midi('output')
+        
+        def on_success(notes):
             unique_notes = len(set(notes))
-            
             self.log(f"✅ Extracted {len(notes)} notes ({unique_notes} unique)!")
             messagebox.showinfo(
                 "Success", 
                 f"Extracted {len(notes)} notes!\nUnique notes: {unique_notes}"
             )
-        except Exception as e:
-            self.log(f"❌ Error: {str(e)}")
-            messagebox.showerror("Error", str(e))
+        
+        self.run_task('extract', task, on_success)
     
     def train_model(self):
         """Train the AI model"""
-        if self.is_training:
+        if self.tasks.is_busy('train'):
             messagebox.showwarning("Training", "Model is already training!")
             return
         
@@ -303,103 +375,139 @@ class MusicGeneratorApp:
             epochs = int(self.epoch_entry.get())
             batch_size = int(self.batch_entry.get())
             sequence_length = int(self.sequence_entry.get())
-            
-            self.is_training = True
-            self.train_button.config(state='disabled', text="Training...")
-            self.progress.start()
-            
-            # Run training in separate thread
-            thread = threading.Thread(
-                target=self._train_thread,
-                args=(epochs, batch_size, sequence_length)
-            )
-            thread.start()
-            
         except ValueError:
             messagebox.showerror("Error", "Please enter valid numbers!")
-        except Exception as e:
-            self.log(f"❌ Error: {str(e)}")
-            messagebox.showerror("Error", str(e))
-            self.is_training = False
-            self.train_button.config(state='normal', text="🚀 Train Model")
-            self.progress.stop()
-    
-    def _train_thread(self, epochs, batch_size, sequence_length):
-        """Training thread"""
-        try:
-            self.log(f"Preparing sequences (length={sequence_length})...")
+            return
+        
+        def task(context):
+            context.log(f"Preparing sequences (length={sequence_length})...")
             self.ai.prepare_sequences(sequence_length)
-            
-            self.log(f"Creating model...")
+            stats = self.ai.vocabulary_stats
+            context.log(f"Vocabulary: {stats['vocabulary_size']} tokens "
+                        f"({stats['coverage']:.1%} of the corpus kept as is)")
+
+            context.log(f"Creating model...")
             self.ai.create_model(sequence_length)
             
-            self.log(f"Training for {epochs} epochs with batch size {batch_size}...")
-            self.ai.train(epochs=epochs, batch_size=batch_size)
-            
+            context.log(f"Training for {epochs} epochs with batch size {batch_size}...")
+            self.ai.train(
+                epochs=epochs,
+                batch_size=batch_size,
+                progress=context.progress,
+                should_stop=context.is_cancelled
+            )
+        
+        def on_success(result):
             self.log("✅ Training complete!")
-            self.root.after(0, lambda: messagebox.showinfo(
+            messagebox.showinfo(
                 "Success",
                 f"Model trained successfully!\nEpochs: {epochs}"
-            ))
-        except Exception as e:
-            self.log(f"❌ Training error: {str(e)}")
-            self.root.after(0, lambda: messagebox.showerror("Error", str(e)))
-        finally:
-            self.is_training = False
-            self.root.after(0, lambda: self.train_button.config(
+            )
+        
+        if self.run_task('train', task, on_success):
+            self.train_button.config(state='disabled', text="Training...")
+            self.wait_for_task('train', lambda: self.train_button.config(
                 state='normal',
                 text="🚀 Train Model"
             ))
-            self.root.after(0, self.progress.stop)
+    
+    def fine_tune_model(self):
+        """Fine-tune the current model on MIDI files added since it was trained"""
+        if self.ai.model is None:
+            self.log("❌ Error: No trained model! Train or load a model first.")
+            messagebox.showerror("Error", "No trained model! Train or load a model first.")
+            return
+        if self.tasks.is_busy('train'):
+            messagebox.showwarning("Training", "Model is already training!")
+            return
+        try:
+            batch_size = int(self.batch_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter valid numbers!")
+            return
+        
+        def task(context):
+            context.log("Ingesting new MIDI files and fine-tuning...")
+            return self.ai.fine_tune(
+                'output',
+                batch_size=batch_size,
+                progress=context.progress,
+                should_stop=context.is_cancelled
+            )
+        
+        def on_success(new_tokens):
+            if new_tokens == 0:
+                self.log("ℹ️ No new MIDI files to learn from.")
+                return
+            self.log(f"✅ Fine-tuned on {new_tokens} new notes (vocabulary: {self.ai.n_vocab})!")
+            messagebox.showinfo("Success", f"Model fine-tuned!\nNew notes: {new_tokens}")
+        
+        self.run_task('train', task, on_success)
+    
+    def wait_for_task(self, name, callback):
+        """Call callback on the main thread once the named task has finished"""
+        if self.tasks.is_busy(name):
+            self.root.after(200, self.wait_for_task, name, callback)
+        else:
+            callback()
     
     def generate_music(self):
         """Generate music using trained model"""
+        if self.ai.model is None:
+            self.log("❌ Error: No trained model! Train or load a model first.")
+            messagebox.showerror("Error", "No trained model! Train or load a model first.")
+            return
         try:
-            if self.ai.model is None:
-                raise Exception("No trained model! Train or load a model first.")
-            
             output_length = int(self.output_length_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter valid numbers!")
+            return
+        
+        def task(context):
+            context.log(f"Generating {output_length} notes...")
+            generated_notes = self.ai.generate_notes(
+                length=output_length,
+                progress=context.progress,
+                should_stop=context.is_cancelled
+            )
+            context.check_cancelled()
             
-            self.log(f"Generating {output_length} notes...")
-            generated_notes = self.ai.generate_notes(length=output_length)
-            
-            self.log("Creating MIDI file...")
-            filename = self.ai.create_midi_from_notes(
+            context.log("Creating MIDI file...")
+            return self.ai.create_midi_from_notes(
                 generated_notes,
-                'output/ai_generated_music.mid'
+                'output/ai_generated_music.mid',
+                fast=True
             )
-            
+        
+        def on_success(filename):
             self.log(f"✅ Music generated: {filename}")
             messagebox.showinfo(
                 "Success",
                 f"AI Music Generated!\n\nFile: {filename}\nNotes: {output_length}\n\nCheck the output folder!"
             )
-        except Exception as e:
-            self.log(f"❌ Error: {str(e)}")
-            messagebox.showerror("Error", str(e))
+        
+        self.run_task('generate', task, on_success)
     
     def save_model(self):
         """Save the trained model"""
-        try:
-            if self.ai.model is None:
-                raise Exception("No model to save! Train a model first.")
-            
-            self.ai.save_model()
+        if self.ai.model is None:
+            self.log("❌ Error: No model to save! Train a model first.")
+            messagebox.showerror("Error", "No model to save! Train a model first.")
+            return
+        
+        def on_success(result):
             self.log("✅ Model saved successfully!")
             messagebox.showinfo("Success", "Model saved to 'models/' folder!")
-        except Exception as e:
-            self.log(f"❌ Error: {str(e)}")
-            messagebox.showerror("Error", str(e))
+        
+        self.run_task('save', lambda context: self.ai.save_model(), on_success)
     
     def load_model(self):
         """Load a trained model"""
-        try:
-            self.ai.load_model()
+        def on_success(result):
             self.log("✅ Model loaded successfully!")
             messagebox.showinfo("Success", "Model loaded from 'models/' folder!")
-        except Exception as e:
-            self.log(f"❌ Error: {str(e)}")
-            messagebox.showerror("Error", str(e))
+        
+        self.run_task('load', lambda context: self.ai.load_model(), on_success)
     
     def open_output_folder(self):
         """Open the output folder"""
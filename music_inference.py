@@ -0,0 +1,96 @@
+"""
+Lean note generation from an exported MusicAI model
+Loads only the TFLite step model written by MusicAI.export_inference and
+its vocabulary, and runs it with the standalone tflite_runtime interpreter
+when that is installed (falling back to tf.lite). Keras is never imported.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from ai_music_model import INFERENCE_EXPORT_VERSION, load_config, make_sampler
+
+
+def load_interpreter_class():
+    """The TFLite Interpreter class, preferring the small tflite_runtime package"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class MusicInference:
+    """Generate notes one token at a time from an exported step model
+
+    Generation is stateful: the seed window is fed through once and then
+    each sampled token advances the LSTM state, as in
+    MusicAI.generate_notes(stateful=True).
+    """
+
+    def __init__(self, export_dir='models/inference', config=None, num_threads=None):
+        self.config = load_config() if config is None else config
+        with open(os.path.join(export_dir, 'export.json'), 'r') as f:
+            self.metadata = json.load(f)
+        if self.metadata.get('format_version') != INFERENCE_EXPORT_VERSION:
+            raise ValueError(f"Unsupported inference export version: {self.metadata.get('format_version')}")
+        with open(os.path.join(export_dir, 'vocab.json'), 'r') as f:
+            pitchnames = json.load(f)
+        self.note_to_int = {note: number for number, note in enumerate(pitchnames)}
+        self.int_to_note = {number: note for number, note in enumerate(pitchnames)}
+        self.n_vocab = len(pitchnames)
+        self.sequence_length = self.metadata['sequence_length']
+        self.seed_windows = np.load(os.path.join(export_dir, 'seeds.npy'))
+
+        Interpreter = load_interpreter_class()
+        self.interpreter = Interpreter(model_path=os.path.join(export_dir, 'model.tflite'),
+                                       num_threads=num_threads)
+        self.step_runner = self.interpreter.get_signature_runner('step')
+        self.reset()
+
+    def reset(self):
+        """Clear the LSTM states"""
+        self.states = {}
+        for index, units in enumerate(self.metadata['state_sizes']):
+            self.states[f'h{index}'] = np.zeros((1, units), dtype=np.float32)
+            self.states[f'c{index}'] = np.zeros((1, units), dtype=np.float32)
+
+    def step(self, token):
+        """Advance the state by one token and return the next-token probabilities"""
+        outputs = self.step_runner(token=np.array([token], dtype=np.int32), **self.states)
+        for name in self.states:
+            self.states[name] = outputs[f'next_{name}']
+        return outputs['probabilities']
+
+    def _seed_tokens(self, start=None, notes=None):
+        if notes is not None:
+            try:
+                return [self.note_to_int[n] for n in notes]
+            except KeyError as e:
+                raise ValueError(f"Seed note {e} is not in the vocabulary.")
+        if len(self.seed_windows) == 0:
+            raise ValueError("The export has no seed windows; pass seed notes.")
+        if start is None:
+            start = np.random.randint(0, len(self.seed_windows))
+        return [int(token) for token in self.seed_windows[start % len(self.seed_windows)]]
+
+    def generate_notes(self, length=100, start=None, notes=None, temperature=None, top_k=None,
+                       top_p=None, seed=None):
+        """Generate new notes from a stored seed window (start) or a list of seed notes
+
+        Sampling options default to the generation config, as for MusicAI.
+        """
+        sampler = make_sampler(self.config.get('generation', {}), temperature, top_k, top_p, seed)
+        self.reset()
+        probabilities = None
+        for token in self._seed_tokens(start, notes):
+            probabilities = self.step(token)
+        output = []
+        for _ in range(length):
+            index = int(sampler(probabilities)[0])
+            output.append(self.int_to_note[index])
+            probabilities = self.step(index)
+        return output
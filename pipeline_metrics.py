@@ -0,0 +1,180 @@
+"""
+Per-stage timing, counters and memory instrumentation for MusicAI
+Each pipeline stage (extract, windows, train, generate, write_midi, ...)
+records its call count, wall time and the process peak memory; stages
+also bump counters such as notes extracted or MIDI bytes written. The
+totals are available as a dict, JSON or Prometheus text, and a stage
+can optionally be captured with cProfile or the TensorFlow profiler.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILERS = (None, 'cprofile', 'tensorflow')
+
+# (rate name, counter, stage, scale): counter / stage seconds * scale,
+# except ms-per-item rates, which divide the other way round
+RATES = (
+    ('notes_per_second', 'notes_extracted', 'extract', 1.0),
+    ('files_per_second', 'files_parsed', 'extract', 1.0),
+    ('windows_per_second', 'windows_built', 'windows', 1.0),
+    ('samples_per_second', 'samples_trained', 'train', 1.0),
+    ('notes_generated_per_second', 'notes_generated', 'generate', 1.0),
+    ('midi_bytes_per_second', 'midi_bytes_written', 'write_midi', 1.0),
+)
+PER_ITEM_RATES = (
+    ('ms_per_generated_note', 'notes_generated', 'generate', 1000.0),
+)
+
+
+def peak_memory_bytes():
+    """Peak resident set size of this process so far, or None if unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class PipelineMetrics:
+    """Collects stage timings and counters for one MusicAI instance
+
+    profiler is None, 'cprofile' (one .prof file per outermost stage call in
+    output_dir) or 'tensorflow' (a TensorBoard trace per outermost stage).
+    """
+
+    def __init__(self, profiler=None, output_dir='profiles'):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler!r}; expected one of {PROFILERS}.")
+        self.profiler = profiler
+        self.output_dir = output_dir
+        self._depth = 0
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the 'profiling' section of config.json"""
+        return cls(profiler=config.get('profiler'), output_dir=config.get('output_dir', 'profiles'))
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.peak_memory = peak_memory_bytes()
+
+    def count(self, name, amount=1):
+        """Add amount to a counter"""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a block as one call of the named stage"""
+        outermost = self._depth == 0
+        self._depth += 1
+        stop_profiler = self._start_profiler(name) if outermost else None
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            self._depth -= 1
+            if stop_profiler is not None:
+                stop_profiler()
+            peak = peak_memory_bytes()
+            entry = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_memory_bytes': None})
+            entry['calls'] += 1
+            entry['seconds'] += elapsed
+            entry['peak_memory_bytes'] = peak
+            self.peak_memory = peak
+
+    def _start_profiler(self, name):
+        """Start the configured profiler for a stage and return its stop function"""
+        if self.profiler is None:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        calls = self.stages.get(name, {}).get('calls', 0)
+        target = os.path.join(self.output_dir, f"{name}-{calls + 1}")
+        if self.profiler == 'cprofile':
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+
+            def stop():
+                profile.disable()
+                profile.dump_stats(target + '.prof')
+            return stop
+
+        import tensorflow as tf
+        tf.profiler.experimental.start(target)
+        return tf.profiler.experimental.stop
+
+    def rates(self):
+        """Throughput figures derived from counters and stage times"""
+        rates = {}
+        for rate, counter, stage, scale in RATES:
+            seconds = self.stages.get(stage, {}).get('seconds', 0.0)
+            if counter in self.counters and seconds > 0:
+                rates[rate] = self.counters[counter] / seconds * scale
+        for rate, counter, stage, scale in PER_ITEM_RATES:
+            seconds = self.stages.get(stage, {}).get('seconds', 0.0)
+            if self.counters.get(counter):
+                rates[rate] = seconds / self.counters[counter] * scale
+        return rates
+
+    def as_dict(self):
+        return {
+            'stages': {name: dict(entry) for name, entry in self.stages.items()},
+            'counters': dict(self.counters),
+            'rates': self.rates(),
+            'peak_memory_bytes': self.peak_memory,
+        }
+
+    def to_json(self, path=None):
+        """Return the metrics as JSON, also writing them to path if given"""
+        text = json.dumps(self.as_dict(), indent=2)
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, prefix='musicai'):
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def family(name, kind, samples):
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        stages = sorted(self.stages.items())
+        family('stage_calls_total', 'counter',
+               [(f'{{stage="{name}"}}', entry['calls']) for name, entry in stages])
+        family('stage_seconds_total', 'counter',
+               [(f'{{stage="{name}"}}', entry['seconds']) for name, entry in stages])
+        for name, value in sorted(self.counters.items()):
+            family(f'{name}_total', 'counter', [('', value)])
+        for name, value in sorted(self.rates().items()):
+            family(name, 'gauge', [('', value)])
+        if self.peak_memory is not None:
+            family('peak_memory_bytes', 'gauge', [('', self.peak_memory)])
+        return '\n'.join(lines) + '\n'
+
+
+def timed_stage(name):
+    """Method decorator recording each call as a stage of self.metrics"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
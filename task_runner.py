@@ -0,0 +1,148 @@
+"""
+Background task runner for the Tk GUI
+Runs long operations in a worker pool and hands their logs, progress and
+results back to the Tk main loop through a queue that the loop polls.
+"""
+
+import queue
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task when it stops because cancellation was requested"""
+
+
+class TaskContext:
+    """Handle passed to a running task for reporting and cancellation checks"""
+
+    def __init__(self, name, messages):
+        self.name = name
+        self._messages = messages
+        self._cancel = threading.Event()
+
+    def log(self, message):
+        """Queue a log line for the main thread"""
+        self._messages.put(('log', self, message))
+
+    def progress(self, done, total):
+        """Queue a progress update of `done` out of `total` steps"""
+        self._messages.put(('progress', self, (done, total)))
+
+    def cancel(self):
+        """Ask the task to stop at its next checkpoint"""
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Raise TaskCancelled if cancellation was requested"""
+        if self._cancel.is_set():
+            raise TaskCancelled(self.name)
+
+
+class TaskRunner:
+    """Run callables in worker threads and dispatch their events on the Tk thread
+
+    Callbacks (on_log, on_progress, on_success, on_error, on_cancel) are
+    always invoked from the Tk main loop, so they may touch widgets.
+    """
+
+    def __init__(self, root, max_workers=2, poll_ms=50):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.messages = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='task')
+        self.callbacks = {}
+        self.active = set()
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, name, func, on_success=None, on_error=None, on_cancel=None,
+               on_log=None, on_progress=None):
+        """Start func(context) in the pool and return its TaskContext"""
+        context = TaskContext(name, self.messages)
+        self.callbacks[context] = {
+            'success': on_success, 'error': on_error, 'cancelled': on_cancel,
+            'log': on_log, 'progress': on_progress
+        }
+        self.active.add(context)
+        self.pool.submit(self._run, context, func)
+        return context
+
+    def call_soon(self, func, *args):
+        """Run func(*args) on the Tk main thread at the next poll"""
+        self.messages.put(('call', None, (func, args)))
+
+    def is_busy(self, name=None):
+        """Whether any task (or the task with this name) is still running"""
+        return any(name is None or context.name == name for context in self.active)
+
+    def cancel_all(self):
+        for context in list(self.active):
+            context.cancel()
+
+    def shutdown(self):
+        """Cancel every task and drop queued ones without waiting for running ones"""
+        self.cancel_all()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, context, func):
+        try:
+            result = func(context)
+            context.check_cancelled()
+        except TaskCancelled:
+            self.messages.put(('cancelled', context, None))
+        except Exception as e:
+            self.messages.put(('error', context, e))
+        else:
+            self.messages.put(('success', context, result))
+
+    def _poll(self):
+        """Drain queued task events on the main thread, then reschedule
+
+        An exception raised by a callback is reported and skips only that
+        event; polling always continues.
+        """
+        try:
+            while True:
+                try:
+                    kind, context, payload = self.messages.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._dispatch(kind, context, payload)
+                except Exception:
+                    self._report_callback_error(*sys.exc_info())
+        finally:
+            self.root.after(self.poll_ms, self._poll)
+
+    def _dispatch(self, kind, context, payload):
+        """Invoke the callback registered for one queued event"""
+        if kind == 'call':
+            func, args = payload
+            func(*args)
+            return
+        callbacks = self.callbacks.get(context, {})
+        if kind in ('success', 'error', 'cancelled'):
+            self.active.discard(context)
+            self.callbacks.pop(context, None)
+        callback = callbacks.get(kind)
+        if callback is None:
+            return
+        if kind == 'progress':
+            callback(*payload)
+        elif kind == 'cancelled':
+            callback()
+        else:
+            callback(payload)
+
+    def _report_callback_error(self, exc_type, exc_value, exc_traceback):
+        """Report a failed callback the way Tk reports its own callback errors"""
+        report = getattr(self.root, 'report_callback_exception', None)
+        if report is not None:
+            report(exc_type, exc_value, exc_traceback)
+        else:
+            traceback.print_exception(exc_type, exc_value, exc_traceback)
@@ -6,6 +6,10 @@ Tests LSTM model training and generation
 import unittest
 import json
 import os
+import shutil
+import tempfile
+
+import numpy as np
 
 
 class MusicModelConfig:
@@ -342,5 +346,1491 @@ class TestMusicGeneration(unittest.TestCase):
         self.assertEqual(len(inputs), len(outputs))
 
 
+def write_sample_midi(path, pitches):
+    """Write a small MIDI file with a chord followed by single notes"""
+    from music21 import stream, note, chord
+    s = stream.Stream()
+    s.append(chord.Chord(['C4', 'E4', 'G4'], quarterLength=1.0))
+    for p in pitches:
+        s.append(note.Note(p, quarterLength=0.5))
+    s.write('midi', fp=path)
+
+
+class TestLazyImports(unittest.TestCase):
+    """Tests for deferred heavy imports"""
+
+    def test_import_does_not_load_tensorflow(self):
+        """Importing the model and GUI modules leaves TensorFlow and music21 unloaded"""
+        import subprocess
+        import sys
+        script = ("import sys, ai_music_model, music_gui_enhanced; "
+                  "print('tensorflow' in sys.modules, 'music21' in sys.modules)")
+        completed = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                                   text=True, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(completed.stdout.split(), ['False', 'False'])
+
+
+class TestMusicAIIngestion(unittest.TestCase):
+    """Tests for MIDI corpus ingestion"""
+
+    def setUp(self):
+        """Create a small MIDI corpus"""
+        self.tmp = tempfile.mkdtemp()
+        self.midi_dir = os.path.join(self.tmp, 'midi')
+        os.makedirs(self.midi_dir)
+        write_sample_midi(os.path.join(self.midi_dir, 'a.mid'), ['C4', 'D4', 'E4'])
+        write_sample_midi(os.path.join(self.midi_dir, 'b.mid'), ['G4', 'A4'])
+        write_sample_midi(os.path.join(self.midi_dir, 'c.mid'), ['F#4', 'B3', 'C5'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_parallel_matches_serial(self):
+        """Process-pool ingestion produces the serial token order"""
+        from ai_music_model import MusicAI
+        serial = MusicAI().extract_notes_from_midi(self.midi_dir)
+        parallel = MusicAI().extract_notes_from_midi(self.midi_dir, workers=2)
+        self.assertEqual(serial, parallel)
+        self.assertIn('0.4.7', serial)
+
+    def test_cache_skips_unchanged_files(self):
+        """Cached files are not parsed again"""
+        import ai_music_model
+        cache_dir = os.path.join(self.tmp, 'cache')
+        first = ai_music_model.MusicAI().extract_notes_from_midi(self.midi_dir, cache_dir=cache_dir)
+
+        original = ai_music_model.parse_midi_notes
+        ai_music_model.parse_midi_notes = lambda path, *args: self.fail(f"re-parsed {path}")
+        try:
+            second = ai_music_model.MusicAI().extract_notes_from_midi(self.midi_dir, cache_dir=cache_dir)
+        finally:
+            ai_music_model.parse_midi_notes = original
+        self.assertEqual(first, second)
+
+    def test_cache_invalidated_on_change(self):
+        """A modified file is re-parsed"""
+        from ai_music_model import MusicAI
+        cache_dir = os.path.join(self.tmp, 'cache')
+        MusicAI().extract_notes_from_midi(self.midi_dir, cache_dir=cache_dir)
+        write_sample_midi(os.path.join(self.midi_dir, 'b.mid'), ['G4', 'A4', 'B4', 'D5'])
+        cached = MusicAI().extract_notes_from_midi(self.midi_dir, cache_dir=cache_dir)
+        fresh = MusicAI().extract_notes_from_midi(self.midi_dir)
+        self.assertEqual(cached, fresh)
+
+    def test_source_offsets(self):
+        """Each file's first token index is recorded in listing order"""
+        from ai_music_model import MusicAI, parse_midi_notes
+        ai = MusicAI()
+        notes = ai.extract_notes_from_midi(self.midi_dir)
+        for path, offset in ai.note_sources:
+            expected = parse_midi_notes(path)
+            self.assertEqual(notes[offset:offset + len(expected)], expected)
+
+
+class TestMusicAISequences(unittest.TestCase):
+    """Tests for training sequence preparation"""
+
+    def setUp(self):
+        """Create a model with a fixed note corpus"""
+        from ai_music_model import MusicAI
+        self.ai = MusicAI(config={})
+        self.ai.create_sample_training_data()
+        self.ai.notes.extend(['0.4.7', '2.5.9', 'C4'] * 5)
+
+    def reference_sequences(self, seq_len):
+        """Build sequences with the original per-window Python loop"""
+        pitchnames = sorted(set(self.ai.notes))
+        note_to_int = {n: i for i, n in enumerate(pitchnames)}
+        inputs, outputs = [], []
+        for i in range(len(self.ai.notes) - seq_len):
+            inputs.append([note_to_int[n] for n in self.ai.notes[i:i + seq_len]])
+            outputs.append(note_to_int[self.ai.notes[i + seq_len]])
+        inputs = np.reshape(inputs, (len(inputs), seq_len, 1)) / float(len(pitchnames))
+        return inputs, np.array(outputs)
+
+    def test_windows_match_reference(self):
+        """Strided windows equal the original list-based sequences"""
+        expected_in, expected_out = self.reference_sequences(16)
+        network_input, network_output = self.ai.prepare_sequences(16)
+        self.assertEqual(network_input.shape, expected_in.shape)
+        np.testing.assert_array_equal(network_input, expected_in)
+        np.testing.assert_array_equal(network_output, expected_out)
+
+    def test_windows_are_views(self):
+        """Input windows share memory with a single normalized array"""
+        network_input, _ = self.ai.prepare_sequences(16)
+        self.assertFalse(network_input.flags.owndata)
+        low, high = np.byte_bounds(network_input)
+        self.assertLess(high - low, network_input.size * network_input.itemsize)
+
+    def test_compact_dtypes(self):
+        """Compact mode stores uint16 tokens and float32 inputs"""
+        expected_in, _ = self.reference_sequences(16)
+        network_input, _ = self.ai.prepare_sequences(16, compact=True)
+        self.assertEqual(self.ai.encoded_notes.dtype, np.uint16)
+        self.assertEqual(network_input.dtype, np.float32)
+        np.testing.assert_allclose(network_input, expected_in, rtol=1e-6)
+
+    def test_labels_stay_integer_targets(self):
+        """No one-hot matrix is stored; dense targets are only built for an in-memory fit"""
+        _, expected_out = self.reference_sequences(16)
+        for sparse_labels in (True, False):
+            _, network_output = self.ai.prepare_sequences(16, sparse_labels=sparse_labels)
+            self.assertEqual(network_output.ndim, 1)
+            np.testing.assert_array_equal(network_output, expected_out)
+        targets = self.ai._training_targets()
+        self.assertEqual(targets.shape, (len(expected_out), self.ai.n_vocab))
+        np.testing.assert_array_equal(targets.argmax(axis=1), expected_out)
+
+    def test_sparse_loss_matches_dense(self):
+        """Sparse and dense losses agree for the same weights"""
+        network_input, _ = self.ai.prepare_sequences(16)
+        dense_output = self.ai._training_targets()
+        dense_model = self.ai.create_model(16)
+        dense_loss = dense_model.evaluate(network_input[:32], dense_output[:32], verbose=0)
+
+        self.ai.create_model(16, sparse_labels=True)
+        self.ai.model.set_weights(dense_model.get_weights())
+        sparse_loss = self.ai.model.evaluate(
+            network_input[:32], self.ai._training_targets()[:32], verbose=0
+        )
+        self.assertAlmostEqual(dense_loss, sparse_loss, places=5)
+
+    def test_dataset_artifact_round_trip(self):
+        """A memory-mapped dataset rebuilds the same training windows"""
+        from ai_music_model import MusicAI
+        network_input, network_output = self.ai.prepare_sequences(16, compact=True)
+        tmp = tempfile.mkdtemp()
+        try:
+            self.ai.save_dataset(tmp)
+            loaded = MusicAI(config={})
+            tokens = loaded.load_dataset(tmp, sequence_length=16)
+            self.assertIsInstance(tokens, np.memmap)
+            self.assertEqual(loaded.int_to_note, self.ai.int_to_note)
+            np.testing.assert_array_equal(loaded.network_input, network_input)
+            np.testing.assert_array_equal(loaded.network_output, network_output)
+            self.assertEqual(loaded.notes, [])
+            inputs, targets = next(iter(loaded.make_dataset(batch_size=8, shuffle_buffer=0)[0]))
+            np.testing.assert_allclose(inputs.numpy(), network_input[:8], rtol=1e-6)
+            np.testing.assert_array_equal(targets.numpy(), loaded._training_targets()[:8])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_dataset_matches_in_memory_windows(self):
+        """Streamed batches equal the in-memory windows and labels"""
+        network_input, _ = self.ai.prepare_sequences(16)
+        network_output = self.ai._training_targets()
+        train_ds, val_ds = self.ai.make_dataset(batch_size=50, shuffle_buffer=0,
+                                                validation_split=0.2)
+        inputs = np.concatenate([x.numpy() for x, _ in train_ds])
+        targets = np.concatenate([y.numpy() for _, y in train_ds])
+        n_val = sum(len(x) for x, _ in val_ds)
+
+        n_train = len(network_input) - int(len(network_input) * 0.2)
+        self.assertEqual(len(inputs), n_train)
+        self.assertEqual(n_val, len(network_input) - n_train)
+        np.testing.assert_allclose(inputs, network_input[:n_train], rtol=1e-6)
+        np.testing.assert_array_equal(targets, network_output[:n_train])
+
+    def test_streaming_train(self):
+        """Window views train from the tf.data pipeline by default, with validation loss"""
+        self.ai.prepare_sequences(16, sparse_labels=True)
+        self.ai.create_model(16)
+        make_dataset = self.ai.make_dataset
+        calls = []
+        self.ai.make_dataset = lambda **options: calls.append(options) or make_dataset(**options)
+        self.ai.train(epochs=1, batch_size=64, validation_split=0.2)
+        self.assertEqual(len(calls), 1)
+        self.assertIn('val_loss', self.ai.model.history.history)
+
+
+class TestMusicAIGeneration(unittest.TestCase):
+    """Tests for note generation"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Train a tiny model once; an empty config keeps generation greedy"""
+        from ai_music_model import MusicAI
+        cls.ai = MusicAI(config={})
+        cls.ai.create_sample_training_data()
+        cls.ai.prepare_sequences(12, sparse_labels=True)
+        cls.ai.create_model(12)
+        cls.ai.train(epochs=1, batch_size=64, validation_split=0.0)
+
+    def reference_notes(self, start, length):
+        """Greedy generation with a full-window model.predict per note"""
+        window = self.ai.network_input[start].ravel().tolist()
+        output = []
+        for _ in range(length):
+            prediction = self.ai.model.predict(np.reshape(window, (1, len(window), 1)), verbose=0)
+            index = int(np.argmax(prediction))
+            output.append(self.ai.int_to_note[index])
+            window = window[1:] + [index / float(self.ai.n_vocab)]
+        return output
+
+    def test_windowed_matches_predict(self):
+        """Direct-call generation equals the predict-based greedy loop"""
+        notes = self.ai.generate_notes(length=8, start=5)
+        self.assertEqual(notes, self.reference_notes(5, 8))
+
+    def test_stateful_generation(self):
+        """Stateful generation starts from the same greedy note"""
+        notes = self.ai.generate_notes(length=8, start=5, stateful=True)
+        self.assertEqual(len(notes), 8)
+        self.assertEqual(notes[0], self.reference_notes(5, 1)[0])
+        self.assertTrue(all(n in self.ai.note_to_int for n in notes))
+
+    def test_generation_step_is_traced_once(self):
+        """Repeated generation reuses the compiled step until the model is replaced"""
+        from ai_music_model import keras
+        steps = {}
+        for stateful in (False, True):
+            first = self.ai.generate_notes(length=4, start=2, stateful=stateful)
+            step = steps[stateful] = self.ai._generation_step(stateful, 1)
+            traces = step.experimental_get_tracing_count()
+            self.assertEqual(self.ai.generate_notes(length=4, start=2, stateful=stateful), first)
+            self.assertIs(self.ai._generation_step(stateful, 1), step)
+            self.assertEqual(step.experimental_get_tracing_count(), traces)
+        model = self.ai.model
+        try:
+            self.ai.model = keras.models.clone_model(model)
+            self.ai.model.set_weights(model.get_weights())
+            self.assertIsNot(self.ai._generation_step(False, 1), steps[False])
+        finally:
+            self.ai.model = model
+
+    def test_generate_batch_matches_single(self):
+        """Each batched sequence equals generating it alone"""
+        pieces = self.ai.generate_batch([3, 7, 11], length=[6, 4, 5])
+        self.assertEqual([len(p) for p in pieces], [6, 4, 5])
+        self.assertEqual(pieces[1], self.ai.generate_notes(length=4, start=7))
+        self.assertEqual(pieces[2], self.ai.generate_notes(length=5, start=11))
+
+    def test_generate_batch_stop_tokens(self):
+        """A sequence ends after emitting one of its stop tokens"""
+        first = self.ai.generate_notes(length=1, start=3)[0]
+        pieces = self.ai.generate_batch([3, 3], length=6, stop_tokens=[{first}, set()])
+        self.assertEqual(pieces[0], [first])
+        self.assertEqual(len(pieces[1]), 6)
+        # A set or flat list is one stop set shared by every seed
+        for shared in ({first}, [first]):
+            pieces = self.ai.generate_batch([3, 3], length=6, stop_tokens=shared)
+            self.assertEqual(pieces, [[first], [first]])
+        with self.assertRaises(ValueError):
+            self.ai.generate_batch([3, 3], length=6, stop_tokens=[first, {first}])
+        with self.assertRaises(ValueError):
+            self.ai.generate_batch([3, 3], length=6, stop_tokens=[{first}])
+
+    def test_generate_batch_note_seeds(self):
+        """Seeds may be given as note tokens"""
+        seed = self.ai.notes[:12]
+        pieces = self.ai.generate_batch([seed, seed], length=3)
+        self.assertEqual(pieces[0], pieces[1])
+        with self.assertRaises(ValueError):
+            self.ai.generate_batch([['not-a-note'] * 12], length=3)
+
+    def test_model_bundle_round_trip(self):
+        """A loaded bundle generates without the corpus"""
+        from ai_music_model import MusicAI
+        tmp = tempfile.mkdtemp()
+        try:
+            bundle_dir = os.path.join(tmp, 'bundle')
+            self.ai.save_model(bundle_dir)
+            self.assertEqual(sorted(os.listdir(bundle_dir)),
+                             ['metadata.json', 'model.keras', 'seeds.npy', 'vocab.json'])
+            loaded = MusicAI(config={})
+            metadata = loaded.load_model(bundle_dir)
+            self.assertEqual(metadata['sequence_length'], 12)
+            self.assertEqual(metadata['n_vocab'], self.ai.n_vocab)
+            self.assertEqual(loaded.notes, [])
+            self.assertEqual(loaded.generate_notes(length=5, start=0),
+                             self.ai.generate_notes(length=5, start=0))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_legacy_model_next_to_bundle_dir(self):
+        """Old music_model.h5 + notes.pkl files are found relative to bundle_dir and reset the instance"""
+        import pickle
+        from ai_music_model import MusicAI
+        tmp = tempfile.mkdtemp()
+        try:
+            self.ai.model.save(os.path.join(tmp, 'music_model.h5'))
+            with open(os.path.join(tmp, 'notes.pkl'), 'wb') as f:
+                pickle.dump({'notes': self.ai.notes, 'note_to_int': self.ai.note_to_int,
+                             'int_to_note': self.ai.int_to_note, 'n_vocab': self.ai.n_vocab}, f)
+            # An instance still holding another corpus and encoding
+            loaded = MusicAI(config={'model': {'input_encoding': 'embedding'}})
+            loaded.notes = ['A4', 'B4', 'C5'] * 10
+            loaded.prepare_sequences(6, sparse_labels=True, transpositions=[1])
+            loaded.load_model(os.path.join(tmp, 'bundle'))
+            self.assertEqual(loaded.n_vocab, self.ai.n_vocab)
+            self.assertEqual((loaded.input_encoding, loaded.transpositions, loaded.sequence_length),
+                             ('scalar', [], 12))
+            self.assertEqual(len(loaded.network_input), 0)
+            self.assertEqual(len(loaded.encoded_notes), 0)
+            self.assertEqual(loaded.generate_notes(length=3, start=0),
+                             self.ai.generate_notes(length=3, start=0))
+
+            # Too few notes for a seed window: nothing stale is left to seed from
+            with open(os.path.join(tmp, 'notes.pkl'), 'wb') as f:
+                pickle.dump({'notes': self.ai.notes[:5], 'note_to_int': self.ai.note_to_int,
+                             'int_to_note': self.ai.int_to_note, 'n_vocab': self.ai.n_vocab}, f)
+            loaded.load_model(os.path.join(tmp, 'bundle'))
+            self.assertEqual(len(loaded.seed_windows), 0)
+            with self.assertRaises(ValueError):
+                loaded.generate_notes(length=3)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_sampling_is_reproducible(self):
+        """A seeded sampler repeats its output"""
+        first = self.ai.generate_notes(length=10, start=2, temperature=1.5, top_p=0.9, seed=7)
+        second = self.ai.generate_notes(length=10, start=2, temperature=1.5, top_p=0.9, seed=7)
+        self.assertEqual(first, second)
+
+    def test_generation_progress_and_cancel(self):
+        """Progress is reported per note and should_stop ends generation early"""
+        updates = []
+        notes = self.ai.generate_notes(length=6, start=0, progress=lambda done, total: updates.append((done, total)))
+        self.assertEqual(len(notes), 6)
+        self.assertEqual(updates, [(i, 6) for i in range(1, 7)])
+        stopped = self.ai.generate_notes(length=6, start=0, should_stop=lambda: len(updates) >= 9,
+                                         progress=lambda done, total: updates.append((done, total)))
+        self.assertEqual(len(stopped), 3)
+
+    def test_training_progress_and_cancel(self):
+        """Training reports epochs and stops once should_stop returns True"""
+        from ai_music_model import MusicAI
+        ai = MusicAI(config={})
+        ai.create_sample_training_data()
+        ai.prepare_sequences(12, sparse_labels=True)
+        ai.create_model(12)
+        epochs = []
+        ai.train(epochs=3, batch_size=64, progress=lambda done, total: epochs.append((done, total)))
+        self.assertEqual(epochs, [(1, 3), (2, 3), (3, 3)])
+        ai.train(epochs=3, batch_size=64, should_stop=lambda: True)
+        self.assertEqual(len(ai.model.history.history['loss']), 1)
+
+
+class TestPipelineMetrics(unittest.TestCase):
+    """Tests for per-stage metrics and profiling"""
+
+    def test_stages_counters_and_rates(self):
+        """Stages accumulate calls and time; rates divide counters by stage time"""
+        from pipeline_metrics import PipelineMetrics
+        metrics = PipelineMetrics()
+        for _ in range(2):
+            with metrics.stage('generate'):
+                metrics.count('notes_generated', 5)
+        data = metrics.as_dict()
+        self.assertEqual(data['stages']['generate']['calls'], 2)
+        self.assertEqual(data['counters'], {'notes_generated': 10})
+        seconds = data['stages']['generate']['seconds']
+        self.assertAlmostEqual(data['rates']['ms_per_generated_note'], seconds * 100.0)
+        self.assertEqual(json.loads(metrics.to_json()), data)
+
+    def test_prometheus_text(self):
+        """Prometheus output has TYPE lines and labelled stage samples"""
+        from pipeline_metrics import PipelineMetrics
+        metrics = PipelineMetrics()
+        with metrics.stage('extract'):
+            metrics.count('notes_extracted', 3)
+        text = metrics.to_prometheus()
+        self.assertIn('# TYPE musicai_stage_seconds_total counter\n', text)
+        self.assertIn('musicai_stage_calls_total{stage="extract"} 1\n', text)
+        self.assertIn('musicai_notes_extracted_total 3\n', text)
+        self.assertIn('# TYPE musicai_notes_per_second gauge\n', text)
+
+    def test_cprofile_capture(self):
+        """The cProfile switch writes one stats file per outermost stage call"""
+        from pipeline_metrics import PipelineMetrics
+        tmp = tempfile.mkdtemp()
+        try:
+            metrics = PipelineMetrics(profiler='cprofile', output_dir=tmp)
+            with metrics.stage('train'):
+                with metrics.stage('windows'):
+                    sum(range(1000))
+            self.assertEqual(os.listdir(tmp), ['train-1.prof'])
+            with self.assertRaises(ValueError):
+                PipelineMetrics(profiler='perf')
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_music_ai_pipeline_metrics(self):
+        """MusicAI records every stage it runs"""
+        import io
+        import midi_io
+        from ai_music_model import MusicAI
+        ai = MusicAI(config={})
+        ai.create_sample_training_data()
+        ai.prepare_sequences(12, sparse_labels=True)
+        ai.create_model(12)
+        ai.train(epochs=2, batch_size=64, validation_split=0.0)
+        notes = ai.generate_notes(length=4, start=0)
+        ai.create_midi_from_notes(notes, io.BytesIO(), fast=True)
+        data = ai.metrics.as_dict()
+        self.assertEqual(set(data['stages']), {'windows', 'train', 'generate', 'write_midi'})
+        self.assertEqual(data['counters']['windows_built'], len(ai.network_input))
+        self.assertEqual(data['counters']['samples_trained'], 2 * len(ai.network_input))
+        self.assertEqual(data['counters']['notes_generated'], 4)
+        self.assertEqual(data['counters']['midi_bytes_written'], len(midi_io.encode_midi(notes)))
+        self.assertIn('samples_per_second', data['rates'])
+        self.assertGreater(data['peak_memory_bytes'], 0)
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    """Tests for the synthetic-corpus benchmark suite"""
+
+    def test_synthetic_corpus_is_reproducible(self):
+        """The same seed writes byte-identical corpora"""
+        from benchmark_music import make_synthetic_corpus
+        tmp = tempfile.mkdtemp()
+        try:
+            first = make_synthetic_corpus(os.path.join(tmp, 'a'), 3, 40, seed=5)
+            second = make_synthetic_corpus(os.path.join(tmp, 'b'), 3, 40, seed=5)
+            for a, b in zip(first, second):
+                with open(a, 'rb') as fa, open(b, 'rb') as fb:
+                    self.assertEqual(fa.read(), fb.read())
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_pipeline_result_and_comparison(self):
+        """A tiny pipeline run reports every stage and compares against itself"""
+        from benchmark_music import bench_pipeline, compare_results
+        pipeline = bench_pipeline(n_files=2, notes_per_file=60, sequence_length=8, epochs=1,
+                                  generation_length=3, repeats=1)
+        # Notes held across a barline are read back once per measure
+        self.assertGreaterEqual(pipeline['extract']['notes'], 120)
+        self.assertEqual(pipeline['prepare']['windows'], pipeline['extract']['notes'] - 8)
+        self.assertEqual(pipeline['train']['samples'], pipeline['prepare']['windows'])
+        self.assertEqual(pipeline['generate']['notes'], 3)
+        json.dumps(pipeline)
+        result = {'pipeline': pipeline}
+        changes = compare_results(result, result)
+        self.assertEqual(len(changes), 5)
+        self.assertTrue(all(change == 0 for change in changes.values()))
+
+
+class FakeRoot:
+    """Stand-in for Tk that lets tests run scheduled callbacks by hand"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, delay, func, *args):
+        self.scheduled.append((func, args))
+
+    def run_pending(self):
+        pending, self.scheduled = self.scheduled, []
+        for func, args in pending:
+            func(*args)
+
+
+class TestTaskRunner(unittest.TestCase):
+    """Tests for the GUI background task runner"""
+
+    def setUp(self):
+        from task_runner import TaskRunner
+        self.root = FakeRoot()
+        self.runner = TaskRunner(self.root, max_workers=1)
+
+    def tearDown(self):
+        self.runner.shutdown()
+
+    def finish(self, name):
+        """Poll until the named task has been dispatched"""
+        import time
+        deadline = time.time() + 10
+        while self.runner.is_busy(name) and time.time() < deadline:
+            time.sleep(0.01)
+            self.root.run_pending()
+        self.assertFalse(self.runner.is_busy(name))
+
+    def test_events_dispatch_on_poll(self):
+        """Logs, progress and results are delivered in order through the poll loop"""
+        events = []
+
+        def task(context):
+            context.log("working")
+            context.progress(1, 2)
+            context.progress(2, 2)
+            return 42
+
+        self.runner.submit('job', task,
+                           on_success=lambda result: events.append(('success', result)),
+                           on_log=lambda message: events.append(('log', message)),
+                           on_progress=lambda done, total: events.append(('progress', done, total)))
+        self.assertTrue(self.runner.is_busy('job'))
+        self.finish('job')
+        self.assertEqual(events, [('log', 'working'), ('progress', 1, 2),
+                                  ('progress', 2, 2), ('success', 42)])
+
+    def test_errors_and_cancellation(self):
+        """Exceptions reach on_error and cancelled tasks reach on_cancel"""
+        import threading
+        events = []
+        started = threading.Event()
+
+        def failing(context):
+            raise ValueError("bad input")
+
+        def waiting(context):
+            started.set()
+            while not context.is_cancelled():
+                pass
+            context.check_cancelled()
+
+        self.runner.submit('fail', failing, on_error=lambda error: events.append(str(error)))
+        self.finish('fail')
+        self.runner.submit('wait', waiting, on_cancel=lambda: events.append('cancelled'))
+        started.wait(10)
+        self.runner.cancel_all()
+        self.finish('wait')
+        self.assertEqual(events, ['bad input', 'cancelled'])
+
+    def test_failing_callback_keeps_polling(self):
+        """A callback that raises is reported and later events still arrive"""
+        events = []
+        self.root.report_callback_exception = lambda *exc_info: events.append(str(exc_info[1]))
+
+        def fail(message):
+            raise RuntimeError(message)
+
+        self.runner.submit('log', lambda context: context.log("boom"), on_log=fail,
+                           on_success=lambda result: events.append('done'))
+        self.finish('log')
+        self.runner.call_soon(events.append, 'later')
+        self.root.run_pending()
+        self.assertEqual(events, ['boom', 'done', 'later'])
+
+
+class TestModelSettings(unittest.TestCase):
+    """Tests for config-driven model construction"""
+
+    def build(self, model_config):
+        from ai_music_model import MusicAI
+        ai = MusicAI(config={'model': model_config})
+        ai.create_sample_training_data()
+        ai.prepare_sequences(8, sparse_labels=True)
+        ai.create_model(8)
+        return ai
+
+    def test_settings_resolution(self):
+        """Individual keys override the configured preset, which overrides the default"""
+        from ai_music_model import MODEL_PRESETS, model_settings
+        self.assertEqual(model_settings({})['lstm_units'], 256)
+        self.assertEqual(model_settings({'lstm_units': 32, 'num_layers': 2})['lstm_units'], 32)
+        small = model_settings({'preset': 'small', 'lstm_units': 512})
+        self.assertEqual(small['lstm_units'], 512)
+        self.assertEqual(small['num_layers'], MODEL_PRESETS['small']['num_layers'])
+        self.assertEqual(model_settings({'preset': 'small', 'dropout': 0.0})['dropout'], 0.0)
+        medium = model_settings({'preset': 'small', 'lstm_units': 512}, preset='medium')
+        self.assertEqual(medium, dict(medium, **MODEL_PRESETS['medium']))
+        for bad in ({'preset': 'huge'}, {'precision': 'float8'}, {'num_layers': 0}):
+            with self.assertRaises(ValueError):
+                model_settings(bad)
+
+    def test_architecture_from_config(self):
+        """Layer count, widths and dropout follow the config"""
+        from ai_music_model import layers
+        ai = self.build({'lstm_units': 16, 'num_layers': 2, 'dropout': 0.0, 'dense_units': 24})
+        lstms = [layer for layer in ai.model.layers if isinstance(layer, layers.LSTM)]
+        self.assertEqual([layer.units for layer in lstms], [16, 16])
+        self.assertEqual([layer.return_sequences for layer in lstms], [True, False])
+        self.assertFalse(any(isinstance(layer, layers.Dropout) for layer in ai.model.layers))
+        self.assertEqual(ai.model.layers[-2].units, 24)
+
+    def test_mixed_precision_round_trip(self):
+        """A bfloat16 model keeps float32 probabilities and survives a bundle round trip"""
+        from ai_music_model import MusicAI
+        ai = self.build({'preset': 'small', 'precision': 'mixed_bfloat16'})
+        self.assertEqual(ai.model.layers[0].compute_dtype, 'bfloat16')
+        self.assertEqual(ai.model.output.dtype, 'float32')
+        ai.train(epochs=1, batch_size=64, validation_split=0.0)
+        tmp = tempfile.mkdtemp()
+        try:
+            ai.save_model(os.path.join(tmp, 'bundle'))
+            loaded = MusicAI(config={})
+            loaded.load_model(os.path.join(tmp, 'bundle'))
+            self.assertEqual(loaded.generate_notes(length=3, start=0),
+                             ai.generate_notes(length=3, start=0))
+        finally:
+            shutil.rmtree(tmp)
+
+
+class TestCheckpointing(unittest.TestCase):
+    """Tests for checkpointing, resume and plateau callbacks"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_ai(self, **training):
+        from ai_music_model import MusicAI
+        training.setdefault('checkpoint', {'enabled': True, 'dir': self.tmp, 'keep': 2})
+        ai = MusicAI(config={'model': {'preset': 'small'}, 'training': training})
+        ai.create_sample_training_data()
+        ai.prepare_sequences(8, sparse_labels=True)
+        ai.create_model(8)
+        return ai
+
+    def test_resume_after_crash(self):
+        """A crashed run resumes from its last checkpoint with the optimizer state"""
+        from ai_music_model import keras
+
+        def crash(epoch, logs=None):
+            if epoch == 2:
+                raise KeyboardInterrupt
+
+        ai = self.make_ai()
+        with self.assertRaises(KeyboardInterrupt):
+            ai.train(epochs=4, validation_split=0.0,
+                     callbacks=[keras.callbacks.LambdaCallback(on_epoch_begin=crash)])
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ['best.keras', 'epoch-0001.keras', 'epoch-0002.keras', 'state.json'])
+        iterations = int(ai.model.optimizer.iterations.numpy())
+
+        resumed = self.make_ai()
+        resumed.train(epochs=4, validation_split=0.0,
+                      callbacks=[keras.callbacks.LambdaCallback(
+                          on_train_begin=lambda logs: self.assertEqual(
+                              int(resumed.model.optimizer.iterations.numpy()), iterations))])
+        self.assertEqual(resumed.model.history.epoch, [2, 3])
+        self.assertEqual(sorted(f for f in os.listdir(self.tmp) if f.startswith('epoch-')),
+                         ['epoch-0003.keras', 'epoch-0004.keras'])
+        with open(os.path.join(self.tmp, 'state.json')) as f:
+            state = json.load(f)
+        self.assertTrue(state['completed'])
+        self.assertEqual(state['epoch'], 4)
+
+        # A finished run is not resumed: the next call trains from scratch
+        fresh = self.make_ai()
+        fresh.train(epochs=1, validation_split=0.0)
+        self.assertEqual(fresh.model.history.epoch, [0])
+        self.assertEqual(sorted(f for f in os.listdir(self.tmp) if f.startswith('epoch-')),
+                         ['epoch-0001.keras'])
+
+    def test_mismatched_checkpoint_is_not_resumed(self):
+        """A checkpoint of a different model starts a fresh run"""
+        from ai_music_model import keras
+
+        def crash(epoch, logs=None):
+            if epoch == 1:
+                raise KeyboardInterrupt
+
+        ai = self.make_ai()
+        with self.assertRaises(KeyboardInterrupt):
+            ai.train(epochs=3, validation_split=0.0,
+                     callbacks=[keras.callbacks.LambdaCallback(on_epoch_begin=crash)])
+        other = self.make_ai()
+        other.create_model(8, preset='medium')
+        other.train(epochs=1, validation_split=0.0)
+        self.assertEqual(other.model.history.epoch, [0])
+
+        # Same vocabulary size and architecture, but another corpus
+        with self.assertRaises(KeyboardInterrupt):
+            ai.train(epochs=3, validation_split=0.0,
+                     callbacks=[keras.callbacks.LambdaCallback(on_epoch_begin=crash)])
+        shuffled = self.make_ai()
+        shuffled.notes = list(reversed(shuffled.notes))
+        shuffled.prepare_sequences(8, sparse_labels=True)
+        self.assertEqual(shuffled.n_vocab, ai.n_vocab)
+        shuffled.train(epochs=2, validation_split=0.0)
+        self.assertEqual(shuffled.model.history.epoch, [0, 1])
+
+    def test_early_stopping_and_lr_reduction(self):
+        """Plateau callbacks stop training and lower the learning rate"""
+        ai = self.make_ai(
+            checkpoint={},
+            early_stopping={'enabled': True, 'patience': 1, 'min_delta': 100.0},
+            reduce_lr_on_plateau={'enabled': True, 'patience': 0, 'factor': 0.5, 'min_delta': 100.0}
+        )
+        learning_rate = float(ai.model.optimizer.learning_rate.numpy())
+        ai.train(epochs=10, validation_split=0.2)
+        self.assertEqual(ai.model.history.epoch, [0, 1])
+        self.assertLess(float(ai.model.optimizer.learning_rate.numpy()), learning_rate)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+
+class TestDistributedTraining(unittest.TestCase):
+    """Tests for distribution strategies and local multi-worker training"""
+
+    def test_strategy_selection(self):
+        """Unknown strategies are rejected and the default strategy has one replica"""
+        from ai_music_model import make_strategy
+        self.assertEqual(make_strategy({}).num_replicas_in_sync, 1)
+        with self.assertRaises(ValueError):
+            make_strategy({'strategy': 'parameter_server'})
+
+    def test_rebuild_under_strategy(self):
+        """train(strategy=...) moves an existing model and its weights under the strategy"""
+        from ai_music_model import MusicAI, tf
+        ai = MusicAI(config={'model': {'preset': 'small'}})
+        ai.create_sample_training_data()
+        ai.prepare_sequences(8, sparse_labels=True)
+        ai.create_model(8)
+        weights = ai.model.get_weights()
+        strategy = tf.distribute.OneDeviceStrategy('/cpu:0')
+        ai.train(epochs=1, validation_split=0.0, strategy=strategy,
+                 callbacks=[tf.keras.callbacks.LambdaCallback(on_train_begin=lambda logs: [
+                     np.testing.assert_array_equal(a, b) for a, b in zip(weights, ai.model.get_weights())])])
+        self.assertIs(ai.model.distribute_strategy, strategy)
+
+    def test_two_local_workers_match_single_process(self):
+        """Two worker processes converge like one process with the same global batch"""
+        from ai_music_model import MusicAI
+        from distributed_training import launch_local_workers
+        tmp = tempfile.mkdtemp()
+        try:
+            ai = MusicAI(config={})
+            ai.create_sample_training_data()
+            ai.prepare_sequences(8)
+            ai.save_dataset(tmp)
+            config = {'model': {'preset': 'small', 'dropout': 0.0},
+                      'training': {'seed': 3, 'shuffle_buffer': 0}}
+            single = launch_local_workers(tmp, n_workers=1, sequence_length=8, epochs=3,
+                                          batch_size=64, config=config, timeout=300)
+            workers = launch_local_workers(tmp, n_workers=2, sequence_length=8, epochs=3,
+                                           batch_size=32, config=config, timeout=300)
+        finally:
+            shutil.rmtree(tmp)
+        self.assertEqual([result['replicas'] for result in workers], [2, 2])
+        self.assertEqual(workers[0]['loss'], workers[1]['loss'])
+        single_loss, worker_loss = single[0]['loss'], workers[0]['loss']
+        self.assertLess(worker_loss[-1], worker_loss[0])
+        np.testing.assert_allclose(worker_loss, single_loss, rtol=0.02)
+
+
+class TestEmbeddingInput(unittest.TestCase):
+    """Tests for the integer token / Embedding input encoding"""
+
+    @classmethod
+    def setUpClass(cls):
+        from ai_music_model import MusicAI
+        cls.ai = MusicAI(config={'model': {'preset': 'small', 'input_encoding': 'embedding',
+                                           'embedding_dim': 8}})
+        cls.ai.create_sample_training_data()
+        cls.ai.prepare_sequences(12, sparse_labels=True)
+        cls.ai.create_model(12)
+        cls.ai.train(epochs=1, batch_size=64, validation_split=0.0)
+
+    def test_windows_are_token_ids(self):
+        """Embedding windows are integer views of the encoded corpus"""
+        from ai_music_model import layers
+        self.assertEqual(self.ai.network_input.shape, (len(self.ai.encoded_notes) - 12, 12))
+        self.assertTrue(np.issubdtype(self.ai.network_input.dtype, np.integer))
+        np.testing.assert_array_equal(self.ai.network_input[3], self.ai.encoded_notes[3:15])
+        self.assertIsInstance(self.ai.model.layers[0], layers.Embedding)
+        self.assertEqual(self.ai.model.layers[0].output_dim, 8)
+        inputs, _ = next(iter(self.ai.make_dataset(batch_size=4, shuffle_buffer=0)[0]))
+        np.testing.assert_array_equal(inputs.numpy(), self.ai.network_input[:4])
+
+    def test_generation_modes_agree(self):
+        """Windowed, stateful and batched generation share the first greedy note"""
+        windowed = self.ai.generate_notes(length=5, start=2)
+        stateful = self.ai.generate_notes(length=5, start=2, stateful=True)
+        batched = self.ai.generate_batch([2, 4], length=5)
+        self.assertEqual(len(windowed), 5)
+        self.assertEqual(stateful[0], windowed[0])
+        self.assertEqual(batched[0], windowed)
+
+    def test_bundle_records_encoding(self):
+        """The bundle metadata carries the encoding and a loaded model reuses it"""
+        from ai_music_model import MusicAI
+        tmp = tempfile.mkdtemp()
+        try:
+            self.ai.save_model(tmp)
+            with open(os.path.join(tmp, 'metadata.json')) as f:
+                self.assertEqual(json.load(f)['input_encoding'], 'embedding')
+            loaded = MusicAI(config={})
+            loaded.load_model(tmp)
+            self.assertEqual(loaded.input_encoding, 'embedding')
+            self.assertEqual(loaded.generate_notes(length=5, start=0),
+                             self.ai.generate_notes(length=5, start=0))
+        finally:
+            shutil.rmtree(tmp)
+
+
+class TestInferenceExport(unittest.TestCase):
+    """Tests for the TFLite step-model export and MusicInference"""
+
+    def check_export(self, model_config):
+        """Exported step probabilities match the Keras stateful step model"""
+        from ai_music_model import MusicAI
+        from music_inference import MusicInference
+        ai = MusicAI(config={'model': model_config})
+        ai.create_sample_training_data()
+        ai.prepare_sequences(8, sparse_labels=True)
+        ai.create_model(8)
+        ai.train(epochs=1, batch_size=64, validation_split=0.0)
+        tmp = tempfile.mkdtemp()
+        try:
+            ai.export_inference(tmp)
+            self.assertEqual(sorted(os.listdir(tmp)),
+                             ['export.json', 'model.tflite', 'seeds.npy', 'vocab.json'])
+            runtime = MusicInference(tmp, config={})
+        finally:
+            shutil.rmtree(tmp)
+
+        tokens = ai._seed_tokens(3)
+        step_model = ai._build_step_model(1)
+        for token in tokens:
+            expected = step_model(ai._encode_inputs([[token]]), training=False).numpy()
+            np.testing.assert_allclose(runtime.step(token), expected, atol=1e-5)
+        seed = [ai.int_to_note[int(t)] for t in tokens]
+        self.assertEqual(runtime.generate_notes(length=6, notes=seed),
+                         ai.generate_batch([seed], length=6, stateful=True)[0])
+
+    def test_scalar_export(self):
+        self.check_export({'preset': 'medium'})
+
+    def test_embedding_export(self):
+        self.check_export({'preset': 'small', 'input_encoding': 'embedding'})
+
+
+class TestSampleTokens(unittest.TestCase):
+    """Tests for the vectorized token samplers"""
+
+    def setUp(self):
+        """Build a batch of probability rows"""
+        self.probs = np.array([[0.5, 0.3, 0.15, 0.05],
+                               [0.05, 0.15, 0.3, 0.5]])
+
+    def test_zero_temperature_is_argmax(self):
+        """Temperature 0 falls back to greedy decoding"""
+        from ai_music_model import sample_tokens
+        np.testing.assert_array_equal(sample_tokens(self.probs, temperature=0), [0, 3])
+
+    def test_top_k_restricts_support(self):
+        """Only the k most likely tokens are drawn"""
+        from ai_music_model import sample_tokens
+        rng = np.random.default_rng(0)
+        draws = np.stack([sample_tokens(self.probs, 1.0, top_k=2, rng=rng) for _ in range(300)])
+        self.assertTrue(set(draws[:, 0]) <= {0, 1})
+        self.assertTrue(set(draws[:, 1]) <= {2, 3})
+
+    def test_top_p_restricts_support(self):
+        """Nucleus sampling keeps the smallest set reaching top_p"""
+        from ai_music_model import sample_tokens
+        rng = np.random.default_rng(0)
+        draws = np.stack([sample_tokens(self.probs, 1.0, top_p=0.8, rng=rng) for _ in range(300)])
+        self.assertEqual(set(draws[:, 0]), {0, 1})
+        self.assertEqual(set(draws[:, 1]), {2, 3})
+
+    def test_temperature_one_matches_distribution(self):
+        """Unmodified sampling follows the model probabilities"""
+        from ai_music_model import sample_tokens
+        rng = np.random.default_rng(1)
+        batch = np.repeat(self.probs[:1], 20000, axis=0)
+        counts = np.bincount(sample_tokens(batch, 1.0, rng=rng), minlength=4) / len(batch)
+        np.testing.assert_allclose(counts, self.probs[0], atol=0.02)
+
+
+class TestFastMidiWriter(unittest.TestCase):
+    """Tests for the direct MIDI encoder"""
+
+    def setUp(self):
+        """Build a token list mixing notes, chords and accidentals"""
+        from ai_music_model import MusicAI
+        self.ai = MusicAI()
+        self.tokens = ['C4', '0.4.7', 'E-4', 'C4', 'F#5', '11.2', 'C##4', '5', 'B-2', '2.5.9']
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_matches_music21_bytes(self):
+        """The encoder writes the same file as the music21 path"""
+        slow_path = os.path.join(self.tmp, 'slow.mid')
+        fast_path = os.path.join(self.tmp, 'fast.mid')
+        self.ai.create_midi_from_notes(self.tokens, slow_path)
+        self.ai.create_midi_from_notes(self.tokens, fast_path, fast=True)
+        with open(slow_path, 'rb') as slow, open(fast_path, 'rb') as fast:
+            self.assertEqual(slow.read(), fast.read())
+
+    def test_buffer_output(self):
+        """Both writers accept an in-memory buffer"""
+        import io
+        fast = io.BytesIO()
+        slow = io.BytesIO()
+        self.ai.create_midi_from_notes(self.tokens, fast, fast=True)
+        self.ai.create_midi_from_notes(self.tokens, slow)
+        self.assertEqual(fast.getvalue(), slow.getvalue())
+        self.assertTrue(fast.getvalue().startswith(b'MThd'))
+
+    def test_microtones_fall_back(self):
+        """Tokens the encoder cannot represent use music21"""
+        import io
+        import midi_io
+        with self.assertRaises(ValueError):
+            midi_io.encode_midi(['D~4'])
+        buffer = io.BytesIO()
+        self.ai.create_midi_from_notes(['C4', 'D~4'], buffer, fast=True)
+        self.assertTrue(buffer.getvalue().startswith(b'MThd'))
+
+
+def write_random_score(path, rng):
+    """Write a multi-part MIDI file with chords, rests, triplets and ties"""
+    from music21 import stream, note, chord, meter
+    score = stream.Score()
+    for _ in range(rng.choice([1, 2, 3])):
+        part = stream.Part()
+        if rng.random() < 0.3:
+            part.append(meter.TimeSignature(rng.choice(['3/4', '6/8'])))
+        for _ in range(rng.randint(5, 30)):
+            ql = rng.choice([0.25, 0.5, 1, 1.5, 2, 3, 5, 1 / 3, 2 / 3, 1 / 6])
+            roll = rng.random()
+            if roll < 0.3:
+                pitches = [rng.randint(48, 80) for _ in range(rng.randint(2, 4))]
+                part.append(chord.Chord(pitches, quarterLength=ql))
+            elif roll < 0.4:
+                part.append(note.Rest(quarterLength=ql))
+            else:
+                part.append(note.Note(rng.randint(40, 90), quarterLength=ql))
+        score.insert(0, part)
+    score.write('midi', fp=path)
+
+
+class TestFastMidiReader(unittest.TestCase):
+    """Tests for the raw MIDI event reader"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Write a reproducible sample corpus"""
+        import random
+        cls.tmp = tempfile.mkdtemp()
+        rng = random.Random(42)
+        for i in range(20):
+            write_random_score(os.path.join(cls.tmp, f'piece{i:02d}.mid'), rng)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def test_parity_with_music21(self):
+        """Every sample file yields the same tokens as converter.parse"""
+        import midi_io
+        from ai_music_model import parse_midi_notes
+        for name in sorted(os.listdir(self.tmp)):
+            path = os.path.join(self.tmp, name)
+            with self.subTest(file=name):
+                self.assertEqual(midi_io.read_midi_notes(path), parse_midi_notes(path))
+
+    def test_extract_with_fast_reader(self):
+        """Corpus extraction is unchanged by the fast reader"""
+        from ai_music_model import MusicAI
+        expected = MusicAI().extract_notes_from_midi(self.tmp)
+        self.assertEqual(MusicAI().extract_notes_from_midi(self.tmp, fast_reader=True), expected)
+
+    def test_percussion_falls_back(self):
+        """Files the reader cannot reproduce raise and are parsed by music21"""
+        import midi_io
+        from ai_music_model import parse_midi_notes
+        from music21 import stream, note, instrument
+        part = stream.Part([instrument.Woodblock(), note.Note('C4'), note.Note('E4')])
+        drums_dir = tempfile.mkdtemp()
+        path = os.path.join(drums_dir, 'drums.mid')
+        part.write('midi', fp=path)
+        try:
+            with self.assertRaises(midi_io.UnsupportedMidiError):
+                midi_io.read_midi_notes(path)
+            self.assertEqual(parse_midi_notes(path, fast=True), parse_midi_notes(path))
+        finally:
+            shutil.rmtree(drums_dir)
+
+    def test_pitch_spelling(self):
+        """MIDI numbers are spelled like music21 pitch names"""
+        import midi_io
+        self.assertEqual(midi_io.midi_to_pitch_name(63), 'E-4')
+        self.assertEqual(midi_io.midi_to_pitch_name(61), 'C#4')
+        self.assertEqual(midi_io.midi_to_pitch_name(21), 'A0')
+
+
+class TestEventTokens(unittest.TestCase):
+    """Tests for the duration-aware event token scheme"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_score(self, path):
+        """A single part with a rest, triplets, a chord tied across the barline and a tied note"""
+        from music21 import stream, note, chord
+        part = stream.Part()
+        part.append(note.Note('C4', quarterLength=1))
+        part.append(note.Rest(quarterLength=1))
+        part.append(note.Note('E-4', quarterLength=1 / 3))
+        part.append(note.Note('G4', quarterLength=2 / 3))
+        part.append(chord.Chord(['B4', 'D4'], quarterLength=3))
+        part.append(note.Note('B-3', quarterLength=4))
+        part.write('midi', fp=path)
+
+    def test_pack_round_trip(self):
+        """Codes unpack to their kind, value and duration and labels parse back"""
+        import midi_io
+        code = midi_io.pack_event(midi_io.EVENT_NOTE, 63, midi_io.DURATION_TWELFTHS.index(18))
+        self.assertEqual(midi_io.unpack_event(code), (midi_io.EVENT_NOTE, 63, 1.5))
+        for label in ['C4:1', 'E-4:1/3', '0.4.7:2', 'shift:1/2', 'C#5:8']:
+            with self.subTest(label=label):
+                self.assertEqual(midi_io.event_label(midi_io.parse_event_label(label)), label)
+
+    def test_tokens_write_like_notes(self):
+        """Events built from note tokens encode to the same file as the note writer"""
+        import midi_io
+        tokens = ['C4', '0.4.7', 'E-4', 'F#5', '11.2', 'B-2']
+        self.assertEqual(midi_io.encode_events(midi_io.events_from_tokens(tokens)),
+                         midi_io.encode_midi(tokens))
+
+    def test_readers_keep_rhythm(self):
+        """Both readers recover durations, rests and merged ties"""
+        import midi_io
+        from ai_music_model import parse_midi_events
+        path = os.path.join(self.tmp, 'rhythm.mid')
+        self.write_score(path)
+        expected = ['C4:1', 'shift:2', 'E-4:1/3', 'shift:1/3', 'G4:2/3', 'shift:2/3',
+                    '11.2:3', 'shift:3', 'B-3:4']
+        for events in (midi_io.read_midi_events(path), parse_midi_events(path)):
+            self.assertEqual(events.dtype, np.int32)
+            self.assertEqual([midi_io.event_label(code) for code in events], expected)
+
+    def test_train_and_write_events(self):
+        """The events scheme extracts, windows and writes generated tokens back to MIDI"""
+        import io
+        import midi_io
+        from ai_music_model import MusicAI, load_config
+        self.write_score(os.path.join(self.tmp, 'a.mid'))
+        self.write_score(os.path.join(self.tmp, 'b.mid'))
+        config = load_config()
+        config['model']['token_scheme'] = 'events'
+        ai = MusicAI(config=config)
+        events = ai.extract_notes_from_midi(self.tmp, fast_reader=True)
+        self.assertEqual(len(events), 18)
+        self.assertEqual(ai.note_sources[1][1], 9)
+        network_input, _ = ai.prepare_sequences(sequence_length=4, sparse_labels=True)
+        self.assertEqual(len(network_input), 14)
+        self.assertIn('shift:1/3', ai.note_to_int)
+
+        tokens = [ai.int_to_note[int(token)] for token in ai.encoded_notes[:9]]
+        buffer = io.BytesIO()
+        ai.create_midi_from_notes(tokens, buffer)
+        written = midi_io.read_midi_events(buffer.getvalue())
+        self.assertEqual([midi_io.event_label(code) for code in written], tokens)
+
+        ai.save_dataset(os.path.join(self.tmp, 'dataset'))
+        loaded = MusicAI()
+        loaded.load_dataset(os.path.join(self.tmp, 'dataset'))
+        self.assertEqual(loaded.token_scheme, 'events')
+
+    def test_sample_data_as_events(self):
+        """Without MIDI files the sample melodies become event codes"""
+        from ai_music_model import MusicAI, load_config
+        config = load_config()
+        config['model']['token_scheme'] = 'events'
+        ai = MusicAI(config=config)
+        events = ai.extract_notes_from_midi(os.path.join(self.tmp, 'missing'))
+        self.assertGreater(len(events), 0)
+        self.assertEqual(ai.notes, [])
+
+    def test_unknown_scheme(self):
+        from ai_music_model import MusicAI, load_config
+        config = load_config()
+        config['model']['token_scheme'] = 'piano_roll'
+        with self.assertRaises(ValueError):
+            MusicAI(config=config)
+
+
+class TestTranspositionAugmentation(unittest.TestCase):
+    """Tests for on-the-fly transposition of training windows"""
+
+    def make_ai(self, token_scheme='notes'):
+        from ai_music_model import MusicAI
+        ai = MusicAI(config={'model': {'preset': 'small', 'input_encoding': 'embedding',
+                                       'token_scheme': token_scheme}})
+        ai.create_sample_training_data()
+        return ai
+
+    def test_transpose_tokens(self):
+        """Notes, chords and events move by semitones; impossible moves return None"""
+        import midi_io
+        self.assertEqual(midi_io.transpose_token('E-4', 1), 'E4')
+        self.assertEqual(midi_io.transpose_token('11.2', 1), '0.3')
+        self.assertEqual(midi_io.transpose_token('C4:1/2', -1), 'B3:1/2')
+        self.assertEqual(midi_io.transpose_token('0.4.7:1', 5), '5.9.0:1')
+        self.assertEqual(midi_io.transpose_token('shift:1', 3), 'shift:1')
+        self.assertIsNone(midi_io.transpose_token('G9', 1))
+        self.assertIsNone(midi_io.transpose_token('D~4', 1))
+
+    def test_vocabulary_and_table(self):
+        """The vocabulary covers every key and the table maps ids between them"""
+        import midi_io
+        plain = self.make_ai()
+        plain.prepare_sequences(12, sparse_labels=True, transpositions=[])
+        self.assertIsNone(plain.transpose_table)
+
+        ai = self.make_ai()
+        ai.prepare_sequences(12, sparse_labels=True, transpositions=[-2, 1])
+        self.assertEqual(ai.transpositions, [0, -2, 1])
+        self.assertIn('C#4', ai.note_to_int)
+        self.assertIn('B-3', ai.note_to_int)
+        # The windows are not multiplied by the number of keys
+        self.assertEqual(ai.network_input.shape, plain.network_input.shape)
+        self.assertEqual(ai.transpose_table.shape, (3, ai.n_vocab))
+        for row, semitones in enumerate(ai.transpositions):
+            for token in set(ai.encoded_notes.tolist()):
+                expected = midi_io.transpose_token(ai.int_to_note[token], semitones)
+                self.assertEqual(ai.int_to_note[int(ai.transpose_table[row, token])], expected)
+
+    def test_dataset_windows_are_transposed(self):
+        """Each streamed window and its target move together into one key"""
+        ai = self.make_ai()
+        ai.prepare_sequences(12, sparse_labels=True, transpositions=[-1, 1, 2, 3])
+        train_dataset, validation_dataset = ai.make_dataset(batch_size=32, shuffle_buffer=0,
+                                                            validation_split=0.25)
+        shifted = 0
+        for batch, (inputs, targets) in enumerate(train_dataset.take(3)):
+            for i, (window, target) in enumerate(zip(inputs.numpy(), targets.numpy())):
+                start = batch * 32 + i
+                original = ai.encoded_notes[start:start + 13]
+                rows = [row for row in range(len(ai.transpositions))
+                        if np.array_equal(ai.transpose_table[row][original], np.append(window, target))]
+                self.assertTrue(rows)
+                shifted += 0 not in rows
+        self.assertGreater(shifted, 0)
+        inputs, _ = next(iter(validation_dataset))
+        n_train = len(ai.network_input) - int(len(ai.network_input) * 0.25)
+        np.testing.assert_array_equal(inputs.numpy(), ai.network_input[n_train:n_train + len(inputs)])
+
+    def test_events_and_dataset_round_trip(self):
+        """Event vocabularies are extended too and saved datasets keep the table"""
+        from ai_music_model import MusicAI
+        ai = self.make_ai('events')
+        ai.prepare_sequences(12, sparse_labels=True, transpositions=[2])
+        self.assertIn('D4:1', ai.note_to_int)
+        self.assertIn('E4:1', ai.note_to_int)
+        tmp = tempfile.mkdtemp()
+        try:
+            ai.save_dataset(tmp)
+            loaded = MusicAI(config={})
+            loaded.load_dataset(tmp)
+            self.assertEqual(loaded.transpositions, [0, 2])
+            np.testing.assert_array_equal(loaded.transpose_table, ai.transpose_table)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_bundle_keeps_transpositions(self):
+        """A model bundle loaded without its dataset rebuilds the table"""
+        from ai_music_model import MusicAI
+        ai = self.make_ai()
+        ai.prepare_sequences(12, sparse_labels=True, transpositions=[-1, 2])
+        ai.create_model(12)
+        tmp = tempfile.mkdtemp()
+        try:
+            ai.save_model(tmp)
+            loaded = MusicAI(config={})
+            loaded.load_model(tmp)
+            self.assertEqual(loaded.transpositions, [0, -1, 2])
+            np.testing.assert_array_equal(loaded.transpose_table, ai.transpose_table)
+        finally:
+            shutil.rmtree(tmp)
+
+
+class TestVocabularyPruning(unittest.TestCase):
+    """Tests for the frequency-pruned vocabulary"""
+
+    def test_build_vocabulary(self):
+        """Rare chords go to the nearest kept chord, notes move by octaves, the rest to UNK"""
+        from ai_music_model import build_vocabulary
+        from midi_io import UNKNOWN_TOKEN
+        counts = {'C4': 50, 'E4': 40, '0.4.7': 30, '2.5.9': 20, 'C6': 2, '0.3.7': 1, '1.6': 1, 'F#3': 1}
+        vocabulary, replacements, stats = build_vocabulary(counts, min_count=3)
+        self.assertEqual(vocabulary, ['C4', 'E4', '0.4.7', '2.5.9', UNKNOWN_TOKEN])
+        self.assertEqual(replacements, {'C6': 'C4', '0.3.7': '0.4.7', '1.6': UNKNOWN_TOKEN,
+                                        'F#3': UNKNOWN_TOKEN})
+        self.assertEqual(stats['tokens'], 145)
+        self.assertEqual(stats['distinct_tokens'], 8)
+        self.assertEqual(stats['pruned_tokens'], 4)
+        self.assertAlmostEqual(stats['coverage'], 140 / 145)
+        self.assertAlmostEqual(stats['mapped_fraction'], 3 / 145)
+        self.assertAlmostEqual(stats['unknown_fraction'], 2 / 145)
+
+        vocabulary, replacements, _ = build_vocabulary(counts, max_size=2)
+        self.assertEqual(vocabulary[:2], ['C4', 'E4'])
+        self.assertEqual(replacements['C6'], 'C4')
+        self.assertEqual(replacements['0.4.7'], UNKNOWN_TOKEN)
+        self.assertEqual(build_vocabulary(counts)[1], {})
+
+    def test_event_neighbours_keep_duration(self):
+        """Event tokens only map to neighbours of the same duration"""
+        from ai_music_model import nearest_token
+        candidates = ['0.4.7:1/2', '0.4.7:1', 'C4:1', 'shift:1', 'shift:2']
+        self.assertEqual(nearest_token('0.3.7:1', candidates), '0.4.7:1')
+        self.assertEqual(nearest_token('C5:1', candidates), 'C4:1')
+        self.assertIsNone(nearest_token('C5:2', candidates))
+        self.assertEqual(nearest_token('shift:3/2', candidates), 'shift:1')
+
+    def test_pruned_training_data(self):
+        """The output layer shrinks and generated unknown tokens are skipped on write"""
+        import io
+        from ai_music_model import MusicAI
+        from midi_io import UNKNOWN_TOKEN
+        ai = MusicAI(config={'model': {'preset': 'small'}, 'vocabulary': {'max_size': 4}})
+        ai.create_sample_training_data()
+        ai.notes.extend(['0.4.7', '1.5.8', 'G#7'])
+        ai.prepare_sequences(12, sparse_labels=True)
+        self.assertLessEqual(ai.n_vocab, 5)
+        self.assertEqual(ai.vocabulary_stats['vocabulary_size'], ai.n_vocab)
+        self.assertIn(UNKNOWN_TOKEN, ai.note_to_int)
+        self.assertEqual(ai.int_to_note[int(ai.encoded_notes[-1])], UNKNOWN_TOKEN)
+        ai.create_model(12)
+        self.assertEqual(ai.model.output_shape[-1], ai.n_vocab)
+
+        with_unknown, without = io.BytesIO(), io.BytesIO()
+        ai.create_midi_from_notes(['C4', UNKNOWN_TOKEN, 'E4'], with_unknown, fast=True)
+        ai.create_midi_from_notes(['C4', 'E4'], without, fast=True)
+        self.assertEqual(with_unknown.getvalue(), without.getvalue())
+
+    def test_pruned_events(self):
+        """Pruned event corpora encode the unknown token as code 0"""
+        import midi_io
+        from ai_music_model import MusicAI
+        ai = MusicAI(config={'model': {'token_scheme': 'events'}, 'vocabulary': {'min_count': 5}})
+        ai.create_sample_training_data()
+        ai.events = np.append(ai.events, midi_io.parse_event_label('1.5.8:1/12'))
+        ai.prepare_sequences(12, sparse_labels=True)
+        self.assertEqual(ai.int_to_note[0], midi_io.UNKNOWN_TOKEN)
+        self.assertEqual(int(ai.encoded_notes[-1]), 0)
+        self.assertEqual(midi_io.elements_from_events([0]), [])
+
+
+class TestIncrementalUpdates(unittest.TestCase):
+    """Tests for ingesting new files and fine-tuning in place"""
+
+    def setUp(self):
+        import midi_io
+        from ai_music_model import MusicAI
+        self.tmp = tempfile.mkdtemp()
+        melody = ['C4', 'D4', 'E4', 'F4', 'G4', '0.4.7', 'E4', 'D4']
+        for i in range(3):
+            midi_io.write_midi(melody * 5, os.path.join(self.tmp, f'old{i}.mid'))
+        self.ai = MusicAI(config={'model': {'preset': 'small', 'input_encoding': 'embedding'},
+                                  'training': {'validation_split': 0.0}})
+        self.ai.extract_notes_from_midi(self.tmp)
+        self.ai.prepare_sequences(8, sparse_labels=True)
+        self.ai.create_model(8)
+        self.ai.train(epochs=1, batch_size=32)
+        self.old_vocab = dict(self.ai.note_to_int)
+        self.old_length = len(self.ai.encoded_notes)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def add_file(self, tokens):
+        """Write a new file and return the tokens it parses to"""
+        import midi_io
+        from ai_music_model import parse_midi_notes
+        path = os.path.join(self.tmp, 'new.mid')
+        midi_io.write_midi(tokens, path)
+        return parse_midi_notes(path)
+
+    def test_update_parses_only_new_files(self):
+        """Only the new file is parsed and new tokens are appended to the vocabulary"""
+        tokens = self.add_file(['C4', 'A4', 'B4', '2.5.9'] * 10)
+        self.ai.metrics.reset()
+        self.assertEqual(self.ai.update_corpus(self.tmp), len(tokens))
+        self.assertEqual(self.ai.metrics.counters['files_parsed'], 1)
+        self.assertEqual(len(self.ai.encoded_notes), self.old_length + len(tokens))
+        self.assertEqual(self.ai.note_sources[-1][1], self.old_length)
+        for token, number in self.old_vocab.items():
+            self.assertEqual(self.ai.note_to_int[token], number)
+        self.assertEqual(self.ai.n_vocab, len(set(self.old_vocab) | set(tokens)))
+        self.assertEqual([self.ai.int_to_note[int(n)] for n in self.ai.encoded_notes[self.old_length:]], tokens)
+        self.assertEqual(self.ai.update_corpus(self.tmp), 0)
+
+    def test_bundle_remembers_sources(self):
+        """A bundle saved without its dataset still knows which files it was trained on"""
+        from ai_music_model import MusicAI
+        bundle_dir = os.path.join(self.tmp, 'bundle')
+        self.ai.save_model(bundle_dir)
+        tokens = self.add_file(['C4', 'A4', 'B4'] * 10)
+        loaded = MusicAI(config=self.ai.config)
+        loaded.load_model(bundle_dir)
+        self.assertEqual(len(loaded.note_sources), 3)
+        self.assertEqual(loaded.update_corpus(self.tmp), len(tokens))
+        self.assertEqual(loaded.metrics.counters['files_parsed'], 1)
+        self.assertEqual(len(loaded.encoded_notes), len(tokens))
+
+    def test_fine_tune_too_few_notes_changes_nothing(self):
+        """A new file too short for one window is rejected and stays new"""
+        from ai_music_model import MusicAI
+        bundle_dir = os.path.join(self.tmp, 'bundle')
+        self.ai.save_model(bundle_dir)
+        loaded = MusicAI(config=self.ai.config)
+        loaded.load_model(bundle_dir)
+        self.add_file(['A4', 'B4', '2.5.9'])
+        with self.assertRaises(ValueError):
+            loaded.fine_tune(self.tmp, epochs=1)
+        self.assertEqual(loaded.n_vocab, len(self.old_vocab))
+        self.assertEqual(loaded.note_to_int, self.old_vocab)
+        self.assertEqual(len(loaded.note_sources), 3)
+        self.assertEqual(len(loaded.encoded_notes), 0)
+        self.assertEqual(loaded.model.output_shape[-1], len(self.old_vocab))
+        tokens = self.add_file(['A4', 'B4', '2.5.9'] * 5)
+        self.assertEqual(loaded.fine_tune(self.tmp, epochs=1), len(tokens))
+
+    def test_grow_keeps_trained_weights(self):
+        """Growing the output layer keeps the old columns and Embedding rows"""
+        old_embedding = self.ai.model.layers[0].get_weights()[0]
+        old_kernel, old_bias = self.ai.model.layers[-1].get_weights()
+        self.add_file(['A4', 'B4'] * 10)
+        self.ai.update_corpus(self.tmp)
+        self.ai._grow_model()
+        self.assertEqual(self.ai.model.output_shape[-1], self.ai.n_vocab)
+        embedding = self.ai.model.layers[0].get_weights()[0]
+        kernel, bias = self.ai.model.layers[-1].get_weights()
+        np.testing.assert_array_equal(embedding[:len(old_embedding)], old_embedding)
+        np.testing.assert_array_equal(kernel[:, :len(old_bias)], old_kernel)
+        np.testing.assert_array_equal(bias[:len(old_bias)], old_bias)
+        np.testing.assert_array_equal(bias[len(old_bias):], old_bias.min())
+
+    def test_grow_scalar_model_keeps_predictions(self):
+        """Scalar inputs keep their original scale, so old windows predict as before"""
+        from ai_music_model import MusicAI
+        ai = MusicAI(config={'model': {'preset': 'small', 'input_encoding': 'scalar'},
+                             'training': {'validation_split': 0.0}})
+        ai.extract_notes_from_midi(self.tmp)
+        ai.prepare_sequences(8, sparse_labels=True)
+        ai.create_model(8)
+        ai.train(epochs=1, batch_size=32)
+        old_vocab = ai.n_vocab
+        old_inputs = np.array(ai.network_input, dtype=np.float32)
+        before = ai.model(old_inputs, training=False).numpy()
+        self.add_file(['A4', 'B4', 'C5', '2.5.9'] * 10)
+        ai.update_corpus(self.tmp)
+        ai._grow_model()
+        self.assertGreater(ai.n_vocab, old_vocab)
+        self.assertEqual(ai.input_scale, old_vocab)
+        ai._build_windows(8, sparse_labels=True)
+        np.testing.assert_allclose(ai.network_input[:len(old_inputs)], old_inputs, rtol=1e-6)
+        after = ai.model(old_inputs, training=False).numpy()
+        np.testing.assert_array_equal(after[:, :old_vocab].argmax(axis=1), before.argmax(axis=1))
+
+        bundle_dir = os.path.join(self.tmp, 'bundle')
+        ai.save_model(bundle_dir, include_dataset=True)
+        loaded = MusicAI(config={})
+        loaded.load_model(bundle_dir, load_dataset=True)
+        self.assertEqual(loaded.input_scale, old_vocab)
+        np.testing.assert_allclose(loaded._encode_inputs([[old_vocab + 1]]).ravel(),
+                                   [(old_vocab + 1) / old_vocab], rtol=1e-6)
+
+    def test_fine_tune_on_new_windows(self):
+        """Fine-tuning trains only on windows whose targets are new"""
+        self.assertEqual(self.ai.fine_tune(self.tmp, epochs=1), 0)
+        tokens = self.add_file(['A4', 'B4', 'C5'] * 10)
+        self.assertEqual(self.ai.fine_tune(self.tmp, epochs=1, learning_rate=0.0001), len(tokens))
+        self.assertEqual(self.ai.model.output_shape[-1], len(set(self.old_vocab) | set(tokens)))
+        self.assertEqual(len(self.ai.network_input), len(tokens))
+        self.assertEqual(self.ai.window_start, self.old_length - 8)
+        self.assertAlmostEqual(float(self.ai.model.optimizer.learning_rate.numpy()), 0.0001, places=6)
+        inputs, targets = next(iter(self.ai.make_dataset(batch_size=4, shuffle_buffer=0)[0]))
+        np.testing.assert_array_equal(inputs.numpy(), self.ai.network_input[:4])
+        self.assertEqual(len(self.ai.generate_notes(length=3, start=0)), 3)
+
+
+class TestCommandLine(unittest.TestCase):
+    """Tests for the headless command-line entry point"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run ingest, prepare and train on a small synthetic corpus"""
+        import contextlib
+        import io
+        from ai_music_model import MODEL_PRESETS, load_config
+        from benchmark_music import make_synthetic_corpus
+        from music_cli import main
+        cls.tmp = tempfile.mkdtemp()
+        config = load_config()
+        config['model'] = {key: value for key, value in config['model'].items()
+                           if key not in MODEL_PRESETS['small']}
+        config['model']['preset'] = 'small'
+        config['training']['checkpoint']['enabled'] = False
+        config['training']['validation_split'] = 0.0
+        cls.config_path = os.path.join(cls.tmp, 'config.json')
+        with open(cls.config_path, 'w') as f:
+            json.dump(config, f)
+        cls.midi_dir = os.path.join(cls.tmp, 'midi')
+        make_synthetic_corpus(cls.midi_dir, 3, 60, seed=5)
+        cls.output = io.StringIO()
+        common = ['--midi-dir', cls.midi_dir, '--cache-dir', os.path.join(cls.tmp, 'cache')]
+        with contextlib.redirect_stdout(cls.output):
+            main(['--config', cls.config_path, 'ingest'] + common)
+            main(['--config', cls.config_path, 'prepare', '--sequence-length', '8',
+                  '--dataset-dir', os.path.join(cls.tmp, 'dataset')] + common)
+            main(['--config', cls.config_path, 'train', '--sequence-length', '8', '--epochs', '1',
+                  '--dataset-dir', os.path.join(cls.tmp, 'dataset'),
+                  '--bundle-dir', os.path.join(cls.tmp, 'bundle')])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def run_cli(self, *argv):
+        import contextlib
+        import io
+        from music_cli import main
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result = main(['--config', self.config_path] + list(argv))
+        return result, output.getvalue()
+
+    def test_pipeline_artifacts(self):
+        """Ingest fills the cache, prepare writes the dataset and train the bundle"""
+        log = self.output.getvalue()
+        self.assertIn('Ingested 3 files', log)
+        self.assertIn('Dataset', log)
+        self.assertTrue(os.listdir(os.path.join(self.tmp, 'cache')))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'dataset', 'tokens.npy')))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'bundle', 'model.keras')))
+        _, output = self.run_cli('prepare', '--update', '--midi-dir', self.midi_dir,
+                                 '--dataset-dir', os.path.join(self.tmp, 'dataset'))
+        self.assertIn('Added 0 tokens', output)
+
+    def test_generate_job(self):
+        """The job mode writes one MIDI file per piece and summarizes throughput"""
+        out_dir = os.path.join(self.tmp, 'pieces')
+        summary, output = self.run_cli('generate', '--bundle-dir', os.path.join(self.tmp, 'bundle'),
+                                       '--output-dir', out_dir, '--count', '3', '--workers', '2',
+                                       '--length', '6', '--seed', '1', '--stateful')
+        self.assertEqual(summary['pieces'], 3)
+        self.assertEqual(summary['workers'], 2)
+        self.assertEqual(summary['notes'], 18)
+        self.assertEqual(sorted(os.listdir(out_dir)), ['piece_0000.mid', 'piece_0001.mid', 'piece_0002.mid'])
+        self.assertGreater(summary['notes_per_second'], 0)
+        self.assertIn('Generated 3 pieces', output)
+
+    def test_seeded_pieces_repeat(self):
+        """A seeded single-process run is reproducible"""
+        first, _ = self.run_cli('generate', '--bundle-dir', os.path.join(self.tmp, 'bundle'),
+                                '--output-dir', os.path.join(self.tmp, 'a'), '--length', '6', '--seed', '3',
+                                '--temperature', '1.0')
+        second, _ = self.run_cli('generate', '--bundle-dir', os.path.join(self.tmp, 'bundle'),
+                                 '--output-dir', os.path.join(self.tmp, 'b'), '--length', '6', '--seed', '3',
+                                 '--temperature', '1.0')
+        with open(first['files'][0], 'rb') as a, open(second['files'][0], 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_non_positive_counts_are_rejected(self):
+        """--count, --length and --workers must be at least 1"""
+        import contextlib
+        import io
+        for option in ('--count', '--length', '--workers'):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                self.run_cli('generate', '--bundle-dir', os.path.join(self.tmp, 'bundle'), option, '0')
+
+
 if __name__ == "__main__":
     unittest.main()